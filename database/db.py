@@ -1,56 +1,337 @@
 import sqlite3
 import os
+import re
+import sys
+import threading
+import time
 from datetime import datetime
+from database.migrations import migrate
+
+# Путь к базе и параметры пула берутся из окружения
+DB_PATH = os.getenv('DB_PATH', 'database/history.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '30'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', str(16 * 1024)))
+DB_CACHED_STATEMENTS = int(os.getenv('DB_CACHED_STATEMENTS', '256'))
+# Число файлов-шардов; пользователь всегда попадает в один и тот же шард
+DB_SHARDS = int(os.getenv('DB_SHARDS', '1'))
 
 # Create database directory if it doesn't exist
-os.makedirs('database', exist_ok=True)
+os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+
+def connect(path: str = None) -> sqlite3.Connection:
+    """Opens a new connection with tuned pragmas."""
+    # Соединения переходят между потоками пула, но используются строго одним потоком за раз
+    # busy timeout покрывает длинные записи, например массовый импорт
+    conn = sqlite3.connect(path or DB_PATH, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=DB_CACHED_STATEMENTS)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+# Наблюдатель за выполнением запросов (используется метриками), по умолчанию выключен
+_statement_observer = None
+_statement_sampler = None
+_statement_labels = {}
+_STATEMENT_RE = re.compile(r'^\s*(?:(UPDATE)\s+(\w+)|(SELECT|INSERT|DELETE|WITH)\b.*?\b(?:FROM|INTO)\s+(\w+))',
+                           re.IGNORECASE | re.DOTALL)
+
+def set_statement_observer(observer, sampler=None) -> None:
+    """Sets observer(caller, statement, seconds, rows) called for sampled SQL statements.
+
+    seconds is None when the call only reports rows fetched after execution.
+    """
+    global _statement_observer, _statement_sampler
+    _statement_observer = observer
+    _statement_sampler = sampler
+
+def _statement_label(sql: str) -> str:
+    label = _statement_labels.get(sql)
+    if label is None:
+        match = _STATEMENT_RE.match(sql)
+        if match:
+            verb, table = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+            label = f"{verb.lower()} {table}"
+        else:
+            label = sql.split(None, 1)[0].lower()
+        _statement_labels[sql] = label
+    return label
+
+
+class TimedCursor:
+    """Курсор, который сообщает наблюдателю время выполнения и число строк каждого запроса."""
+
+    def __init__(self, cursor: sqlite3.Cursor, observer):
+        self._cursor = cursor
+        self._observer = observer
+        self._label = None
+        self._caller = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _run(self, method, sql, params):
+        self._label = _statement_label(sql)
+        self._caller = sys._getframe(2).f_code.co_name
+        started = time.perf_counter()
+        method(sql, params)
+        elapsed = time.perf_counter() - started
+        self._observer(self._caller, self._label, elapsed, max(self._cursor.rowcount, 0))
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(self._cursor.executemany, sql, seq_of_params)
+
+    def _count_rows(self, rows):
+        # Время выполнения уже учтено в execute, здесь добавляем только прочитанные строки
+        if self._label is not None and rows:
+            self._observer(self._caller, self._label, None, len(rows))
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count_rows([row])
+        return row
+
+    def fetchmany(self, size=None):
+        return self._count_rows(self._cursor.fetchmany(size) if size else self._cursor.fetchmany())
+
+    def fetchall(self):
+        return self._count_rows(self._cursor.fetchall())
+
+
+class PooledConnection:
+    """Соединение, взятое из пула. close() возвращает его обратно в пул."""
+
+    def __init__(self, pool: 'ConnectionPool', conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self):
+        cursor = self._conn.cursor()
+        observer = _statement_observer
+        if observer is not None and (_statement_sampler is None or _statement_sampler()):
+            return TimedCursor(cursor, observer)
+        return cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._conn.rollback()
+        self.close()
+        return False
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    """Пул постоянных соединений с привязкой к потокам.
+
+    Поток в первую очередь получает соединение, которым пользовался в прошлый раз,
+    поэтому кэш подготовленных выражений и страниц остается "теплым".
+    """
+
+    def __init__(self, path: str = None, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.path = path or DB_PATH
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._all = []
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'acquired': 0,
+            'reused_affine': 0,
+            'reused_other': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+        }
+
+    def acquire(self) -> PooledConnection:
+        with self._cond:
+            self._stats['acquired'] += 1
+            conn = self._take_idle()
+            if conn is None and len(self._all) < self.size:
+                conn = connect(self.path)
+                self._all.append(conn)
+                self._stats['created'] += 1
+            if conn is None:
+                started = time.perf_counter()
+                self._stats['waits'] += 1
+                deadline = started + self.timeout
+                while conn is None:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise TimeoutError("Timed out waiting for a database connection")
+                    self._cond.wait(remaining)
+                    conn = self._take_idle()
+                self._stats['wait_time'] += time.perf_counter() - started
+        self._local.conn = conn
+        return PooledConnection(self, conn)
+
+    def _take_idle(self):
+        if not self._idle:
+            return None
+        preferred = getattr(self._local, 'conn', None)
+        if preferred is not None and preferred in self._idle:
+            self._idle.remove(preferred)
+            self._stats['reused_affine'] += 1
+            return preferred
+        self._stats['reused_other'] += 1
+        return self._idle.pop()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        """Возвращает статистику использования пула."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = len(self._all)
+            stats['idle'] = len(self._idle)
+        return stats
+
+    def close(self) -> None:
+        with self._cond:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+            self._idle.clear()
+
+
+def shard_path(path: str, index: int) -> str:
+    """Файл шарда: нулевой - сам path, остальные рядом (history.1.db, history.2.db, ...)."""
+    if index == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{index}{ext}"
+
+def shard_index(user_id: int, shards: int) -> int:
+    """Номер шарда пользователя: jump consistent hash от user_id.
+
+    При добавлении шарда переезжает только 1/(shards + 1) пользователей,
+    поэтому перешардирование копирует минимум данных.
+    """
+    key = user_id & 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < shards:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+class ShardedPool:
+    """Пулы соединений по одному на файл-шард.
+
+    Данные пользователя целиком лежат в его шарде, поэтому записи разных
+    пользователей берут блокировки разных файлов и идут параллельно.
+    Шард 0 - основной файл, в нем же хранятся общие данные (каталог семей).
+    """
+
+    def __init__(self, path: str = None, size: int = DB_POOL_SIZE, shards: int = DB_SHARDS,
+                 timeout: float = DB_POOL_TIMEOUT):
+        self.path = path or DB_PATH
+        self.pools = [ConnectionPool(shard_path(self.path, index), size, timeout) for index in range(shards)]
+
+    @property
+    def shards(self) -> int:
+        return len(self.pools)
+
+    def shard_for(self, user_id: int) -> int:
+        return shard_index(user_id, len(self.pools))
+
+    def acquire(self, user_id: int = None) -> PooledConnection:
+        """Соединение с шардом пользователя; без user_id - с шардом 0."""
+        return self.pools[0 if user_id is None else self.shard_for(user_id)].acquire()
+
+    def acquire_shard(self, index: int) -> PooledConnection:
+        return self.pools[index].acquire()
+
+    def stats(self) -> dict:
+        """Статистика всех пулов, просуммированная по шардам."""
+        stats = {'shards': len(self.pools)}
+        for pool in self.pools:
+            for key, value in pool.stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def close(self) -> None:
+        for pool in self.pools:
+            pool.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ShardedPool:
+    """Returns the process-wide connection pool."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ShardedPool()
+    return _pool
+
+def configure_pool(path: str = None, size: int = DB_POOL_SIZE, shards: int = None) -> ShardedPool:
+    """Replaces the process-wide pool, e.g. to point tools at another database file."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ShardedPool(path, size, shards or DB_SHARDS)
+    return _pool
+
+def get_db_connection(user_id: int = None) -> PooledConnection:
+    """Takes a connection to the user's shard (shard 0 without user_id); close() returns it back."""
+    return get_pool().acquire(user_id)
+
+def get_shard_connection(index: int) -> PooledConnection:
+    """Takes a connection to the given shard, for queries over all users."""
+    return get_pool().acquire_shard(index)
+
+def shard_count() -> int:
+    return get_pool().shards
+
+def shard_indexes(user_id: int = None) -> list:
+    """Шарды, которые нужно обойти: шард пользователя или, без user_id, все."""
+    if user_id is not None:
+        return [get_pool().shard_for(user_id)]
+    return list(range(shard_count()))
 
-def get_db_connection():
-    """Creates a connection to the database."""
-    return sqlite3.connect('database/history.db')
+def get_pool_stats() -> dict:
+    """Returns connection pool usage statistics."""
+    return get_pool().stats()
 
 def init_db():
-    """Initializes the database and creates tables."""
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    # Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (user_id INTEGER PRIMARY KEY,
-                 name TEXT,
-                 budget_type TEXT,
-                 family_id INTEGER)''')
-
-    # Transactions table
-    c.execute('''CREATE TABLE IF NOT EXISTS transactions
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 user_id INTEGER, 
-                 type TEXT, 
-                 amount REAL, 
-                 category TEXT,
-                 description TEXT,
-                 date TEXT)''')
-
-    # Income categories table
-    c.execute('''CREATE TABLE IF NOT EXISTS income_categories
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 user_id INTEGER,
-                 name TEXT)''')
-
-    # Expense categories table
-    c.execute('''CREATE TABLE IF NOT EXISTS expense_categories
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 user_id INTEGER,
-                 name TEXT)''')
-
-    # Monthly statistics table
-    c.execute('''CREATE TABLE IF NOT EXISTS monthly_stats
-                 (user_id INTEGER,
-                 year INTEGER,
-                 month INTEGER,
-                 total_income REAL,
-                 total_expense REAL,
-                 PRIMARY KEY (user_id, year, month))''')
-
-    conn.commit()
-    conn.close() 
\ No newline at end of file
+    """Initializes every shard and applies pending schema migrations."""
+    for index in range(shard_count()):
+        with get_shard_connection(index) as conn:
+            migrate(conn)
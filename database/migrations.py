@@ -0,0 +1,332 @@
+import sqlite3
+
+# Миграции схемы. Номер версии хранится в PRAGMA user_version.
+# Каждый шаг - SQL-строка или функция от курсора; шаги одной версии
+# выполняются в одной транзакции. Список только дополняется, уже
+# выпущенные версии не редактируются.
+
+def _dedupe_categories(c):
+    # Перед добавлением уникального индекса удаляем дубликаты категорий
+    for table in ('income_categories', 'expense_categories'):
+        c.execute(f"""DELETE FROM {table}
+                      WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY user_id, name)""")
+
+def _add_column(table, column, declaration):
+    """Шаг миграции: добавляет колонку, если ее еще нет."""
+    def step(c):
+        columns = [row[1] for row in c.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return step
+
+def _rebuild_table(table, columns, select):
+    """Шаг миграции: пересоздает таблицу с новым описанием колонок.
+
+    SQLite не меняет тип существующей колонки, поэтому данные копируются
+    в новую таблицу выражением select, а индексы создаются заново.
+    """
+    def step(c):
+        indexes = [row[0] for row in c.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))]
+        c.execute(f"CREATE TABLE {table}_new ({columns})")
+        c.execute(f"INSERT INTO {table}_new SELECT {select} FROM {table}")
+        c.execute(f"DROP TABLE {table}")
+        c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for sql in indexes:
+            c.execute(sql)
+    return step
+
+MIGRATIONS = [
+    (1, 'initial schema', [
+        '''CREATE TABLE IF NOT EXISTS users
+           (user_id INTEGER PRIMARY KEY,
+           name TEXT,
+           budget_type TEXT,
+           family_id INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS transactions
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           type TEXT,
+           amount REAL,
+           category TEXT,
+           description TEXT,
+           date TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS income_categories
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           name TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS expense_categories
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           name TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS monthly_stats
+           (user_id INTEGER,
+           year INTEGER,
+           month INTEGER,
+           total_income REAL,
+           total_expense REAL,
+           PRIMARY KEY (user_id, year, month))''',
+    ]),
+    (2, 'covering indexes for hot queries', [
+        # get_balance, clear_transactions
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_type_date
+           ON transactions (user_id, type, date, category, amount)''',
+        # get_transactions_by_category
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_category_type
+           ON transactions (user_id, category, type)''',
+        # get_categories, delete_category; одна категория с одним именем на пользователя
+        _dedupe_categories,
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_income_categories_user_name
+           ON income_categories (user_id, name)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_expense_categories_user_name
+           ON expense_categories (user_id, name)''',
+    ]),
+    (3, 'indexed year_month for transactions', [
+        # Месяц транзакции в виде YYYYMM, чтобы фильтр по периоду шел по индексу
+        _add_column('transactions', 'year_month', 'INTEGER'),
+        """UPDATE transactions
+           SET year_month = CAST(strftime('%Y%m', date) AS INTEGER)
+           WHERE year_month IS NULL""",
+        # get_category_stats
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_month
+           ON transactions (user_id, year_month, type, category, amount)''',
+    ]),
+    (4, 'running per-user balances', [
+        # get_balance читает одну строку по первичному ключу
+        '''CREATE TABLE IF NOT EXISTS user_balances
+           (user_id INTEGER PRIMARY KEY,
+           total_income REAL NOT NULL DEFAULT 0,
+           total_expense REAL NOT NULL DEFAULT 0)''',
+        """INSERT OR REPLACE INTO user_balances (user_id, total_income, total_expense)
+           SELECT user_id,
+                  TOTAL(CASE WHEN type = 'income' THEN amount END),
+                  TOTAL(CASE WHEN type = 'expense' THEN amount END)
+           FROM transactions
+           GROUP BY user_id""",
+    ]),
+    (5, 'chronological index for history reads', [
+        # iter_transactions: история пользователя по порядку (date, id) без сортировки в памяти
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_date
+           ON transactions (user_id, date)''',
+    ]),
+    (6, 'index for filtered history pages', [
+        # get_transactions_page с фильтром по категории: ключ (date, id) идет по порядку индекса
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_type_category_date
+           ON transactions (user_id, type, category, date)''',
+    ]),
+    (7, 'day/month/year rollups by category', [
+        # period: YYYYMMDD - день, YYYYMM - месяц, YYYY - год (см. services/rollups.py);
+        # category '' - операции без категории
+        '''CREATE TABLE IF NOT EXISTS category_rollups
+           (user_id INTEGER NOT NULL,
+           period INTEGER NOT NULL,
+           type TEXT NOT NULL,
+           category TEXT NOT NULL,
+           total REAL NOT NULL DEFAULT 0,
+           count INTEGER NOT NULL DEFAULT 0,
+           PRIMARY KEY (user_id, period, type, category)) WITHOUT ROWID''',
+        """INSERT OR REPLACE INTO category_rollups (user_id, period, type, category, total, count)
+           SELECT user_id, year_month * 100 + CAST(substr(date, 9, 2) AS INTEGER),
+                  type, COALESCE(category, ''), TOTAL(amount), COUNT(*)
+           FROM transactions
+           GROUP BY 1, 2, 3, 4""",
+        """INSERT OR REPLACE INTO category_rollups (user_id, period, type, category, total, count)
+           SELECT user_id, period / 100, type, category, SUM(total), SUM(count)
+           FROM category_rollups
+           WHERE period >= 10000000
+           GROUP BY 1, 2, 3, 4""",
+        """INSERT OR REPLACE INTO category_rollups (user_id, period, type, category, total, count)
+           SELECT user_id, period / 100, type, category, SUM(total), SUM(count)
+           FROM category_rollups
+           WHERE period BETWEEN 100000 AND 999999
+           GROUP BY 1, 2, 3, 4""",
+    ]),
+    (8, 'family budgets', [
+        '''CREATE TABLE IF NOT EXISTS families
+           (family_id INTEGER PRIMARY KEY AUTOINCREMENT,
+           invite_code TEXT NOT NULL UNIQUE,
+           owner_id INTEGER NOT NULL)''',
+        # Участники семьи и состав семьи для агрегатов по категориям
+        '''CREATE INDEX IF NOT EXISTS idx_users_family
+           ON users (family_id)''',
+        # Суммы по всем участникам, обновляются вместе с user_balances и monthly_stats
+        '''CREATE TABLE IF NOT EXISTS family_balances
+           (family_id INTEGER PRIMARY KEY,
+           total_income REAL NOT NULL DEFAULT 0,
+           total_expense REAL NOT NULL DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS family_monthly_stats
+           (family_id INTEGER,
+           year INTEGER,
+           month INTEGER,
+           total_income REAL NOT NULL DEFAULT 0,
+           total_expense REAL NOT NULL DEFAULT 0,
+           PRIMARY KEY (family_id, year, month))''',
+    ]),
+    (9, 'integer amounts in kopecks', [
+        # Суммы хранятся целыми копейками: агрегаты складываются точно
+        _rebuild_table('transactions',
+                       """id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       user_id INTEGER,
+                       type TEXT,
+                       amount INTEGER,
+                       category TEXT,
+                       description TEXT,
+                       date TEXT,
+                       year_month INTEGER""",
+                       """id, user_id, type, CAST(ROUND(amount * 100) AS INTEGER),
+                       category, description, date, year_month"""),
+        # Агрегаты не переводятся, а пересчитываются из транзакций: накопленная
+        # погрешность сумм с плавающей точкой в них не переходит
+        'DROP TABLE monthly_stats',
+        '''CREATE TABLE monthly_stats
+           (user_id INTEGER,
+           year INTEGER,
+           month INTEGER,
+           total_income INTEGER NOT NULL DEFAULT 0,
+           total_expense INTEGER NOT NULL DEFAULT 0,
+           PRIMARY KEY (user_id, year, month))''',
+        """INSERT INTO monthly_stats (user_id, year, month, total_income, total_expense)
+           SELECT user_id, year_month / 100, year_month % 100,
+                  SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+                  SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+           FROM transactions
+           GROUP BY user_id, year_month""",
+        'DROP TABLE user_balances',
+        '''CREATE TABLE user_balances
+           (user_id INTEGER PRIMARY KEY,
+           total_income INTEGER NOT NULL DEFAULT 0,
+           total_expense INTEGER NOT NULL DEFAULT 0)''',
+        """INSERT INTO user_balances (user_id, total_income, total_expense)
+           SELECT user_id, SUM(total_income), SUM(total_expense)
+           FROM monthly_stats
+           GROUP BY user_id""",
+        'DROP TABLE category_rollups',
+        '''CREATE TABLE category_rollups
+           (user_id INTEGER NOT NULL,
+           period INTEGER NOT NULL,
+           type TEXT NOT NULL,
+           category TEXT NOT NULL,
+           total INTEGER NOT NULL DEFAULT 0,
+           count INTEGER NOT NULL DEFAULT 0,
+           PRIMARY KEY (user_id, period, type, category)) WITHOUT ROWID''',
+        """INSERT INTO category_rollups (user_id, period, type, category, total, count)
+           SELECT user_id, year_month * 100 + CAST(substr(date, 9, 2) AS INTEGER),
+                  type, COALESCE(category, ''), SUM(amount), COUNT(*)
+           FROM transactions
+           GROUP BY 1, 2, 3, 4""",
+        """INSERT INTO category_rollups (user_id, period, type, category, total, count)
+           SELECT user_id, period / 100, type, category, SUM(total), SUM(count)
+           FROM category_rollups
+           WHERE period >= 10000000
+           GROUP BY 1, 2, 3, 4""",
+        """INSERT INTO category_rollups (user_id, period, type, category, total, count)
+           SELECT user_id, period / 100, type, category, SUM(total), SUM(count)
+           FROM category_rollups
+           WHERE period BETWEEN 100000 AND 999999
+           GROUP BY 1, 2, 3, 4""",
+        'DROP TABLE family_balances',
+        '''CREATE TABLE family_balances
+           (family_id INTEGER PRIMARY KEY,
+           total_income INTEGER NOT NULL DEFAULT 0,
+           total_expense INTEGER NOT NULL DEFAULT 0)''',
+        """INSERT INTO family_balances (family_id, total_income, total_expense)
+           SELECT u.family_id, SUM(b.total_income), SUM(b.total_expense)
+           FROM users u
+           JOIN user_balances b ON b.user_id = u.user_id
+           WHERE u.family_id IS NOT NULL
+           GROUP BY u.family_id""",
+        'DROP TABLE family_monthly_stats',
+        '''CREATE TABLE family_monthly_stats
+           (family_id INTEGER,
+           year INTEGER,
+           month INTEGER,
+           total_income INTEGER NOT NULL DEFAULT 0,
+           total_expense INTEGER NOT NULL DEFAULT 0,
+           PRIMARY KEY (family_id, year, month))''',
+        """INSERT INTO family_monthly_stats (family_id, year, month, total_income, total_expense)
+           SELECT u.family_id, m.year, m.month, SUM(m.total_income), SUM(m.total_expense)
+           FROM users u
+           JOIN monthly_stats m ON m.user_id = u.user_id
+           WHERE u.family_id IS NOT NULL
+           GROUP BY u.family_id, m.year, m.month""",
+    ]),
+    (10, 'persistent conversations and user_data', [
+        # Состояние диалогов переживает перезапуск бота; загружается по
+        # пользователю при его первом апдейте, поэтому ключ начинается с user_id
+        '''CREATE TABLE IF NOT EXISTS user_data
+           (user_id INTEGER PRIMARY KEY,
+           data BLOB NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS conversations
+           (user_id INTEGER,
+           name TEXT,
+           conversation_key TEXT,
+           state BLOB NOT NULL,
+           PRIMARY KEY (user_id, name, conversation_key)) WITHOUT ROWID''',
+    ]),
+    (11, 'index for incremental analytics reads', [
+        # TransactionAnalytics дочитывает транзакции пользователя после последнего id
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_id
+           ON transactions (user_id, id)''',
+    ]),
+    (12, 'recurring transactions', [
+        # unit 'day' или 'month', каждые count единиц; anchor_day - число месяца
+        # для ежемесячных правил (31 в коротком месяце становится последним днем)
+        '''CREATE TABLE IF NOT EXISTS recurring_rules
+           (rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER NOT NULL,
+           type TEXT NOT NULL,
+           amount INTEGER NOT NULL,
+           category TEXT,
+           description TEXT,
+           unit TEXT NOT NULL,
+           count INTEGER NOT NULL,
+           anchor_day INTEGER,
+           next_due TEXT NOT NULL)''',
+        # Планировщик читает только наступившие правила
+        '''CREATE INDEX IF NOT EXISTS idx_recurring_rules_due
+           ON recurring_rules (next_due)''',
+        '''CREATE INDEX IF NOT EXISTS idx_recurring_rules_user
+           ON recurring_rules (user_id)''',
+    ]),
+    (13, 'index for history pages filtered by category only', [
+        # get_transactions_page с категорией без типа: индекс 6 начинается с type
+        # и здесь не подходит; id (rowid) - последний столбец индекса
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_category_date
+           ON transactions (user_id, category, date)''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции по порядку и возвращает итоговую версию."""
+    current = get_schema_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        # Другой процесс мог применить эту версию, пока мы ждали блокировку
+        if get_schema_version(conn) >= version:
+            conn.rollback()
+            current = get_schema_version(conn)
+            continue
+        try:
+            for step in steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version}: {description}")
+        current = version
+    return current
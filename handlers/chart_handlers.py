@@ -0,0 +1,50 @@
+import asyncio
+from datetime import date
+
+from telegram import Update
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, CommandHandler
+from handlers.stats_handlers import PERIOD_TITLES, period_range
+from services.async_transaction_service import AsyncTransactionService
+from services.charts import chart_cache, chart_version, render_in_pool
+from services.metrics import timed_handler
+
+
+async def show_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/chart [day|week|month|year|365] - расходы по категориям и доходы/расходы по месяцам."""
+    user_id = update.message.from_user.id
+    args = context.args or []
+    period = args[0].lower() if args and args[0].lower() in PERIOD_TITLES else 'month'
+    date_from, date_to = period_range(period, date.today())
+    stats, trend = await asyncio.gather(
+        AsyncTransactionService.get_period_stats(user_id, date_from, date_to),
+        AsyncTransactionService.get_monthly_trend(user_id)
+    )
+
+    title = PERIOD_TITLES[period]
+    expenses = sorted(stats['expense_by_category'].items(), key=lambda item: item[0] or '')
+    months = [(f"{m.month:02d}.{m.year % 100:02d}", m.total_income, m.total_expense) for m in trend]
+    version = chart_version(title, date_from, date_to, expenses, months)
+    caption = f"📈 Расходы {title} и итоги по месяцам\n\nДругие периоды: /chart week, /chart year"
+
+    # Данные не менялись - картинка уже у Telegram, достаточно ее file_id
+    cached = chart_cache.get(user_id, period, version)
+    if cached is not None and cached[1] is not None:
+        try:
+            await update.message.reply_photo(photo=cached[1], caption=caption)
+            return
+        except BadRequest:
+            chart_cache.forget_file_id(user_id, period)
+
+    png = cached[0] if cached is not None else await render_in_pool(title, expenses, months)
+    if png is None:
+        await update.message.reply_text("Графики сейчас недоступны. Статистика: /stats")
+        return
+    message = await update.message.reply_photo(photo=png, caption=caption)
+    chart_cache.put(user_id, period, version, png, message.photo[-1].file_id if message.photo else None)
+
+
+def get_chart_handlers():
+    return [
+        CommandHandler("chart", timed_handler('none', show_chart)),
+    ]
@@ -0,0 +1,67 @@
+import asyncio
+import os
+from typing import IO
+
+from telegram import InputFile, Update
+from telegram.ext import ContextTypes, CommandHandler
+from handlers.keyboards import main_menu_keyboard
+from services.async_transaction_service import AsyncTransactionService
+from services.export import EXPORT_FORMATS
+from services.metrics import timed_handler
+
+# Сколько выгрузок может идти одновременно: остальные потоки БД остаются для обычных запросов
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', '1'))
+# Ограничение Bot API на размер отправляемого ботом файла
+UPLOAD_LIMIT = 50 * 1024 * 1024
+
+_export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+class StreamedInputFile(InputFile):
+    """InputFile, который отдает HTTP-клиенту сам файл, а не его содержимое.
+
+    InputFile читает файловый объект целиком в память; httpx же принимает
+    файл в multipart и читает его частями (перед каждой попыткой отправки
+    перематывая в начало), поэтому выгрузка с диска не копируется в память.
+    """
+
+    def __init__(self, file: IO[bytes], filename: str):
+        super().__init__(b'', filename=filename)
+        self.input_file_content = file
+
+
+async def _send_export(message, user_id: int, fmt: str, compress: bool):
+    async with _export_slots:
+        document, filename, count = await AsyncTransactionService.export_transactions(user_id, fmt, compress)
+    with document:
+        if not count:
+            await message.reply_text("📭 Нет операций для выгрузки.", reply_markup=main_menu_keyboard())
+            return
+        size = document.seek(0, os.SEEK_END)
+        document.seek(0)
+        if size > UPLOAD_LIMIT:
+            await message.reply_text("❌ Файл получился слишком большим для Telegram. Попробуйте /export csv gz",
+                                     reply_markup=main_menu_keyboard())
+            return
+        await message.reply_document(
+            document=StreamedInputFile(document, filename),
+            caption=f"📤 Выгружено операций: {count}",
+            reply_markup=main_menu_keyboard()
+        )
+
+
+async def export_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    args = [arg.lower() for arg in context.args or []]
+    fmt = next((arg for arg in args if arg in EXPORT_FORMATS), 'csv')
+    compress = 'gz' in args or 'gzip' in args
+
+    await update.message.reply_text("⏳ Готовлю выгрузку, файл придет отдельным сообщением...")
+    # Выгрузка идет фоновой задачей, чтобы не задерживать обработку следующих апдейтов
+    context.application.create_task(_send_export(update.message, user_id, fmt, compress), update=update)
+
+
+def get_export_handlers():
+    return [
+        CommandHandler("export", timed_handler('none', export_history)),
+    ]
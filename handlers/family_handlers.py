@@ -0,0 +1,93 @@
+import asyncio
+from datetime import date
+
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from handlers.keyboards import main_menu_keyboard
+from handlers.stats_handlers import format_period_stats
+from models.money import format_amount
+from services.async_transaction_service import AsyncFamilyService
+from services.metrics import timed_handler
+
+FAMILY_HELP = (
+    "👨‍👩‍👧 <b>Семейный бюджет</b>\n\n"
+    "Участники семьи видят общий баланс и статистику.\n\n"
+    "/family create - создать семью\n"
+    "/family join КОД - вступить по коду приглашения\n"
+    "/family leave - выйти из семьи"
+)
+
+
+async def show_family(update: Update, context: ContextTypes.DEFAULT_TYPE, family_id: int):
+    today = date.today()
+    family, balance, monthly, stats = await asyncio.gather(
+        AsyncFamilyService.get_family(family_id),
+        AsyncFamilyService.get_family_balance(family_id),
+        AsyncFamilyService.get_family_monthly_stats(family_id),
+        AsyncFamilyService.get_family_period_stats(family_id, today.replace(day=1), today)
+    )
+    if family is None:
+        # Семью удалили, пока пользователь еще числился в ней: членство снимается
+        await AsyncFamilyService.forget_missing_family(update.message.from_user.id, family_id)
+        await update.message.reply_text(FAMILY_HELP, reply_markup=main_menu_keyboard(), parse_mode="HTML")
+        return
+    # Итоги месяца берутся из family_monthly_stats, разбивка по категориям - из агрегатов участников
+    stats['total_income'] = monthly.total_income
+    stats['total_expense'] = monthly.total_expense
+    message = (
+        "👨‍👩‍👧 <b>Семейный бюджет</b>\n\n"
+        f"Участников: <b>{family.members}</b>\n"
+        f"Код приглашения: <code>{family.invite_code}</code>\n"
+        f"Общий баланс: <b>{format_amount(balance)} руб.</b>\n\n"
+    )
+    message += format_period_stats("семьи за месяц", stats)
+    await update.message.reply_text(message, reply_markup=main_menu_keyboard(), parse_mode="HTML")
+
+
+async def family_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    args = context.args or []
+    action = args[0].lower() if args else ''
+
+    if action == 'create':
+        family = await AsyncFamilyService.create_family(user_id)
+        await update.message.reply_text(
+            f"✅ Семья создана! Код приглашения: <code>{family.invite_code}</code>\n"
+            "Отправьте его участникам, чтобы они выполнили /family join КОД",
+            reply_markup=main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        return
+
+    if action == 'join':
+        if len(args) < 2:
+            await update.message.reply_text("Укажите код приглашения: /family join КОД")
+            return
+        family = await AsyncFamilyService.join_family(user_id, args[1])
+        if family is None:
+            await update.message.reply_text("❌ Семья с таким кодом не найдена.")
+            return
+        await update.message.reply_text(
+            f"✅ Вы вступили в семью! Участников: {family.members}",
+            reply_markup=main_menu_keyboard()
+        )
+        return
+
+    if action == 'leave':
+        if await AsyncFamilyService.leave_family(user_id):
+            await update.message.reply_text("✅ Вы вышли из семьи.", reply_markup=main_menu_keyboard())
+        else:
+            await update.message.reply_text("Вы не состоите в семье.", reply_markup=main_menu_keyboard())
+        return
+
+    family_id = await AsyncFamilyService.get_family_id(user_id)
+    if family_id is None:
+        await update.message.reply_text(FAMILY_HELP, reply_markup=main_menu_keyboard(), parse_mode="HTML")
+        return
+    await show_family(update, context, family_id)
+
+
+def get_family_handlers():
+    return [
+        CommandHandler("family", timed_handler('none', family_command)),
+    ]
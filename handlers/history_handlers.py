@@ -0,0 +1,156 @@
+import html
+import os
+from datetime import datetime
+from typing import Optional
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from models.money import format_amount
+from services.async_transaction_service import AsyncTransactionService
+from services.metrics import timed_handler
+
+# Сколько операций показывать на одной странице истории
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '10'))
+# Для скольких последних сообщений с историей помнить фильтры
+HISTORY_FILTERS_KEPT = 20
+
+TYPE_WORDS = {
+    'доход': 'income', 'доходы': 'income', 'income': 'income',
+    'расход': 'expense', 'расходы': 'expense', 'expense': 'expense',
+}
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+
+
+def parse_day(value: str) -> Optional[str]:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    return None
+
+
+def parse_filters(args: list) -> dict:
+    """Разбирает аргументы /history: тип, до двух дат (с, по), остальное - категория."""
+    filters_ = {'transaction_type': None, 'category': None, 'date_from': None, 'date_to': None}
+    dates = []
+    category = []
+    for arg in args:
+        day = parse_day(arg)
+        if day:
+            dates.append(day)
+        elif arg.lower() in TYPE_WORDS and filters_['transaction_type'] is None:
+            filters_['transaction_type'] = TYPE_WORDS[arg.lower()]
+        else:
+            category.append(arg)
+    if dates:
+        filters_['date_from'] = dates[0]
+        filters_['date_to'] = dates[1] if len(dates) > 1 else None
+    if category:
+        filters_['category'] = ' '.join(category)
+    return filters_
+
+
+def _encode_key(row: tuple) -> str:
+    # Ключ (date, id) в callback_data: дата без разделителей, чтобы уложиться в 64 байта
+    return f"{row[1].replace('-', '').replace(' ', '').replace(':', '')}:{row[0]}"
+
+
+def _decode_key(date: str, transaction_id: str) -> tuple:
+    return (f"{date[:4]}-{date[4:6]}-{date[6:8]} {date[8:10]}:{date[10:12]}:{date[12:14]}",
+            int(transaction_id))
+
+
+def _format_row(row: tuple) -> str:
+    _, date, transaction_type, amount, category, description = row
+    sign = '+' if transaction_type == 'income' else '−'
+    line = f"<code>{date[8:10]}.{date[5:7]}.{date[2:4]} {date[11:16]}</code> {sign}{format_amount(amount)}"
+    if category:
+        line += f" {html.escape(category)}"
+    if description:
+        line += f" · {html.escape(description)}"
+    return line
+
+
+def _describe_filters(filters_: dict) -> str:
+    parts = []
+    if filters_['transaction_type']:
+        parts.append('доходы' if filters_['transaction_type'] == 'income' else 'расходы')
+    if filters_['category']:
+        parts.append(html.escape(filters_['category']))
+    if filters_['date_from'] or filters_['date_to']:
+        parts.append(f"{filters_['date_from'] or '…'} — {filters_['date_to'] or '…'}")
+    return ' · '.join(parts)
+
+
+def render_page(rows: list, has_newer: bool, has_older: bool, filters_: dict):
+    """Текст страницы и кнопки навигации."""
+    text = "📜 <b>История операций</b>\n"
+    description = _describe_filters(filters_)
+    if description:
+        text += f"<i>{description}</i>\n"
+    text += "\n"
+    if rows:
+        text += '\n'.join(_format_row(row) for row in rows)
+    else:
+        text += "Операций не найдено."
+
+    buttons = []
+    if rows and has_newer:
+        buttons.append(InlineKeyboardButton("◀ Новее", callback_data=f"hist:a:{_encode_key(rows[0])}"))
+    if rows and has_older:
+        buttons.append(InlineKeyboardButton("Старее ▶", callback_data=f"hist:b:{_encode_key(rows[-1])}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    filters_ = parse_filters(context.args or [])
+    rows, has_older = await AsyncTransactionService.get_transactions_page(
+        user_id, HISTORY_PAGE_SIZE, **filters_)
+    text, markup = render_page(rows, False, has_older, filters_)
+    message = await update.message.reply_text(text, reply_markup=markup, parse_mode="HTML")
+
+    # Фильтры не помещаются в callback_data, поэтому хранятся по id сообщения
+    saved = context.user_data.setdefault('history_filters', {})
+    saved[message.message_id] = filters_
+    while len(saved) > HISTORY_FILTERS_KEPT:
+        del saved[next(iter(saved))]
+
+
+async def history_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    try:
+        _, direction, date, transaction_id = query.data.split(':')
+        key = _decode_key(date, transaction_id)
+    except ValueError:
+        return
+
+    filters_ = context.user_data.get('history_filters', {}).get(query.message.message_id)
+    if filters_ is None:
+        filters_ = parse_filters([])
+    if direction == 'b':
+        rows, has_older = await AsyncTransactionService.get_transactions_page(
+            query.from_user.id, HISTORY_PAGE_SIZE, before=key, **filters_)
+        has_newer = True
+    else:
+        rows, has_newer = await AsyncTransactionService.get_transactions_page(
+            query.from_user.id, HISTORY_PAGE_SIZE, after=key, **filters_)
+        has_older = True
+    text, markup = render_page(rows, has_newer, has_older, filters_)
+    try:
+        await query.edit_message_text(text, reply_markup=markup, parse_mode="HTML")
+    except BadRequest as e:
+        # Повторное нажатие на ту же кнопку: страница не изменилась
+        if 'not modified' not in str(e):
+            raise
+
+
+def get_history_handlers():
+    return [
+        CommandHandler("history", timed_handler('none', show_history)),
+        MessageHandler(filters.Regex("^📜 История$"), timed_handler('none', show_history)),
+        CallbackQueryHandler(timed_handler('none', history_page), pattern="^hist:"),
+    ]
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import ContextTypes, MessageHandler, CommandHandler, filters
+from handlers.keyboards import main_menu_keyboard
+from services.async_transaction_service import AsyncTransactionService
+from services.metrics import timed_handler
+
+# Как часто (в секундах) обновлять сообщение с прогрессом импорта
+IMPORT_PROGRESS_INTERVAL = float(os.getenv('IMPORT_PROGRESS_INTERVAL', '3'))
+
+
+def make_progress_reporter(message, loop: asyncio.AbstractEventLoop, interval: float = IMPORT_PROGRESS_INTERVAL):
+    """Создает callback прогресса для потока БД, который редко обновляет сообщение в чате."""
+    last_report = time.monotonic()
+
+    def report(count: int) -> None:
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report < interval:
+            return
+        last_report = now
+        asyncio.run_coroutine_threadsafe(
+            message.edit_text(f"⏳ Импорт... обработано строк: {count}"), loop
+        )
+
+    return report
+
+
+async def import_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "📥 <b>Импорт выписки</b>\n\n"
+        "Отправьте CSV-файл с колонками <b>Дата</b> и <b>Сумма</b>.\n"
+        "Необязательные колонки: <b>Тип</b> (доход/расход), <b>Категория</b>, <b>Описание</b>.\n"
+        "Если колонки типа нет, отрицательные суммы считаются расходами.",
+        reply_markup=main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+
+
+async def import_statement(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    status = await update.message.reply_text("⏳ Загружаю файл...")
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        file = await context.bot.get_file(update.message.document.file_id)
+        await file.download_to_drive(path)
+
+        progress = make_progress_reporter(status, asyncio.get_running_loop())
+        imported, skipped = await AsyncTransactionService.import_csv(user_id, path, progress)
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Не удалось прочитать файл. Нужны колонки с датой и суммой, см. /import",
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    finally:
+        os.remove(path)
+
+    await update.message.reply_text(
+        f"✅ Импорт завершен!\n"
+        f"Добавлено операций: {imported}\n"
+        f"Пропущено строк: {skipped}",
+        reply_markup=main_menu_keyboard()
+    )
+
+
+def get_import_handlers():
+    return [
+        CommandHandler("import", timed_handler('none', import_help)),
+        MessageHandler(filters.Document.FileExtension("csv"), timed_handler('none', import_statement)),
+    ]
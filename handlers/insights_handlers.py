@@ -0,0 +1,59 @@
+import html
+
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from models.money import format_amount
+from services.async_transaction_service import AsyncAnalyticsService
+from services.metrics import timed_handler
+
+
+def _change(current: int, previous: int) -> str:
+    if not previous:
+        return ''
+    return f" ({(current - previous) * 100 / previous:+.0f}%)"
+
+
+def format_insights(insights: dict) -> str:
+    month_to_date = insights['month_to_date']
+    previous = insights['previous_to_date']
+    average = insights['moving_average']
+    message = (
+        "🔎 <b>Аналитика расходов</b>\n\n"
+        f"С начала месяца: <b>{format_amount(month_to_date)} руб.</b>\n"
+        f"За те же дни прошлого месяца: {format_amount(previous)} руб.{_change(month_to_date, previous)}\n"
+        f"Среднее за 3 месяца: {format_amount(average[-1])} руб. "
+        f"(месяцем раньше {format_amount(average[-2])} руб.)\n"
+    )
+
+    if insights['percentiles']:
+        median, p90, p99 = insights['percentiles']
+        message += (f"\n<b>Суммы трат за год:</b>\n"
+                    f"• обычная (медиана): {format_amount(median)} руб.\n"
+                    f"• 90% трат - до {format_amount(p90)} руб., 99% - до {format_amount(p99)} руб.\n")
+
+    if insights['top_descriptions']:
+        message += "\n<b>Больше всего потрачено на:</b>\n"
+        for description, amount, count in insights['top_descriptions']:
+            message += f"• {html.escape(description)}: {format_amount(amount)} руб. ({count} раз)\n"
+
+    if insights['anomalies']:
+        message += "\n<b>Необычно крупные траты за 30 дней:</b>\n"
+        for anomaly in insights['anomalies']:
+            label = anomaly['description'] or anomaly['category'] or 'Без категории'
+            message += (f"• {anomaly['date']:%d.%m} {html.escape(label)}: "
+                        f"{format_amount(anomaly['amount'])} руб. "
+                        f"(обычно {format_amount(anomaly['typical'])} руб.)\n")
+
+    return message
+
+
+async def show_insights(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/insights - динамика, распределение трат, топ описаний и выбросы."""
+    insights = await AsyncAnalyticsService.get_insights(update.message.from_user.id)
+    await update.message.reply_text(format_insights(insights), parse_mode="HTML")
+
+
+def get_insights_handlers():
+    return [
+        CommandHandler("insights", timed_handler('none', show_insights)),
+    ]
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from typing import List
+from telegram import ReplyKeyboardMarkup, KeyboardButton
+
+# Максимальное число закэшированных клавиатур с категориями
+DYNAMIC_KEYBOARD_CACHE_SIZE = 5000
+
+
+class CachedReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """Неизменяемая клавиатура, которая сериализуется только один раз."""
+
+    __slots__ = ('_cached_dict', '_cached_json')
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        if not recursive:
+            return super().to_dict(recursive=False)
+        if getattr(self, '_cached_dict', None) is None:
+            self._cached_dict = super().to_dict()
+        return self._cached_dict
+
+    def to_json(self) -> str:
+        if getattr(self, '_cached_json', None) is None:
+            self._cached_json = super().to_json()
+        return self._cached_json
+
+
+def _build(rows: List[List[str]]) -> CachedReplyKeyboardMarkup:
+    markup = CachedReplyKeyboardMarkup(
+        [[KeyboardButton(text) for text in row] for row in rows],
+        resize_keyboard=True
+    )
+    # Сериализуем заранее, чтобы ответы использовали готовый словарь
+    markup.to_dict()
+    return markup
+
+
+# Статические клавиатуры строятся один раз при загрузке модуля
+_MAIN_MENU = _build([
+    ["➕ Доход", "➖ Расход"],
+    ["💰 Баланс", "📊 Статистика"],
+    ["📋 Категории", "⚙ Настройки"],
+    ["📜 История"]
+])
+
+_CANCEL = _build([
+    ["❌ Отмена"]
+])
+
+_CATEGORIES = _build([
+    ["➕ Добавить категорию доходов"],
+    ["➕ Добавить категорию расходов"],
+    ["📋 Показать все категории"],
+    ["🔙 Назад"]
+])
+
+_SETTINGS = _build([
+    ["🗑 Очистить все доходы"],
+    ["🗑 Очистить все расходы"],
+    ["❌ Удалить категории доходов"],
+    ["❌ Удалить категории расходов"],
+    ["🔙 Вернуться в главное меню"]
+])
+
+
+def main_menu_keyboard() -> ReplyKeyboardMarkup:
+    return _MAIN_MENU
+
+def cancel_keyboard() -> ReplyKeyboardMarkup:
+    return _CANCEL
+
+def categories_keyboard() -> ReplyKeyboardMarkup:
+    return _CATEGORIES
+
+def settings_keyboard() -> ReplyKeyboardMarkup:
+    return _SETTINGS
+
+
+class DynamicKeyboardCache:
+    """LRU-кэш клавиатур, зависящих от списка категорий пользователя.
+
+    Ключом служит сам список категорий: он меняется только при изменении
+    категорий, поэтому работает как версия, а одинаковые списки разных
+    пользователей (например, пустые) используют одну и ту же клавиатуру.
+    """
+
+    def __init__(self, max_entries: int = DYNAMIC_KEYBOARD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, categories: List[str], extra_rows: List[List[str]]) -> ReplyKeyboardMarkup:
+        key = (kind, tuple(categories))
+        markup = self._data.get(key)
+        if markup is not None:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return markup
+
+        self.misses += 1
+        markup = _build([[category] for category in categories] + extra_rows)
+        self._data[key] = markup
+        if len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+        return markup
+
+
+dynamic_keyboards = DynamicKeyboardCache()
+
+
+def category_keyboard(categories: List[str]) -> ReplyKeyboardMarkup:
+    """Клавиатура выбора категории с кнопками создания новой и отмены."""
+    return dynamic_keyboards.get('choose', categories, [["➕ Создать новую категорию"], ["❌ Отмена"]])
+
+def category_selection_keyboard(categories: List[str]) -> ReplyKeyboardMarkup:
+    """Клавиатура выбора категории для удаления."""
+    return dynamic_keyboards.get('select', categories, [["❌ Отмена"]])
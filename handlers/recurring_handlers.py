@@ -0,0 +1,181 @@
+import html
+import os
+from datetime import date
+from typing import List, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes, CommandHandler
+from handlers.history_handlers import TYPE_WORDS, parse_day
+from handlers.keyboards import main_menu_keyboard
+from models.money import format_amount, parse_amount
+from models.transaction import Category, RecurringRule, Transaction
+from services.async_transaction_service import AsyncRecurringService, AsyncTransactionService
+from services.metrics import timed_handler
+from services.recurring_service import parse_period
+from services.send_scheduler import BULK
+
+# Как часто планировщик проводит наступившие правила, секунды
+RECURRING_INTERVAL = float(os.getenv('RECURRING_INTERVAL', '300'))
+# Лимит Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+RECURRING_HELP = (
+    "🔁 <b>Повторяющиеся операции</b>\n\n"
+    "/recurring add ТИП СУММА ПЕРИОД КАТЕГОРИЯ [ДАТА] - добавить правило\n"
+    "  ТИП: доход или расход\n"
+    "  ПЕРИОД: daily, weekly, monthly, yearly или 10d, 2w, 3m\n"
+    "  ДАТА: первое проведение (ДД.ММ.ГГГГ), по умолчанию сегодня\n"
+    "/recurring delete НОМЕР - удалить правило\n\n"
+    "Пример: /recurring add расход 499 monthly Подписки"
+)
+
+UNIT_NAMES = {'day': 'дн.', 'month': 'мес.'}
+
+
+def describe_period(unit: str, count: int) -> str:
+    if unit == 'day' and count == 1:
+        return 'ежедневно'
+    if unit == 'day' and count == 7:
+        return 'еженедельно'
+    if unit == 'month' and count == 1:
+        return 'ежемесячно'
+    if unit == 'month' and count == 12:
+        return 'ежегодно'
+    return f"каждые {count} {UNIT_NAMES[unit]}"
+
+
+async def list_rules(update: Update, user_id: int):
+    rules = await AsyncRecurringService.get_rules(user_id)
+    if not rules:
+        await update.message.reply_text(RECURRING_HELP, reply_markup=main_menu_keyboard(), parse_mode="HTML")
+        return
+    message = "🔁 <b>Повторяющиеся операции</b>\n\n"
+    for rule in rules:
+        sign = '+' if rule.type == 'income' else '-'
+        message += (f"{rule.rule_id}. {sign}{format_amount(rule.amount)} руб., "
+                    f"{html.escape(rule.category or 'Без категории')}, "
+                    f"{describe_period(rule.unit, rule.count)}, "
+                    f"следующая {date.fromisoformat(rule.next_due):%d.%m.%Y}\n")
+    message += "\nУдалить: /recurring delete НОМЕР"
+    await update.message.reply_text(message, reply_markup=main_menu_keyboard(), parse_mode="HTML")
+
+
+async def recurring_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    args = context.args or []
+    action = args[0].lower() if args else ''
+
+    if action == 'add':
+        if len(args) < 5 or args[1].lower() not in TYPE_WORDS:
+            await update.message.reply_text(RECURRING_HELP, parse_mode="HTML")
+            return
+        transaction_type = TYPE_WORDS[args[1].lower()]
+        period = parse_period(args[3])
+        try:
+            amount = parse_amount(args[2])
+        except ValueError:
+            amount = 0
+        if amount <= 0 or period is None:
+            await update.message.reply_text(RECURRING_HELP, parse_mode="HTML")
+            return
+
+        rest = args[4:]
+        start = parse_day(rest[-1]) if len(rest) > 1 else None
+        if start:
+            rest = rest[:-1]
+        first_due = date.fromisoformat(start) if start else date.today()
+        category = ' '.join(rest)
+        unit, count = period
+
+        await AsyncTransactionService.add_category(Category(user_id=user_id, name=category, type=transaction_type))
+        rule_id = await AsyncRecurringService.add_rule(RecurringRule(
+            user_id=user_id, type=transaction_type, amount=amount, category=category,
+            unit=unit, count=count, next_due=first_due.isoformat(),
+            anchor_day=first_due.day if unit == 'month' else None))
+        await update.message.reply_text(
+            f"✅ Правило {rule_id} добавлено: {format_amount(amount)} руб., "
+            f"{describe_period(unit, count)}, первое проведение {first_due:%d.%m.%Y}",
+            reply_markup=main_menu_keyboard()
+        )
+        return
+
+    if action == 'delete':
+        if len(args) < 2 or not args[1].isdigit():
+            await update.message.reply_text("Укажите номер правила: /recurring delete НОМЕР")
+            return
+        if await AsyncRecurringService.delete_rule(user_id, int(args[1])):
+            await update.message.reply_text("✅ Правило удалено.", reply_markup=main_menu_keyboard())
+        else:
+            await update.message.reply_text("❌ Правило не найдено.", reply_markup=main_menu_keyboard())
+        return
+
+    await list_rules(update, user_id)
+
+
+def summarize_posted(posted: List[Tuple[int, List[Transaction]]]) -> List[str]:
+    """Строки уведомления: одна на правило с числом проведений и итогом.
+
+    После простоя ежедневное правило догоняет сотни дат сразу, поэтому
+    даты не перечисляются, а сворачиваются в диапазон.
+    """
+    lines = []
+    for rule_id, transactions in posted:
+        first = transactions[0]
+        sign = '+' if first.type == 'income' else '-'
+        first_day = date.fromisoformat(first.date[:10])
+        line = (f"• {rule_id}. {html.escape(first.category or 'Без категории')}: "
+                f"{sign}{format_amount(first.amount)} руб.")
+        if len(transactions) == 1:
+            line += f" ({first_day:%d.%m.%Y})"
+        else:
+            last_day = date.fromisoformat(transactions[-1].date[:10])
+            line += (f" × {len(transactions)} ({first_day:%d.%m.%Y} - {last_day:%d.%m.%Y}), "
+                     f"итого {sign}{format_amount(first.amount * len(transactions))} руб.")
+        lines.append(line + "\n")
+    return lines
+
+
+def split_message(header: str, lines: List[str]) -> List[str]:
+    """Собирает строки в сообщения не длиннее лимита Telegram."""
+    messages = []
+    current = header
+    for line in lines:
+        if _message_length(current + line) > MESSAGE_LIMIT:
+            messages.append(current)
+            current = header
+        current += line
+    messages.append(current)
+    return messages
+
+
+def _message_length(text: str) -> int:
+    # Telegram считает длину в кодовых единицах UTF-16; теги HTML - с запасом
+    return len(text.encode('utf-16-le')) // 2
+
+
+async def post_recurring(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: проводит наступившие правила и сообщает об этом пользователям."""
+    posted = await AsyncRecurringService.post_due()
+    by_user = {}
+    for rule_id, transactions in posted:
+        if transactions:
+            by_user.setdefault(transactions[0].user_id, []).append((rule_id, transactions))
+
+    # Уведомления - рассылка: ответы пользователям отправляются раньше них
+    rate_limit_args = BULK if context.bot.rate_limiter else None
+    for user_id, rules in by_user.items():
+        messages = split_message("🔁 <b>Проведены повторяющиеся операции:</b>\n", summarize_posted(rules))
+        try:
+            for message in messages:
+                await context.bot.send_message(user_id, message, parse_mode="HTML",
+                                               rate_limit_args=rate_limit_args)
+        except TelegramError as e:
+            # Транзакции уже проведены; пользователь мог заблокировать бота
+            print(f"Recurring notification to {user_id} failed: {e}")
+
+
+def get_recurring_handlers():
+    return [
+        CommandHandler("recurring", timed_handler('none', recurring_command)),
+    ]
@@ -0,0 +1,111 @@
+import html
+from datetime import date, timedelta
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, CallbackQueryHandler, CommandHandler
+from handlers.history_handlers import parse_day
+from models.money import format_amount
+from services.async_transaction_service import AsyncTransactionService
+from services.metrics import timed_handler
+
+PERIOD_TITLES = {
+    'day': 'за сегодня',
+    'week': 'за неделю',
+    'month': 'за месяц',
+    'year': 'за год',
+    '365': 'за 365 дней',
+}
+
+_PERIODS_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("День", callback_data="stats:day"),
+     InlineKeyboardButton("Неделя", callback_data="stats:week"),
+     InlineKeyboardButton("Месяц", callback_data="stats:month")],
+    [InlineKeyboardButton("Год", callback_data="stats:year"),
+     InlineKeyboardButton("365 дней", callback_data="stats:365")],
+])
+
+
+def period_range(period: str, today: date) -> tuple:
+    """Границы именованного периода, заканчивающегося сегодняшним днем."""
+    if period == 'day':
+        return today, today
+    if period == 'week':
+        return today - timedelta(days=today.weekday()), today
+    if period == 'month':
+        return today.replace(day=1), today
+    if period == 'year':
+        return today.replace(month=1, day=1), today
+    return today - timedelta(days=364), today
+
+
+def format_period_stats(title: str, stats: dict) -> str:
+    message = (
+        f"📊 <b>Статистика {title}</b>\n\n"
+        f"Доходы: <b>{format_amount(stats['total_income'])} руб.</b>\n"
+        f"Расходы: <b>{format_amount(stats['total_expense'])} руб.</b>\n"
+        f"Баланс: <b>{format_amount(stats['total_income'] - stats['total_expense'])} руб.</b>\n\n"
+    )
+
+    if stats['income_by_category']:
+        message += "<b>Доходы по категориям:</b>\n"
+        for category, amount in stats['income_by_category'].items():
+            message += f"• {html.escape(category or 'Без категории')}: {format_amount(amount)} руб.\n"
+
+    if stats['expense_by_category']:
+        message += "\n<b>Расходы по категориям:</b>\n"
+        for category, amount in stats['expense_by_category'].items():
+            message += f"• {html.escape(category or 'Без категории')}: {format_amount(amount)} руб.\n"
+
+    return message
+
+
+async def show_period_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats [day|week|month|year|365] или /stats ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]."""
+    user_id = update.message.from_user.id
+    args = context.args or []
+    today = date.today()
+
+    days = [parse_day(arg) for arg in args]
+    if days and all(days):
+        date_from = date.fromisoformat(days[0])
+        date_to = date.fromisoformat(days[1]) if len(days) > 1 else today
+        if date_from > date_to:
+            date_from, date_to = date_to, date_from
+        title = f"с {date_from:%d.%m.%Y} по {date_to:%d.%m.%Y}"
+    else:
+        period = args[0].lower() if args and args[0].lower() in PERIOD_TITLES else 'month'
+        date_from, date_to = period_range(period, today)
+        title = PERIOD_TITLES[period]
+
+    stats = await AsyncTransactionService.get_period_stats(user_id, date_from, date_to)
+    await update.message.reply_text(
+        format_period_stats(title, stats),
+        reply_markup=_PERIODS_KEYBOARD,
+        parse_mode="HTML"
+    )
+
+
+async def switch_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    period = query.data.split(':', 1)[1]
+    if period not in PERIOD_TITLES:
+        return
+
+    date_from, date_to = period_range(period, date.today())
+    stats = await AsyncTransactionService.get_period_stats(query.from_user.id, date_from, date_to)
+    try:
+        await query.edit_message_text(format_period_stats(PERIOD_TITLES[period], stats),
+                                      reply_markup=_PERIODS_KEYBOARD, parse_mode="HTML")
+    except BadRequest as e:
+        # Повторное нажатие на тот же период: текст не изменился
+        if 'not modified' not in str(e):
+            raise
+
+
+def get_stats_handlers():
+    return [
+        CommandHandler("stats", timed_handler('none', show_period_stats)),
+        CallbackQueryHandler(timed_handler('none', switch_period), pattern="^stats:"),
+    ]
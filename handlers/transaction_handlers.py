@@ -1,64 +1,32 @@
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+import asyncio
+
+from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters, CommandHandler
+from handlers.keyboards import (
+    main_menu_keyboard, cancel_keyboard, categories_keyboard, settings_keyboard,
+    category_keyboard, category_selection_keyboard
+)
+from models.money import format_amount, parse_amount
 from models.transaction import Transaction, Category
-from services.transaction_service import TransactionService
+from services.async_transaction_service import AsyncTransactionService, AsyncFamilyService
+from services.metrics import timed_handler
 
 # States for ConversationHandler
 GET_AMOUNT, GET_CATEGORY, ADD_INCOME_CATEGORY, ADD_EXPENSE_CATEGORY, SETTINGS_MENU, DELETE_CATEGORY = range(6)
 
-def main_menu_keyboard():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("➕ Доход"), KeyboardButton("➖ Расход")],
-        [KeyboardButton("💰 Баланс"), KeyboardButton("📊 Статистика")],
-        [KeyboardButton("📋 Категории"), KeyboardButton("⚙ Настройки")]
-    ], resize_keyboard=True)
-
-def cancel_keyboard():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("❌ Отмена")]
-    ], resize_keyboard=True)
-
-def categories_keyboard():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("➕ Добавить категорию доходов")],
-        [KeyboardButton("➕ Добавить категорию расходов")],
-        [KeyboardButton("📋 Показать все категории")],
-        [KeyboardButton("🔙 Назад")]
-    ], resize_keyboard=True)
-
-def get_category_keyboard(user_id: int, transaction_type: str) -> ReplyKeyboardMarkup:
+STATE_NAMES = {
+    GET_AMOUNT: 'GET_AMOUNT',
+    GET_CATEGORY: 'GET_CATEGORY',
+    ADD_INCOME_CATEGORY: 'ADD_INCOME_CATEGORY',
+    ADD_EXPENSE_CATEGORY: 'ADD_EXPENSE_CATEGORY',
+    SETTINGS_MENU: 'SETTINGS_MENU',
+    DELETE_CATEGORY: 'DELETE_CATEGORY',
+}
+
+async def get_category_keyboard(user_id: int, transaction_type: str) -> ReplyKeyboardMarkup:
     """Создает клавиатуру с доступными категориями и кнопкой создания новой."""
-    categories = TransactionService.get_categories(user_id, transaction_type)
-    keyboard = []
-    
-    # Добавляем существующие категории
-    for category in categories:
-        keyboard.append([KeyboardButton(category)])
-    
-    # Добавляем кнопки для создания новой категории и отмены
-    keyboard.append([KeyboardButton("➕ Создать новую категорию")])
-    keyboard.append([KeyboardButton("❌ Отмена")])
-    
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def settings_keyboard():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("🗑 Очистить все доходы")],
-        [KeyboardButton("🗑 Очистить все расходы")],
-        [KeyboardButton("❌ Удалить категории доходов")],
-        [KeyboardButton("❌ Удалить категории расходов")],
-        [KeyboardButton("🔙 Вернуться в главное меню")]
-    ], resize_keyboard=True)
-
-def category_selection_keyboard(user_id: int, category_type: str):
-    categories = TransactionService.get_categories(user_id, category_type)
-    keyboard = []
-    
-    for category in categories:
-        keyboard.append([KeyboardButton(category)])
-    
-    keyboard.append([KeyboardButton("❌ Отмена")])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    categories = await AsyncTransactionService.get_categories(user_id, transaction_type)
+    return category_keyboard(categories)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -97,7 +65,7 @@ async def get_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await cancel(update, context)
 
     try:
-        amount = float(update.message.text)
+        amount = parse_amount(update.message.text)
         if amount <= 0:
             await update.message.reply_text("Сумма должна быть больше нуля!")
             return GET_AMOUNT
@@ -107,7 +75,7 @@ async def get_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         transaction_type = context.user_data['transaction_type']
         
         # Получаем клавиатуру с категориями
-        keyboard = get_category_keyboard(user_id, transaction_type)
+        keyboard = await get_category_keyboard(user_id, transaction_type)
         
         await update.message.reply_text(
             "Выберите категорию или создайте новую:",
@@ -148,11 +116,11 @@ async def get_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
         amount=amount,
         category=category
     )
-    TransactionService.add_transaction(transaction)
+    await AsyncTransactionService.add_transaction(transaction)
 
     await update.message.reply_text(
         f"✅ {'Доход' if transaction_type == 'income' else 'Расход'} "
-        f"на сумму {amount:.2f} руб. успешно добавлен!"
+        f"на сумму {format_amount(amount)} руб. успешно добавлен!"
         f"{' (Категория: ' + category + ')' if category else ''}",
         reply_markup=main_menu_keyboard()
     )
@@ -168,45 +136,64 @@ async def skip_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
         type=transaction_type,
         amount=amount
     )
-    TransactionService.add_transaction(transaction)
+    await AsyncTransactionService.add_transaction(transaction)
 
     await update.message.reply_text(
         f"✅ {'Доход' if transaction_type == 'income' else 'Расход'} "
-        f"на сумму {amount:.2f} руб. успешно добавлен!",
+        f"на сумму {format_amount(amount)} руб. успешно добавлен!",
         reply_markup=main_menu_keyboard()
     )
     return ConversationHandler.END
 
 async def show_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    balance = TransactionService.get_balance(user_id)
+    balance, family_id = await asyncio.gather(
+        AsyncTransactionService.get_balance(user_id),
+        AsyncFamilyService.get_family_id(user_id)
+    )
+    message = f"Ваш текущий баланс: <b>{format_amount(balance)} руб.</b>"
+    if family_id is not None:
+        family_balance, exists = await asyncio.gather(
+            AsyncFamilyService.get_family_balance(family_id),
+            AsyncFamilyService.family_exists(family_id)
+        )
+        if exists:
+            message += f"\nБаланс семьи: <b>{format_amount(family_balance)} руб.</b>"
+        else:
+            # Семью удалили из каталога, а членство осталось: личный бюджет
+            await AsyncFamilyService.forget_missing_family(user_id, family_id)
     await update.message.reply_text(
-        f"Ваш текущий баланс: <b>{balance:.2f} руб.</b>",
+        message,
         reply_markup=main_menu_keyboard(),
         parse_mode="HTML"
     )
 
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    stats = TransactionService.get_monthly_stats(user_id)
-    category_stats = TransactionService.get_category_stats(user_id)
+    # Запросы независимы, поэтому выполняем их параллельно в пуле потоков БД
+    stats, category_stats = await asyncio.gather(
+        AsyncTransactionService.get_monthly_stats(user_id),
+        AsyncTransactionService.get_category_stats(user_id)
+    )
 
     message = (
         "📊 <b>Статистика за текущий месяц</b>\n\n"
-        f"Доходы: <b>{stats.total_income:.2f} руб.</b>\n"
-        f"Расходы: <b>{stats.total_expense:.2f} руб.</b>\n"
-        f"Баланс: <b>{stats.balance:.2f} руб.</b>\n\n"
+        f"Доходы: <b>{format_amount(stats.total_income)} руб.</b>\n"
+        f"Расходы: <b>{format_amount(stats.total_expense)} руб.</b>\n"
+        f"Баланс: <b>{format_amount(stats.balance)} руб.</b>\n\n"
     )
 
     if category_stats['income_by_category']:
         message += "<b>Доходы по категориям:</b>\n"
         for category, amount in category_stats['income_by_category'].items():
-            message += f"• {category}: {amount:.2f} руб.\n"
+            message += f"• {category}: {format_amount(amount)} руб.\n"
 
     if category_stats['expense_by_category']:
         message += "\n<b>Расходы по категориям:</b>\n"
         for category, amount in category_stats['expense_by_category'].items():
-            message += f"• {category}: {amount:.2f} руб.\n"
+            message += f"• {category}: {format_amount(amount)} руб.\n"
+
+    message += "\nДругие периоды: /stats\nГрафики: /chart"
 
     await update.message.reply_text(
         message,
@@ -248,7 +235,7 @@ async def handle_new_income_category(update: Update, context: ContextTypes.DEFAU
         name=category_name,
         type='income'
     )
-    TransactionService.add_category(category)
+    await AsyncTransactionService.add_category(category)
 
     if amount is not None:
         # Если категория создается в процессе добавления транзакции
@@ -258,11 +245,11 @@ async def handle_new_income_category(update: Update, context: ContextTypes.DEFAU
             amount=amount,
             category=category_name
         )
-        TransactionService.add_transaction(transaction)
+        await AsyncTransactionService.add_transaction(transaction)
         
         await update.message.reply_text(
             f"✅ Категория доходов '{category_name}' успешно создана!\n"
-            f"Доход на сумму {amount:.2f} руб. успешно добавлен!",
+            f"Доход на сумму {format_amount(amount)} руб. успешно добавлен!",
             reply_markup=main_menu_keyboard()
         )
         return ConversationHandler.END
@@ -287,7 +274,7 @@ async def handle_new_expense_category(update: Update, context: ContextTypes.DEFA
         name=category_name,
         type='expense'
     )
-    TransactionService.add_category(category)
+    await AsyncTransactionService.add_category(category)
 
     if amount is not None:
         # Если категория создается в процессе добавления транзакции
@@ -297,11 +284,11 @@ async def handle_new_expense_category(update: Update, context: ContextTypes.DEFA
             amount=amount,
             category=category_name
         )
-        TransactionService.add_transaction(transaction)
+        await AsyncTransactionService.add_transaction(transaction)
         
         await update.message.reply_text(
             f"✅ Категория расходов '{category_name}' успешно создана!\n"
-            f"Расход на сумму {amount:.2f} руб. успешно добавлен!",
+            f"Расход на сумму {format_amount(amount)} руб. успешно добавлен!",
             reply_markup=main_menu_keyboard()
         )
         return ConversationHandler.END
@@ -316,8 +303,8 @@ async def handle_new_expense_category(update: Update, context: ContextTypes.DEFA
 async def show_all_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     
-    income_categories = TransactionService.get_categories(user_id, 'income')
-    expense_categories = TransactionService.get_categories(user_id, 'expense')
+    income_categories = await AsyncTransactionService.get_categories(user_id, 'income')
+    expense_categories = await AsyncTransactionService.get_categories(user_id, 'expense')
 
     message = "📋 <b>Ваши категории:</b>\n\n"
     
@@ -361,7 +348,7 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     if action == "🗑 Очистить все доходы":
-        TransactionService.clear_transactions(user_id, 'income')
+        await AsyncTransactionService.clear_transactions(user_id, 'income')
         await update.message.reply_text(
             "✅ Все доходы успешно удалены!",
             reply_markup=settings_keyboard()
@@ -369,7 +356,7 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SETTINGS_MENU
 
     if action == "🗑 Очистить все расходы":
-        TransactionService.clear_transactions(user_id, 'expense')
+        await AsyncTransactionService.clear_transactions(user_id, 'expense')
         await update.message.reply_text(
             "✅ Все расходы успешно удалены!",
             reply_markup=settings_keyboard()
@@ -377,7 +364,7 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SETTINGS_MENU
 
     if action == "❌ Удалить категории доходов":
-        categories = TransactionService.get_categories(user_id, 'income')
+        categories = await AsyncTransactionService.get_categories(user_id, 'income')
         if not categories:
             await update.message.reply_text(
                 "У вас нет категорий доходов для удаления.",
@@ -388,12 +375,12 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['category_type'] = 'income'
         await update.message.reply_text(
             "Выберите категорию для удаления:",
-            reply_markup=category_selection_keyboard(user_id, 'income')
+            reply_markup=category_selection_keyboard(categories)
         )
         return DELETE_CATEGORY
 
     if action == "❌ Удалить категории расходов":
-        categories = TransactionService.get_categories(user_id, 'expense')
+        categories = await AsyncTransactionService.get_categories(user_id, 'expense')
         if not categories:
             await update.message.reply_text(
                 "У вас нет категорий расходов для удаления.",
@@ -404,7 +391,7 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['category_type'] = 'expense'
         await update.message.reply_text(
             "Выберите категорию для удаления:",
-            reply_markup=category_selection_keyboard(user_id, 'expense')
+            reply_markup=category_selection_keyboard(categories)
         )
         return DELETE_CATEGORY
 
@@ -420,7 +407,7 @@ async def handle_category_deletion(update: Update, context: ContextTypes.DEFAULT
     category_name = update.message.text
     category_type = context.user_data['category_type']
 
-    if TransactionService.delete_category(user_id, category_name, category_type):
+    if await AsyncTransactionService.delete_category(user_id, category_name, category_type):
         await update.message.reply_text(
             f"✅ Категория '{category_name}' успешно удалена!",
             reply_markup=settings_keyboard()
@@ -468,14 +455,30 @@ def get_handlers():
                 MessageHandler(filters.Regex("^❌ Отмена$"), cancel)
             ]
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="transaction",
+        persistent=True
     )
 
-    return [
+    handlers = [
         CommandHandler("start", start),
         conv_handler,
         MessageHandler(filters.Regex("^💰 Баланс$"), show_balance),
         MessageHandler(filters.Regex("^📊 Статистика$"), show_stats),
         MessageHandler(filters.Regex("^📋 Категории$"), categories_menu),
         MessageHandler(filters.Regex("^🔙 Назад$"), start)
-    ] 
\ No newline at end of file
+    ]
+
+    # Замер времени каждого хендлера с меткой состояния диалога
+    for handler in conv_handler.entry_points:
+        handler.callback = timed_handler('entry', handler.callback)
+    for state, state_handlers in conv_handler.states.items():
+        for handler in state_handlers:
+            handler.callback = timed_handler(STATE_NAMES[state], handler.callback)
+    for handler in conv_handler.fallbacks:
+        handler.callback = timed_handler('fallback', handler.callback)
+    for handler in handlers:
+        if handler is not conv_handler:
+            handler.callback = timed_handler('none', handler.callback)
+
+    return handlers 
\ No newline at end of file
@@ -1,35 +1,147 @@
+import asyncio
 import os
+import signal
 
+from telegram import Update
 from telegram.ext import Application
 from dotenv import load_dotenv
-from database.db import init_db
-from handlers.transaction_handlers import get_handlers
 
-# Load environment variables
+# Load environment variables before modules that read their settings
 load_dotenv()
 
+from database.db import init_db, get_pool, get_pool_stats
+from handlers.transaction_handlers import get_handlers
+from handlers.import_handlers import get_import_handlers
+from handlers.export_handlers import get_export_handlers
+from handlers.history_handlers import get_history_handlers
+from handlers.stats_handlers import get_stats_handlers
+from handlers.family_handlers import get_family_handlers
+from handlers.chart_handlers import get_chart_handlers
+from handlers.insights_handlers import get_insights_handlers
+from handlers.recurring_handlers import get_recurring_handlers, post_recurring, RECURRING_INTERVAL
+from services.async_transaction_service import flush_pending_writes, shutdown_executor
+from services.category_cache import category_cache
+from services.charts import chart_cache, start_chart_pool, shutdown_chart_pool
+from services.analytics import analytics_cache
+from services.family_cache import family_cache
+from handlers.keyboards import dynamic_keyboards
+from services import metrics, webhook
+from services.persistence import SQLitePersistence
+from services.send_scheduler import SendScheduler
+from services.update_processor import ChatOrderedUpdateProcessor, PendingUpdateQueue, UPDATES_CONCURRENCY
+
 # Initialize database
 init_db()
 
 def main():
+    persistence = SQLitePersistence()
     # Create application
-    application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
+    builder = (
+        Application.builder()
+        .token(os.getenv('BOT_TOKEN'))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(persistence)
+        .rate_limiter(send_scheduler)
+    )
+    # Updates of different chats run concurrently, updates of one chat in order;
+    # the queue stops accepting updates (polling or webhook) while too many are unfinished
+    if webhook.enabled or UPDATES_CONCURRENCY > 1:
+        processor = ChatOrderedUpdateProcessor()
+        builder = builder.concurrent_updates(processor).update_queue(PendingUpdateQueue(processor))
+    application = builder.build()
 
-    # Add handlers
-    for handler in get_handlers():
+    # Add handlers; saved conversation state is loaded before the others run
+    application.add_handler(persistence.loader_handler(), group=-1)
+    handlers = (get_handlers() + get_import_handlers() + get_export_handlers()
+                + get_history_handlers() + get_stats_handlers() + get_family_handlers() + get_chart_handlers()
+                + get_insights_handlers() + get_recurring_handlers())
+    for handler in handlers:
         application.add_handler(handler)
 
+    # Recurring transactions are posted by the job queue; missed ticks catch up on the next one
+    application.job_queue.run_repeating(post_recurring, interval=RECURRING_INTERVAL, first=1, name='recurring')
+
     # Add error handler
     application.add_error_handler(error_handler)
 
     # Start the bot
     print("Bot is running...")
-    application.run_polling()
+    if webhook.enabled:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
+
+async def run_webhook(application):
+    """Same lifecycle as run_polling, but updates arrive through the webhook server."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = webhook.WebhookServer(application)
+    await application.initialize()
+    try:
+        await post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            webhook.WEBHOOK_URL,
+            secret_token=webhook.WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=webhook.WEBHOOK_MAX_CONNECTIONS,
+        )
+        await stop.wait()
+    finally:
+        # Stop accepting updates first, then let the accepted ones finish
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
+
+metrics_server = metrics.MetricsServer()
+# Outgoing messages wait for Telegram's rate limits instead of failing with 429
+send_scheduler = SendScheduler()
+
+async def post_init(application):
+    """Starts the chart workers and the metrics endpoint when METRICS_PORT is set."""
+    # Forked before the database thread pool starts its threads
+    start_chart_pool()
+    if metrics.enabled:
+        metrics.registry.add_gauge_callback(
+            'budget_bot_db_pool', 'Connection pool statistics', 'stat', get_pool_stats)
+        metrics.registry.add_gauge_callback(
+            'budget_bot_category_cache', 'Category cache statistics', 'stat', category_cache.stats)
+        metrics.registry.add_gauge_callback(
+            'budget_bot_family_cache', 'Family membership cache statistics', 'stat', family_cache.stats)
+        metrics.registry.add_gauge_callback(
+            'budget_bot_keyboard_cache', 'Dynamic keyboard cache statistics', 'stat',
+            lambda: {'hits': dynamic_keyboards.hits, 'misses': dynamic_keyboards.misses})
+        metrics.registry.add_gauge_callback(
+            'budget_bot_send_queue', 'Outgoing requests waiting for rate limits', 'stat', send_scheduler.stats)
+        metrics.registry.add_gauge_callback(
+            'budget_bot_chart_cache', 'Rendered chart cache statistics', 'stat', chart_cache.stats)
+        metrics.registry.add_gauge_callback(
+            'budget_bot_analytics_cache', 'Columnar analytics cache statistics', 'stat', analytics_cache.stats)
+        await metrics_server.start()
+
+async def post_shutdown(application):
+    """Waits for pending database work and closes the connection pool."""
+    await metrics_server.stop()
+    await flush_pending_writes()
+    shutdown_executor()
+    shutdown_chart_pool()
+    pool = get_pool()
+    print(f"Connection pool stats: {pool.stats()}")
+    pool.close()
+    print(f"Category cache stats: {category_cache.stats()}")
 
 async def error_handler(update, context):
     """Log errors and notify users."""
     from traceback import format_exc
     print(f"Error occurred: {format_exc()}")
+    metrics.ERRORS.inc()
     if update and update.message:
         await update.message.reply_text(
             "Произошла ошибка. Пожалуйста, попробуйте еще раз."
@@ -0,0 +1,31 @@
+import re
+
+# Суммы хранятся и считаются в целых копейках; рубли - только при вводе и выводе
+AMOUNT_RE = re.compile(r'([-+]?)(\d+)(?:[.,](\d{1,2}))?')
+# Наибольшая сумма одной операции (10 млрд руб.): с запасом помещается в
+# INTEGER SQLite вместе с суммами балансов по миллионам таких операций
+MAX_AMOUNT = 10 ** 12
+
+
+def parse_amount(text: str) -> int:
+    """Разбирает сумму в рублях ("1500", "99.9", "12,50") в копейки.
+
+    Пробелы между разрядами допускаются; больше двух знаков после
+    запятой или сумма больше MAX_AMOUNT по модулю - ошибка (ValueError),
+    а не округление.
+    """
+    match = AMOUNT_RE.fullmatch(text.strip().replace('\xa0', '').replace(' ', ''))
+    if not match:
+        raise ValueError(f"Invalid amount: {text}")
+    sign, rubles, kopecks = match.groups()
+    amount = int(rubles) * 100 + int((kopecks or '0').ljust(2, '0'))
+    if amount > MAX_AMOUNT:
+        raise ValueError(f"Amount too large: {text}")
+    return -amount if sign == '-' else amount
+
+
+def format_amount(kopecks: int) -> str:
+    """Копейки в строку рублей с двумя знаками: 150050 -> "1500.50"."""
+    sign = '-' if kopecks < 0 else ''
+    rubles, rest = divmod(abs(kopecks), 100)
+    return f"{sign}{rubles}.{rest:02d}"
@@ -6,7 +6,7 @@ from typing import Optional
 class Transaction:
     user_id: int
     type: str  # 'income' or 'expense'
-    amount: float
+    amount: int  # в копейках
     category: Optional[str] = None
     description: Optional[str] = None
     date: Optional[str] = None
@@ -26,9 +26,29 @@ class MonthlyStats:
     user_id: int
     year: int
     month: int
-    total_income: float
-    total_expense: float
+    total_income: int  # в копейках
+    total_expense: int
 
     @property
-    def balance(self) -> float:
-        return self.total_income - self.total_expense 
\ No newline at end of file
+    def balance(self) -> int:
+        return self.total_income - self.total_expense 
+
+@dataclass
+class Family:
+    family_id: int
+    invite_code: str
+    owner_id: int
+    members: int = 0
+
+@dataclass
+class RecurringRule:
+    user_id: int
+    type: str  # 'income' or 'expense'
+    amount: int  # в копейках
+    category: Optional[str]
+    unit: str  # 'day' or 'month'
+    count: int  # каждые count дней или месяцев
+    next_due: str  # YYYY-MM-DD
+    anchor_day: Optional[int] = None  # число месяца для ежемесячных правил
+    description: Optional[str] = None
+    rule_id: Optional[int] = None
@@ -0,0 +1,278 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from database.db import get_db_connection
+
+ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', '1000'))
+ANALYTICS_CACHE_MAX_BYTES = int(os.getenv('ANALYTICS_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# За какой период считаются распределения сумм, топ описаний и обычные суммы по категориям
+INSIGHT_MONTHS = 12
+TOP_DESCRIPTIONS = 5
+# Выброс: робастный z-score (через медиану и MAD) выше порога в категории,
+# где достаточно истории, среди трат последних ANOMALY_DAYS дней
+ANOMALY_DAYS = 30
+ANOMALY_Z = 3.5
+ANOMALY_MIN_HISTORY = 5
+ANOMALY_LIMIT = 5
+
+_COLUMNS = (('ids', np.int64), ('days', np.int32), ('amounts', np.int64),
+            ('expense', np.bool_), ('categories', np.int32), ('descriptions', np.int32))
+
+
+class UserColumns:
+    """Транзакции пользователя в виде колонок numpy в порядке id.
+
+    Дата - номер дня от 1970-01-01, категория и описание - индексы в списках
+    имен. Колонки растут удвоением емкости: добавление не трогает уже
+    заполненную часть, поэтому снимок (срезы по текущей длине), взятый
+    другим потоком, остается верным.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.max_id = 0
+        self._buffers = {name: np.empty(0, dtype) for name, dtype in _COLUMNS}
+        self.category_names: List[str] = []
+        self.description_names: List[str] = []
+        self._category_codes: Dict[str, int] = {}
+        self._description_codes: Dict[str, int] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    @staticmethod
+    def _encode(values: list, names: List[str], codes: Dict[str, int]) -> np.ndarray:
+        # Словарь обходится по различным значениям, а не по строкам
+        unique, inverse = np.unique(np.array(values, dtype=object), return_inverse=True)
+        mapping = np.empty(len(unique), np.int32)
+        for i, name in enumerate(unique):
+            code = codes.get(name)
+            if code is None:
+                code = codes[name] = len(names)
+                names.append(name)
+            mapping[i] = code
+        return mapping[inverse]
+
+    def append(self, rows: List[tuple]) -> None:
+        """Добавляет строки (id, type, amount, category, description, date) с id > max_id."""
+        if not rows:
+            return
+        ids, types, amounts, categories, descriptions, dates = zip(*rows)
+        new = {
+            'ids': np.array(ids, np.int64),
+            # 'YYYY-MM-DD HH:MM:SS' обрезается до даты при приведении к U10
+            'days': np.array(dates, 'U10').astype('datetime64[D]').astype(np.int32),
+            'amounts': np.array(amounts, np.int64),
+            'expense': np.array(types, 'U7') == 'expense',
+            'categories': self._encode(categories, self.category_names, self._category_codes),
+            'descriptions': self._encode(descriptions, self.description_names, self._description_codes),
+        }
+        end = self.size + len(rows)
+        for name, buffer in self._buffers.items():
+            if end > len(buffer):
+                grown = np.empty(max(end, 2 * len(buffer), 64), buffer.dtype)
+                grown[:self.size] = buffer[:self.size]
+                buffer = self._buffers[name] = grown
+            buffer[self.size:end] = new[name]
+        self.size = end
+        self.max_id = int(new['ids'].max())
+
+    def snapshot(self) -> dict:
+        columns = {name: buffer[:self.size] for name, buffer in self._buffers.items()}
+        columns['category_names'] = list(self.category_names)
+        columns['description_names'] = list(self.description_names)
+        return columns
+
+
+class AnalyticsCache:
+    """LRU-кэш колонок по пользователям, ограниченный числом и объемом.
+
+    Новые транзакции дочитываются по id > max_id при следующем запросе;
+    удаление транзакций сбрасывает пользователя (invalidate).
+    """
+
+    def __init__(self, max_entries: int = ANALYTICS_CACHE_SIZE, max_bytes: int = ANALYTICS_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Растет при каждой инвалидации; защищает от сохранения устаревших колонок
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, user_id: int) -> Optional[UserColumns]:
+        with self._lock:
+            columns = self._data.get(user_id)
+            if columns is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return columns
+
+    def extend(self, user_id: int, columns: UserColumns, rows: List[tuple], version: int) -> Optional[dict]:
+        """Дописывает строки и возвращает снимок; None - колонки успели сбросить."""
+        with self._lock:
+            if version != self._version and self._data.get(user_id) is not columns:
+                return None
+            # Другой поток мог дописать часть этих строк раньше
+            columns.append([row for row in rows if row[0] > columns.max_id])
+            self._data[user_id] = columns
+            self._data.move_to_end(user_id)
+            self._evict()
+            return columns.snapshot()
+
+    def _evict(self) -> None:
+        total = sum(columns.nbytes for columns in self._data.values())
+        while len(self._data) > self.max_entries or (total > self.max_bytes and len(self._data) > 1):
+            _, evicted = self._data.popitem(last=False)
+            total -= evicted.nbytes
+            self.evictions += 1
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._version += 1
+            self._data.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': sum(columns.nbytes for columns in self._data.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+analytics_cache = AnalyticsCache()
+
+
+def _group_medians(groups: np.ndarray, values: np.ndarray, group_count: int):
+    """Медиана values в каждой группе (и размер группы) без цикла по группам."""
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sorted_values = values[order]
+    low = sorted_values[np.minimum(starts + (counts - 1) // 2, len(values) - 1)]
+    high = sorted_values[np.minimum(starts + counts // 2, len(values) - 1)]
+    return (low + high) / 2, counts
+
+
+class TransactionAnalytics:
+    """Аналитика расходов по колоночному представлению транзакций пользователя."""
+
+    @staticmethod
+    def load_columns(user_id: int) -> dict:
+        """Снимок колонок пользователя: из кэша плюс транзакции, добавленные после него."""
+        while True:
+            version = analytics_cache.version
+            columns = analytics_cache.get(user_id)
+            cached = columns is not None
+            if not cached:
+                columns = UserColumns()
+            with get_db_connection(user_id) as conn:
+                c = conn.cursor()
+                c.execute("""SELECT id, type, amount, COALESCE(category, ''), COALESCE(description, ''), date
+                             FROM transactions
+                             WHERE user_id = ? AND id > ?
+                             ORDER BY id""", (user_id, columns.max_id))
+                rows = c.fetchall()
+            if not cached:
+                # Полная загрузка собирается вне блокировки кэша
+                columns.append(rows)
+                rows = []
+            snapshot = analytics_cache.extend(user_id, columns, rows, version)
+            if snapshot is not None:
+                return snapshot
+
+    @staticmethod
+    def compute_insights(columns: dict, today: date) -> dict:
+        """Метрики по снимку колонок; суммы в копейках."""
+        days, amounts, expense = columns['days'], columns['amounts'], columns['expense']
+        today_day = int(np.datetime64(today, 'D').astype(np.int64))
+        current_month = int(np.datetime64(today, 'M').astype(np.int64))
+        first_month = current_month - INSIGHT_MONTHS + 1
+
+        months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        in_window = (months >= first_month) & (months <= current_month)
+        spent = expense & in_window
+        monthly_expense = np.bincount(months[spent] - first_month, weights=amounts[spent],
+                                      minlength=INSIGHT_MONTHS).astype(np.int64)
+        earned = ~expense & in_window
+        monthly_income = np.bincount(months[earned] - first_month, weights=amounts[earned],
+                                     minlength=INSIGHT_MONTHS).astype(np.int64)
+        moving_average = np.convolve(monthly_expense, np.ones(3) / 3, mode='valid')
+
+        # Месяц к месяцу на ту же дату: начало текущего месяца против того же числа дней прошлого
+        month_start = int(np.datetime64(today, 'M').astype('datetime64[D]').astype(np.int64))
+        previous_start = int((np.datetime64(today, 'M') - 1).astype('datetime64[D]').astype(np.int64))
+        elapsed = today_day - month_start
+        month_to_date = int(amounts[expense & (days >= month_start) & (days <= today_day)].sum())
+        previous_to_date = int(amounts[expense & (days >= previous_start)
+                                       & (days <= min(previous_start + elapsed, month_start - 1))].sum())
+
+        window_amounts = amounts[spent]
+        percentiles = (np.percentile(window_amounts, [50, 90, 99]).round().astype(np.int64).tolist()
+                       if len(window_amounts) else [])
+
+        descriptions = columns['descriptions'][spent]
+        names = columns['description_names']
+        totals = np.bincount(descriptions, weights=window_amounts, minlength=len(names))
+        counts = np.bincount(descriptions, minlength=len(names))
+        if '' in names:
+            totals[names.index('')] = 0
+        top = [(names[i], int(totals[i]), int(counts[i]))
+               for i in np.argsort(totals)[::-1][:TOP_DESCRIPTIONS] if totals[i] > 0]
+
+        anomalies = []
+        if len(window_amounts):
+            categories = columns['categories'][spent]
+            group_count = len(columns['category_names'])
+            values = window_amounts.astype(np.float64)
+            medians, sizes = _group_medians(categories, values, group_count)
+            deviations = np.abs(values - medians[categories])
+            mads, _ = _group_medians(categories, deviations, group_count)
+            mad = mads[categories]
+            score = np.divide(0.6745 * (values - medians[categories]), mad,
+                              out=np.zeros_like(values), where=mad > 0)
+            flagged = np.flatnonzero((score > ANOMALY_Z) & (sizes[categories] >= ANOMALY_MIN_HISTORY)
+                                     & (days[spent] > today_day - ANOMALY_DAYS))
+            for i in flagged[np.argsort(score[flagged])[::-1]][:ANOMALY_LIMIT]:
+                anomalies.append({
+                    'date': date.fromordinal(int(days[spent][i]) + date(1970, 1, 1).toordinal()),
+                    'category': columns['category_names'][categories[i]],
+                    'description': names[descriptions[i]],
+                    'amount': int(window_amounts[i]),
+                    'typical': int(round(medians[categories[i]])),
+                })
+
+        return {
+            'months': [str(np.datetime64(first_month + i, 'M')) for i in range(INSIGHT_MONTHS)],
+            'monthly_expense': monthly_expense.tolist(),
+            'monthly_income': monthly_income.tolist(),
+            'moving_average': moving_average.round().astype(np.int64).tolist(),
+            'month_to_date': month_to_date,
+            'previous_to_date': previous_to_date,
+            'percentiles': percentiles,
+            'top_descriptions': top,
+            'anomalies': anomalies,
+        }
+
+    @staticmethod
+    def get_insights(user_id: int, today: Optional[date] = None) -> dict:
+        return TransactionAnalytics.compute_insights(TransactionAnalytics.load_columns(user_id),
+                                                     today or date.today())
@@ -0,0 +1,217 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from tempfile import SpooledTemporaryFile
+from typing import Callable, List, Optional, Tuple
+from database.db import get_pool
+from models.transaction import Transaction, Category, Family, MonthlyStats, RecurringRule
+from services.analytics import TransactionAnalytics
+from services.category_cache import category_cache
+from services.family_cache import family_cache, NOT_CACHED
+from services.family_service import FamilyService
+from services.recurring_service import RecurringService
+from services.csv_import import import_csv
+from services.export import export_transactions
+from services.transaction_service import TransactionService
+from services.write_queue import WriteBehindQueue
+
+# Размер пула потоков для работы с базой данных
+DB_WORKERS = int(os.getenv('DB_WORKERS', '4'))
+
+# Групповой коммит новых транзакций (выключен по умолчанию)
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', '0') == '1'
+WRITE_FLUSH_MS = float(os.getenv('WRITE_FLUSH_MS', '5'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+
+# Все обращения к SQLite выполняются в отдельных потоках, у каждого из которых
+# свои соединения, поэтому event loop не блокируется на время запроса.
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db-worker')
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле потоков."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+async def _write_shard_group(transactions: List[Transaction]) -> None:
+    await run_in_db_thread(TransactionService.add_transactions, transactions)
+
+# Шарды - разные файлы со своими блокировками, поэтому группы пишутся параллельно
+_write_queue = WriteBehindQueue(_write_shard_group, WRITE_FLUSH_MS / 1000, WRITE_BATCH_SIZE,
+                                group_key=lambda transaction: get_pool().shard_for(transaction.user_id))
+
+
+async def flush_pending_writes() -> None:
+    """Записывает транзакции, оставшиеся в очереди группового коммита."""
+    await _write_queue.close()
+
+
+def shutdown_executor() -> None:
+    """Дожидается завершения запросов и останавливает пул потоков."""
+    _executor.shutdown(wait=True)
+
+
+class AsyncTransactionService:
+    """Асинхронная обертка над TransactionService для использования в хендлерах."""
+
+    @staticmethod
+    async def add_transaction(transaction: Transaction) -> None:
+        if WRITE_BEHIND:
+            # Возвращается после фиксации пачки, в которую попала транзакция
+            await _write_queue.submit(transaction)
+        else:
+            await run_in_db_thread(TransactionService.add_transaction, transaction)
+
+    @staticmethod
+    async def add_transactions(transactions: List[Transaction]) -> None:
+        await run_in_db_thread(TransactionService.add_transactions, transactions)
+
+    @staticmethod
+    async def get_balance(user_id: int) -> int:
+        return await run_in_db_thread(TransactionService.get_balance, user_id)
+
+    @staticmethod
+    async def get_monthly_stats(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> MonthlyStats:
+        return await run_in_db_thread(TransactionService.get_monthly_stats, user_id, year, month)
+
+    @staticmethod
+    async def get_monthly_trend(user_id: int, months: int = 12) -> List[MonthlyStats]:
+        return await run_in_db_thread(TransactionService.get_monthly_trend, user_id, months)
+
+    @staticmethod
+    async def get_transactions_by_category(user_id: int, category: str, transaction_type: str) -> List[Transaction]:
+        return await run_in_db_thread(TransactionService.get_transactions_by_category,
+                                      user_id, category, transaction_type)
+
+    @staticmethod
+    async def get_transactions_page(user_id: int, limit: int = 10,
+                                    before: Optional[Tuple[str, int]] = None,
+                                    after: Optional[Tuple[str, int]] = None,
+                                    transaction_type: Optional[str] = None,
+                                    category: Optional[str] = None,
+                                    date_from: Optional[str] = None,
+                                    date_to: Optional[str] = None) -> Tuple[List[tuple], bool]:
+        return await run_in_db_thread(TransactionService.get_transactions_page, user_id, limit, before, after,
+                                      transaction_type, category, date_from, date_to)
+
+    @staticmethod
+    async def get_category_stats(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> dict:
+        return await run_in_db_thread(TransactionService.get_category_stats, user_id, year, month)
+
+    @staticmethod
+    async def get_period_stats(user_id: int, date_from: date, date_to: date) -> dict:
+        return await run_in_db_thread(TransactionService.get_period_stats, user_id, date_from, date_to)
+
+    @staticmethod
+    async def add_category(category: Category) -> None:
+        await run_in_db_thread(TransactionService.add_category, category)
+
+    @staticmethod
+    async def get_categories(user_id: int, category_type: str) -> List[str]:
+        # Попадание в кэш обслуживается прямо в event loop, без похода в пул потоков
+        categories = category_cache.get(user_id, category_type)
+        if categories is None:
+            categories = await run_in_db_thread(TransactionService.load_categories, user_id, category_type)
+        return categories
+
+    @staticmethod
+    async def delete_category(user_id: int, category_name: str, category_type: str) -> bool:
+        return await run_in_db_thread(TransactionService.delete_category, user_id, category_name, category_type)
+
+    @staticmethod
+    async def clear_transactions(user_id: int, transaction_type: Optional[str] = None) -> None:
+        await run_in_db_thread(TransactionService.clear_transactions, user_id, transaction_type)
+
+    @staticmethod
+    async def clear_categories(user_id: int, category_type: Optional[str] = None) -> None:
+        await run_in_db_thread(TransactionService.clear_categories, user_id, category_type)
+
+    @staticmethod
+    async def import_csv(user_id: int, path: str, progress: Optional[Callable[[int], None]] = None) -> Tuple[int, int]:
+        return await run_in_db_thread(import_csv, user_id, path, progress)
+
+    @staticmethod
+    async def export_transactions(user_id: int, fmt: str = 'csv',
+                                  compress: bool = False) -> Tuple[SpooledTemporaryFile, str, int]:
+        return await run_in_db_thread(export_transactions, user_id, fmt, compress)
+
+
+class AsyncFamilyService:
+    """Асинхронная обертка над FamilyService."""
+
+    @staticmethod
+    async def get_family_id(user_id: int) -> Optional[int]:
+        # Попадание в кэш членства обслуживается прямо в event loop
+        family_id = family_cache.get(user_id)
+        if family_id is NOT_CACHED:
+            family_id = await run_in_db_thread(FamilyService.get_family_id, user_id)
+        return family_id
+
+    @staticmethod
+    async def get_family(family_id: int) -> Optional[Family]:
+        return await run_in_db_thread(FamilyService.get_family, family_id)
+
+    @staticmethod
+    async def family_exists(family_id: int) -> bool:
+        return await run_in_db_thread(FamilyService.family_exists, family_id)
+
+    @staticmethod
+    async def forget_missing_family(user_id: int, family_id: int) -> bool:
+        return await run_in_db_thread(FamilyService.forget_missing_family, user_id, family_id)
+
+    @staticmethod
+    async def create_family(user_id: int) -> Family:
+        return await run_in_db_thread(FamilyService.create_family, user_id)
+
+    @staticmethod
+    async def join_family(user_id: int, invite_code: str) -> Optional[Family]:
+        return await run_in_db_thread(FamilyService.join_family, user_id, invite_code)
+
+    @staticmethod
+    async def leave_family(user_id: int) -> bool:
+        return await run_in_db_thread(FamilyService.leave_family, user_id)
+
+    @staticmethod
+    async def get_family_balance(family_id: int) -> int:
+        return await run_in_db_thread(FamilyService.get_family_balance, family_id)
+
+    @staticmethod
+    async def get_family_monthly_stats(family_id: int, year: Optional[int] = None,
+                                       month: Optional[int] = None) -> MonthlyStats:
+        return await run_in_db_thread(FamilyService.get_family_monthly_stats, family_id, year, month)
+
+    @staticmethod
+    async def get_family_period_stats(family_id: int, date_from: date, date_to: date) -> dict:
+        return await run_in_db_thread(FamilyService.get_family_period_stats, family_id, date_from, date_to)
+
+
+class AsyncAnalyticsService:
+    """Асинхронная обертка над TransactionAnalytics."""
+
+    @staticmethod
+    async def get_insights(user_id: int, today: Optional[date] = None) -> dict:
+        # numpy отпускает GIL на больших массивах, поэтому расчет тоже идет в пуле потоков
+        return await run_in_db_thread(TransactionAnalytics.get_insights, user_id, today)
+
+
+class AsyncRecurringService:
+    """Асинхронная обертка над RecurringService."""
+
+    @staticmethod
+    async def add_rule(rule: RecurringRule) -> int:
+        return await run_in_db_thread(RecurringService.add_rule, rule)
+
+    @staticmethod
+    async def get_rules(user_id: int) -> List[RecurringRule]:
+        return await run_in_db_thread(RecurringService.get_rules, user_id)
+
+    @staticmethod
+    async def delete_rule(user_id: int, rule_id: int) -> bool:
+        return await run_in_db_thread(RecurringService.delete_rule, user_id, rule_id)
+
+    @staticmethod
+    async def post_due(today: Optional[date] = None) -> List[Tuple[int, List[Transaction]]]:
+        return await run_in_db_thread(RecurringService.post_due, today)
@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+CATEGORY_CACHE_SIZE = int(os.getenv('CATEGORY_CACHE_SIZE', '10000'))
+CATEGORY_CACHE_MAX_BYTES = int(os.getenv('CATEGORY_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+
+class CategoryCache:
+    """LRU-кэш списков категорий по ключу (user_id, type).
+
+    Ограничен числом записей и примерным объемом памяти. Используется из
+    потоков пула БД и из event loop, поэтому все операции под блокировкой.
+    """
+
+    def __init__(self, max_entries: int = CATEGORY_CACHE_SIZE, max_bytes: int = CATEGORY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Растет при каждой инвалидации; защищает от записи устаревшего списка
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(categories: tuple) -> int:
+        return sys.getsizeof(categories) + sum(sys.getsizeof(name) for name in categories)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, user_id: int, category_type: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._data.get((user_id, category_type))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end((user_id, category_type))
+            self.hits += 1
+            return list(entry[0])
+
+    def put(self, user_id: int, category_type: str, categories: List[str], version: int) -> None:
+        """Сохраняет список, если с момента чтения (version) не было инвалидаций."""
+        categories = tuple(categories)
+        size = self._sizeof(categories)
+        with self._lock:
+            if version != self._version or size > self.max_bytes:
+                return
+            key = (user_id, category_type)
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (categories, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, user_id: int, category_type: Optional[str] = None) -> None:
+        types = (category_type,) if category_type else ('income', 'expense')
+        with self._lock:
+            self._version += 1
+            for typ in types:
+                entry = self._data.pop((user_id, typ), None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+category_cache = CategoryCache()
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import signal
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+# Процессы, в которых рисуются графики: рендеринг занимает процессор на
+# десятки миллисекунд и в event loop задерживал бы все остальные апдейты
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', '10000'))
+CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Категорий на круговой диаграмме; остальные объединяются в "Другое"
+PIE_CATEGORIES = 7
+
+_pool = None
+_pool_failed = False
+
+
+def chart_version(*data) -> str:
+    """Версия данных графика: меняется вместе с любым из чисел, которые на нем нарисованы."""
+    return hashlib.blake2b(repr(data).encode(), digest_size=8).hexdigest()
+
+
+def render_chart(title: str, expenses: List[Tuple[str, int]], trend: List[Tuple[str, int, int]]) -> bytes:
+    """PNG: расходы по категориям за период и доходы/расходы по месяцам.
+
+    Выполняется в процессе пула; суммы приходят в копейках.
+    """
+    # Импорт здесь: matplotlib нужен только процессам пула
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(11, 4.5), dpi=100)
+    pie, bars = figure.subplots(1, 2, gridspec_kw={'width_ratios': [1, 1.4]})
+
+    expenses = sorted(expenses, key=lambda item: item[1], reverse=True)
+    if len(expenses) > PIE_CATEGORIES:
+        rest = sum(amount for _, amount in expenses[PIE_CATEGORIES - 1:])
+        expenses = expenses[:PIE_CATEGORIES - 1] + [('Другое', rest)]
+    if expenses:
+        pie.pie([amount / 100 for _, amount in expenses],
+                labels=[name or 'Без категории' for name, _ in expenses],
+                autopct='%1.0f%%', startangle=90, counterclock=False)
+        pie.axis('equal')
+    else:
+        pie.text(0.5, 0.5, 'Расходов нет', ha='center', va='center')
+        pie.axis('off')
+    pie.set_title(f'Расходы {title}')
+
+    positions = range(len(trend))
+    bars.bar([x - 0.2 for x in positions], [income / 100 for _, income, _ in trend],
+             width=0.4, label='Доходы', color='#4caf50')
+    bars.bar([x + 0.2 for x in positions], [expense / 100 for _, _, expense in trend],
+             width=0.4, label='Расходы', color='#e53935')
+    bars.set_xticks(list(positions), [label for label, _, _ in trend], rotation=45)
+    bars.set_ylabel('руб.')
+    bars.set_title('По месяцам')
+    bars.legend()
+    bars.grid(axis='y', alpha=0.3)
+
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def _init_worker() -> None:
+    # Ctrl+C получает вся группа процессов; останавливает пул сам бот
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _pool_context():
+    # fork создает процессы сразу и без повторного импорта модулей; где fork
+    # нет (Windows), используется способ платформы по умолчанию (spawn)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def start_chart_pool() -> bool:
+    """Запускает процессы пула; False - пул недоступен и /chart отключен.
+
+    Вызывается при старте бота, до того как появятся потоки пула БД: с
+    fork все процессы создаются сразу, а форк процесса с потоками опасен.
+    Ошибка запуска не останавливает бота и не повторяется.
+    """
+    global _pool, _pool_failed
+    if _pool is None and not _pool_failed:
+        try:
+            pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=_pool_context(),
+                                       initializer=_init_worker)
+            # С fork первая задача сразу создает все процессы пула
+            pool.submit(chart_version)
+        except (OSError, ValueError, RuntimeError) as e:
+            _pool_failed = True
+            print(f"Chart pool is unavailable, /chart is disabled: {e}")
+            return False
+        _pool = pool
+    return _pool is not None
+
+
+def shutdown_chart_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+async def render_in_pool(title: str, expenses: list, trend: list) -> Optional[bytes]:
+    """PNG графика; None - пул процессов недоступен."""
+    if not start_chart_pool():
+        return None
+    return await asyncio.get_running_loop().run_in_executor(_pool, render_chart, title, expenses, trend)
+
+
+class ChartCache:
+    """LRU-кэш графиков: PNG и file_id отправленной картинки.
+
+    Для пары (user_id, period) хранится только последняя версия данных:
+    запрос с другой версией - промах, а новая версия заменяет старую.
+    Ограничен числом записей и суммарным размером PNG.
+    """
+
+    def __init__(self, max_entries: int = CHART_CACHE_SIZE, max_bytes: int = CHART_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # (user_id, period) -> [version, png, file_id]
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int, period: str, version: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """(png, file_id) для этой версии данных или None."""
+        with self._lock:
+            entry = self._data.get((user_id, period))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._data.move_to_end((user_id, period))
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, user_id: int, period: str, version: str, png: bytes, file_id: Optional[str] = None) -> None:
+        if len(png) > self.max_bytes:
+            return
+        with self._lock:
+            key = (user_id, period)
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._data[key] = [version, png, file_id]
+            self._bytes += len(png)
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def forget_file_id(self, user_id: int, period: str) -> None:
+        """file_id больше не принимается Telegram - в следующий раз PNG загрузится заново."""
+        with self._lock:
+            entry = self._data.get((user_id, period))
+            if entry is not None:
+                entry[2] = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+chart_cache = ChartCache()
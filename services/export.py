@@ -0,0 +1,74 @@
+import csv
+import gzip
+import io
+import json
+import os
+from tempfile import SpooledTemporaryFile
+from typing import Tuple
+
+from models.money import format_amount
+from services.transaction_service import TransactionService
+
+# Сколько байт выгрузки держать в памяти, прежде чем SpooledTemporaryFile уйдет на диск
+EXPORT_SPOOL_SIZE = int(os.getenv('EXPORT_SPOOL_SIZE', str(1024 * 1024)))
+# Сколько строк читать из курсора за один fetchmany
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_COLUMNS = ('id', 'date', 'type', 'amount', 'category', 'description')
+
+
+def _rows(user_id: int):
+    # Суммы выгружаются в рублях строкой "1500.50", без перевода в float
+    for transaction_id, date, typ, amount, category, description in \
+            TransactionService.iter_transactions(user_id, EXPORT_BATCH_SIZE):
+        yield transaction_id, date, typ, format_amount(amount), category, description
+
+
+def _write_csv(stream: io.TextIOBase, rows) -> int:
+    writer = csv.writer(stream)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_jsonl(stream: io.TextIOBase, rows) -> int:
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def export_transactions(user_id: int, fmt: str = 'csv', compress: bool = False) -> Tuple[SpooledTemporaryFile, str, int]:
+    """Выгружает историю пользователя во временный файл.
+
+    Строки идут из курсора порциями и сразу пишутся в файл, поэтому память
+    не зависит от объема истории. Возвращает (файл, имя файла, число строк);
+    файл открыт и перемотан в начало, закрыть его должен вызывающий код.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    spool = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+b')
+    try:
+        target = gzip.GzipFile(fileobj=spool, mode='wb') if compress else spool
+        stream = io.TextIOWrapper(target, encoding='utf-8', newline='')
+        rows = _rows(user_id)
+        count = _write_csv(stream, rows) if fmt == 'csv' else _write_jsonl(stream, rows)
+        stream.flush()
+        # Отвязываем обертку, чтобы ее закрытие не закрыло сам файл
+        stream.detach()
+        if compress:
+            target.close()
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+
+    filename = f"transactions.{fmt}" + ('.gz' if compress else '')
+    return spool, filename, count
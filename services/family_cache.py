@@ -0,0 +1,59 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+FAMILY_CACHE_SIZE = int(os.getenv('FAMILY_CACHE_SIZE', '100000'))
+
+# Возвращается get(), если пользователя нет в кэше; None означает "не состоит в семье"
+NOT_CACHED = object()
+
+
+class FamilyCache:
+    """LRU-кэш членства в семье: user_id -> family_id или None.
+
+    Как и CategoryCache, защищен блокировкой и счетчиком версий, чтобы
+    значение, прочитанное до вступления или выхода из семьи, не попало в кэш.
+    """
+
+    def __init__(self, max_entries: int = FAMILY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, user_id: int):
+        with self._lock:
+            if user_id not in self._data:
+                self.misses += 1
+                return NOT_CACHED
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return self._data[user_id]
+
+    def put(self, user_id: int, family_id: Optional[int], version: int) -> None:
+        with self._lock:
+            if version != self._version:
+                return
+            self._data[user_id] = family_id
+            self._data.move_to_end(user_id)
+            if len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._version += 1
+            self._data.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+family_cache = FamilyCache()
@@ -0,0 +1,275 @@
+import secrets
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Optional
+
+from database.db import get_db_connection, get_pool, get_shard_connection, shard_count
+from models.transaction import Family, MonthlyStats
+from services import rollups
+from services.family_cache import family_cache, NOT_CACHED
+
+
+class FamilyService:
+    """Семейные бюджеты: состав семьи и общие агрегаты участников.
+
+    Каталог семей (families) хранится в шарде 0, членство - в строке
+    пользователя в его шарде. family_balances и family_monthly_stats каждого
+    шарда хранят суммы по участникам из этого шарда: при вступлении в семью
+    к ним прибавляются агрегаты пользователя, при выходе вычитаются, а новые
+    транзакции учитываются в TransactionService в той же транзакции записи.
+    Итоги семьи - сумма по всем шардам.
+
+    Вступление в семью и удаление опустевшей семьи из каталога идут под
+    блокировкой записи каталога, поэтому участник не может вступить в семью,
+    которую в этот момент удаляют.
+    """
+
+    @staticmethod
+    def get_family_id(user_id: int) -> Optional[int]:
+        """Семья пользователя (None - личный бюджет); значение кэшируется."""
+        family_id = family_cache.get(user_id)
+        if family_id is not NOT_CACHED:
+            return family_id
+
+        version = family_cache.version
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("SELECT family_id FROM users WHERE user_id = ?", (user_id,))
+            result = c.fetchone()
+        family_id = result[0] if result else None
+        family_cache.put(user_id, family_id, version)
+        return family_id
+
+    @staticmethod
+    def get_family(family_id: int) -> Optional[Family]:
+        with get_db_connection() as conn:
+            c = conn.cursor()
+            c.execute("""SELECT family_id, invite_code, owner_id
+                         FROM families
+                         WHERE family_id = ?""", (family_id,))
+            result = c.fetchone()
+        if result is None:
+            return None
+        return Family(*result, members=FamilyService._count_members(family_id))
+
+    @staticmethod
+    def family_exists(family_id: int) -> bool:
+        with get_db_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT 1 FROM families WHERE family_id = ?", (family_id,))
+            return c.fetchone() is not None
+
+    @staticmethod
+    def _count_members(family_id: int, catalog=None) -> int:
+        """Участники во всех шардах; catalog - курсор шарда 0, если он уже открыт."""
+        members = 0
+        for index in range(shard_count()):
+            if index == 0 and catalog is not None:
+                catalog.execute("SELECT COUNT(*) FROM users WHERE family_id = ?", (family_id,))
+                members += catalog.fetchone()[0]
+                continue
+            with get_shard_connection(index) as conn:
+                c = conn.cursor()
+                c.execute("SELECT COUNT(*) FROM users WHERE family_id = ?", (family_id,))
+                members += c.fetchone()[0]
+        return members
+
+    @staticmethod
+    @contextmanager
+    def _catalog_and_user_shard(user_id: int):
+        """(курсор каталога, курсор шарда пользователя) под блокировкой записи каталога.
+
+        Блокировки берутся всегда в порядке каталог -> шард, шард фиксируется
+        первым. Если пользователь в шарде 0, это один и тот же курсор.
+        """
+        with get_db_connection() as catalog:
+            cc = catalog.cursor()
+            cc.execute("BEGIN IMMEDIATE")
+            if get_pool().shard_for(user_id) == 0:
+                yield cc, cc
+            else:
+                with get_db_connection(user_id) as conn:
+                    yield cc, conn.cursor()
+                    conn.commit()
+            catalog.commit()
+
+    @staticmethod
+    def create_family(user_id: int) -> Family:
+        """Создает семью и делает пользователя ее первым участником."""
+        # Каталог и шард пользователя могут быть одним файлом, поэтому транзакции
+        # идут по очереди, а не вложенно
+        with get_db_connection() as conn:
+            c = conn.cursor()
+            while True:
+                invite_code = secrets.token_hex(4).upper()
+                c.execute("INSERT OR IGNORE INTO families (invite_code, owner_id) VALUES (?, ?)",
+                          (invite_code, user_id))
+                if c.rowcount:
+                    break
+            family_id = c.lastrowid
+            conn.commit()
+
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            # Первая запись захватывает блокировку, дальше все читается уже под ней
+            c.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            previous = FamilyService._leave(c, user_id)
+            FamilyService._join(c, user_id, family_id)
+            conn.commit()
+        family_cache.invalidate(user_id)
+        FamilyService._drop_if_empty(previous)
+        return Family(family_id, invite_code, user_id, 1)
+
+    @staticmethod
+    def join_family(user_id: int, invite_code: str) -> Optional[Family]:
+        """Вступление в семью по коду приглашения. None - код не найден."""
+        previous = None
+        with FamilyService._catalog_and_user_shard(user_id) as (catalog, c):
+            catalog.execute("SELECT family_id FROM families WHERE invite_code = ?",
+                            (invite_code.strip().upper(),))
+            result = catalog.fetchone()
+            if result is None:
+                return None
+            family_id = result[0]
+
+            c.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            c.execute("SELECT family_id FROM users WHERE user_id = ?", (user_id,))
+            if c.fetchone()[0] != family_id:
+                previous = FamilyService._leave(c, user_id)
+                FamilyService._join(c, user_id, family_id)
+        family_cache.invalidate(user_id)
+        FamilyService._drop_if_empty(previous)
+        return FamilyService.get_family(family_id)
+
+    @staticmethod
+    def forget_missing_family(user_id: int, family_id: int) -> bool:
+        """Выводит пользователя из семьи, которой нет в каталоге. False - семья на месте."""
+        with FamilyService._catalog_and_user_shard(user_id) as (catalog, c):
+            catalog.execute("SELECT 1 FROM families WHERE family_id = ?", (family_id,))
+            if catalog.fetchone():
+                return False
+            c.execute("SELECT family_id FROM users WHERE user_id = ?", (user_id,))
+            result = c.fetchone()
+            if result and result[0] == family_id:
+                FamilyService._leave(c, user_id)
+        family_cache.invalidate(user_id)
+        return True
+
+    @staticmethod
+    def leave_family(user_id: int) -> bool:
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            previous = FamilyService._leave(c, user_id)
+            conn.commit()
+        family_cache.invalidate(user_id)
+        FamilyService._drop_if_empty(previous)
+        return previous is not None
+
+    @staticmethod
+    def _join(c, user_id: int, family_id: int) -> None:
+        c.execute("UPDATE users SET family_id = ?, budget_type = 'family' WHERE user_id = ?",
+                  (family_id, user_id))
+        FamilyService._move_aggregates(c, user_id, family_id, 1)
+
+    @staticmethod
+    def _leave(c, user_id: int) -> Optional[int]:
+        """Выводит пользователя из семьи в его шарде; возвращает family_id прежней семьи."""
+        c.execute("SELECT family_id FROM users WHERE user_id = ?", (user_id,))
+        result = c.fetchone()
+        if not result or result[0] is None:
+            return None
+        family_id = result[0]
+        c.execute("UPDATE users SET family_id = NULL, budget_type = 'personal' WHERE user_id = ?", (user_id,))
+        c.execute("SELECT 1 FROM users WHERE family_id = ? LIMIT 1", (family_id,))
+        if c.fetchone():
+            FamilyService._move_aggregates(c, user_id, family_id, -1)
+        else:
+            # Последний участник семьи в этом шарде: его агрегаты семьи больше не нужны
+            c.execute("DELETE FROM family_balances WHERE family_id = ?", (family_id,))
+            c.execute("DELETE FROM family_monthly_stats WHERE family_id = ?", (family_id,))
+        return family_id
+
+    @staticmethod
+    def _drop_if_empty(family_id: Optional[int]) -> None:
+        """Удаляет семью из каталога, если в ней не осталось участников ни в одном шарде."""
+        if family_id is None:
+            return
+        with get_db_connection() as conn:
+            c = conn.cursor()
+            # Подсчет и удаление под одной блокировкой: join_family ждет ее, чтобы вступить
+            c.execute("BEGIN IMMEDIATE")
+            if FamilyService._count_members(family_id, c):
+                return
+            c.execute("DELETE FROM families WHERE family_id = ?", (family_id,))
+            conn.commit()
+
+    @staticmethod
+    def _move_aggregates(c, user_id: int, family_id: int, sign: int) -> None:
+        """Прибавляет (sign=1) или вычитает (sign=-1) агрегаты пользователя из агрегатов семьи."""
+        c.execute("""INSERT INTO family_balances (family_id, total_income, total_expense)
+                     SELECT ?, ? * total_income, ? * total_expense FROM user_balances WHERE user_id = ?
+                     ON CONFLICT (family_id) DO UPDATE
+                     SET total_income = total_income + excluded.total_income,
+                         total_expense = total_expense + excluded.total_expense""",
+                  (family_id, sign, sign, user_id))
+        c.execute("""INSERT INTO family_monthly_stats (family_id, year, month, total_income, total_expense)
+                     SELECT ?, year, month, ? * total_income, ? * total_expense FROM monthly_stats WHERE user_id = ?
+                     ON CONFLICT (family_id, year, month) DO UPDATE
+                     SET total_income = total_income + excluded.total_income,
+                         total_expense = total_expense + excluded.total_expense""",
+                  (family_id, sign, sign, user_id))
+
+    @staticmethod
+    def get_family_balance(family_id: int) -> int:
+        balance = 0
+        for index in range(shard_count()):
+            with get_shard_connection(index) as conn:
+                c = conn.cursor()
+                c.execute("""SELECT total_income - total_expense
+                             FROM family_balances
+                             WHERE family_id = ?""", (family_id,))
+                result = c.fetchone()
+            balance += result[0] if result else 0
+        return balance
+
+    @staticmethod
+    def get_family_monthly_stats(family_id: int, year: Optional[int] = None,
+                                 month: Optional[int] = None) -> MonthlyStats:
+        now = datetime.now()
+        query_year = year or now.year
+        query_month = month or now.month
+
+        # В MonthlyStats для семьи в поле user_id хранится family_id
+        stats = MonthlyStats(family_id, query_year, query_month, 0, 0)
+        for index in range(shard_count()):
+            with get_shard_connection(index) as conn:
+                c = conn.cursor()
+                c.execute("""SELECT total_income, total_expense
+                             FROM family_monthly_stats
+                             WHERE family_id = ? AND year = ? AND month = ?""",
+                          (family_id, query_year, query_month))
+                result = c.fetchone()
+            if result:
+                stats.total_income += result[0]
+                stats.total_expense += result[1]
+        return stats
+
+    @staticmethod
+    def get_family_period_stats(family_id: int, date_from: date, date_to: date) -> dict:
+        """Доходы и расходы семьи по категориям: агрегаты category_rollups всех участников."""
+        stats = {'total_income': 0, 'total_expense': 0, 'income_by_category': {}, 'expense_by_category': {}}
+        for index in range(shard_count()):
+            with get_shard_connection(index) as conn:
+                shard_stats = rollups.read_period(
+                    conn.cursor(), "r.user_id IN (SELECT user_id FROM users WHERE family_id = ?)",
+                    [family_id], date_from, date_to)
+            for typ in ('income', 'expense'):
+                stats[f'total_{typ}'] += shard_stats[f'total_{typ}']
+                by_category = stats[f'{typ}_by_category']
+                for category, total in shard_stats[f'{typ}_by_category'].items():
+                    by_category[category] = by_category.get(category, 0) + total
+        for typ in ('income', 'expense'):
+            # Порядок по убыванию суммы, как и в выборке одного шарда
+            stats[f'{typ}_by_category'] = dict(sorted(stats[f'{typ}_by_category'].items(),
+                                                      key=lambda item: item[1], reverse=True))
+        return stats
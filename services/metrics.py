@@ -0,0 +1,218 @@
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from database.db import set_statement_observer
+
+# Метрики включаются указанием порта, на котором они отдаются в формате Prometheus
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Доля замеряемых вызовов: 1.0 - все, 0.1 - каждый десятый в среднем
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '1.0'))
+LOOP_LAG_INTERVAL = float(os.getenv('METRICS_LOOP_LAG_INTERVAL', '0.5'))
+
+enabled = METRICS_PORT > 0
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def should_sample() -> bool:
+    return enabled and (METRICS_SAMPLE_RATE >= 1.0 or random.random() < METRICS_SAMPLE_RATE)
+
+
+def _format_labels(names: Tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{str(value)}"'.replace('\n', ' ') for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счетчики по корзинам..., сумма, количество]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(data)) for labels, data in self._values.items()]
+        for labels, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {data[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {data[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_gauge_callback(self, name: str, documentation: str, label: str, func: Callable[[], dict]) -> None:
+        """Регистрирует набор gauge-значений, которые вычисляются при каждом запросе метрик."""
+        self._gauges.append((name, documentation, label, func))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, label, func in self._gauges:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in func().items():
+                lines.append(f'{name}{{{label}="{key}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HANDLER_LATENCY = registry.register(Histogram(
+    'budget_bot_handler_seconds', 'Handler latency by conversation state', ('state', 'handler')))
+HANDLER_ERRORS = registry.register(Counter(
+    'budget_bot_handler_errors_total', 'Exceptions raised by handlers', ('state', 'handler')))
+SQL_LATENCY = registry.register(Histogram(
+    'budget_bot_sql_seconds', 'SQL statement latency', ('caller', 'statement')))
+SQL_ROWS = registry.register(Counter(
+    'budget_bot_sql_rows_total', 'Rows returned or changed by SQL statements', ('caller', 'statement')))
+ERRORS = registry.register(Counter(
+    'budget_bot_errors_total', 'Errors reported to the application error handler'))
+LOOP_LAG = registry.register(Histogram(
+    'budget_bot_event_loop_lag_seconds', 'Event loop wake-up delay',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+SEND_WAIT = registry.register(Histogram(
+    'budget_bot_send_wait_seconds', 'Time an outgoing request waited for rate limits', ('priority',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)))
+SEND_RETRY_AFTER = registry.register(Counter(
+    'budget_bot_send_retry_after_total', 'RetryAfter (429) responses from the Bot API', ('priority',)))
+
+
+def timed_handler(state: str, callback):
+    """Оборачивает хендлер замером времени с меткой состояния ConversationHandler."""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if not should_sample():
+            return await callback(update, context)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc((state, name))
+            raise
+        finally:
+            HANDLER_LATENCY.observe((state, name), time.perf_counter() - started)
+
+    return wrapper
+
+
+def _observe_statement(caller: str, statement: str, elapsed, rows: int) -> None:
+    if elapsed is not None:
+        SQL_LATENCY.observe((caller, statement), elapsed)
+    if rows > 0:
+        SQL_ROWS.inc((caller, statement), rows)
+
+
+async def sample_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Периодически меряет, насколько позже запланированного просыпается event loop."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe((), max(0.0, time.perf_counter() - started - interval))
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        path = request_line.split()[1] if len(request_line.split()) > 1 else b'/'
+        if path.split(b'?')[0] == b'/metrics':
+            body = registry.render().encode()
+            status = b'200 OK'
+        else:
+            body = b'Not Found\n'
+            status = b'404 Not Found'
+        writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                     b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                     b'Connection: close\r\n\r\n' + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics и фоновый замер лага event loop."""
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._lag_task = None
+
+    async def start(self) -> None:
+        set_statement_observer(_observe_statement, should_sample)
+        self._server = await asyncio.start_server(_handle_http, self.host, self.port)
+        self._lag_task = asyncio.create_task(sample_loop_lag())
+        print(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        set_statement_observer(None)
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
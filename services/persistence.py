@@ -0,0 +1,278 @@
+import asyncio
+import json
+import os
+import pickle
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import telegram
+from telegram import Update
+from telegram.ext import BasePersistence, ContextTypes, ConversationHandler, PersistenceInput, TypeHandler
+
+from database.db import get_db_connection, get_pool, get_shard_connection, shard_count
+from services.async_transaction_service import run_in_db_thread
+
+# Как часто Application сбрасывает накопленные изменения в базу, секунды
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', '5'))
+# Сколько пользователей помнится загруженными; вытесненный загрузится заново
+PERSISTENCE_CACHE_SIZE = int(os.getenv('PERSISTENCE_CACHE_SIZE', '10000'))
+# Пауза перед повтором записи после ошибки растет вдвое до этого предела, секунды
+PERSISTENCE_MAX_RETRY_DELAY = 30.0
+
+# Диалоги пользователя подгружаются в ConversationHandler через его внутренний
+# TrackingDict.update_no_track - так проверено только на закрепленной версии PTB.
+# На других версиях все диалоги читаются при старте через get_conversations()
+LAZY_CONVERSATIONS = telegram.__version_info__[:2] == (20, 7)
+
+
+def _encode_key(key: tuple) -> str:
+    return json.dumps(list(key))
+
+
+def _key_user(key: tuple) -> int:
+    # Ключ диалога (chat_id, user_id); по user_id выбирается шард и строка загрузки
+    return key[-1]
+
+
+def load_user_state(user_id: int) -> Tuple[dict, Dict[str, dict]]:
+    """user_data пользователя и его диалоги {имя: {ключ: состояние}}."""
+    with get_db_connection(user_id) as conn:
+        c = conn.cursor()
+        c.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,))
+        row = c.fetchone()
+        c.execute("""SELECT name, conversation_key, state
+                     FROM conversations
+                     WHERE user_id = ?""", (user_id,))
+        conversations = {}
+        for name, key, state in c.fetchall():
+            conversations.setdefault(name, {})[tuple(json.loads(key))] = pickle.loads(state)
+    return (pickle.loads(row[0]) if row else {}), conversations
+
+
+def load_conversations(name: str) -> dict:
+    """Все сохраненные диалоги name со всех шардов: {ключ: состояние}."""
+    conversations = {}
+    for index in range(shard_count()):
+        with get_shard_connection(index) as conn:
+            c = conn.cursor()
+            c.execute("SELECT conversation_key, state FROM conversations WHERE name = ?", (name,))
+            for key, state in c.fetchall():
+                conversations[tuple(json.loads(key))] = pickle.loads(state)
+    return conversations
+
+
+def save_state(user_data: Dict[int, Optional[bytes]], conversations: Dict[tuple, Optional[bytes]]) -> None:
+    """Записывает накопленные изменения: по одной транзакции на шард.
+
+    user_data: {user_id: pickle или None - удалить},
+    conversations: {(user_id, имя, ключ): pickle состояния или None - диалог завершен}.
+    """
+    pool = get_pool()
+    shards = {}
+    for user_id, data in user_data.items():
+        shards.setdefault(pool.shard_for(user_id), ([], []))[0].append((user_id, data))
+    for key, state in conversations.items():
+        shards.setdefault(pool.shard_for(key[0]), ([], []))[1].append((key, state))
+
+    for index, (users, states) in shards.items():
+        with get_shard_connection(index) as conn:
+            c = conn.cursor()
+            c.executemany("INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                          [(user_id, data) for user_id, data in users if data is not None])
+            c.executemany("DELETE FROM user_data WHERE user_id = ?",
+                          [(user_id,) for user_id, data in users if data is None])
+            c.executemany("""INSERT OR REPLACE INTO conversations (user_id, name, conversation_key, state)
+                             VALUES (?, ?, ?, ?)""",
+                          [key + (state,) for key, state in states if state is not None])
+            c.executemany("""DELETE FROM conversations
+                             WHERE user_id = ? AND name = ? AND conversation_key = ?""",
+                          [key for key, state in states if state is None])
+            conn.commit()
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит состояние диалогов и context.user_data в базе бота.
+
+    Application вызывает update_* раз в PERSISTENCE_FLUSH_INTERVAL только для
+    изменившихся пользователей и диалогов; здесь они копятся и пишутся одной
+    транзакцией на шард, а неизменившиеся user_data не пишутся совсем.
+    При старте ничего не читается: состояние пользователя подгружает
+    loader_handler() перед обработкой его первого апдейта.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_INTERVAL,
+                 cache_size: int = PERSISTENCE_CACHE_SIZE):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False,
+                                                     user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.cache_size = cache_size
+        self._conversation_handlers: Dict[str, ConversationHandler] = {}
+        # LRU загруженных пользователей; вытеснение забывает и их _saved
+        self._loaded: OrderedDict = OrderedDict()
+        # Последнее сохраненное user_data: повторная запись того же самого пропускается
+        self._saved: Dict[int, bytes] = {}
+        self._pending_user_data: Dict[int, Optional[bytes]] = {}
+        self._pending_conversations: Dict[tuple, Optional[bytes]] = {}
+        # Пачка, которая сейчас записывается в пуле потоков
+        self._writing: Tuple[dict, dict] = ({}, {})
+        self._write_task = None
+        self._sleeping = False
+        self._retry_delay = 0.0
+
+    def loader_handler(self) -> TypeHandler:
+        """Хендлер для группы -1: подгружает состояние пользователя до остальных хендлеров."""
+        return TypeHandler(Update, self._load)
+
+    async def _load(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        if user is None:
+            return
+        if user.id in self._loaded:
+            self._loaded.move_to_end(user.id)
+            return
+        if not self._conversation_handlers:
+            self._conversation_handlers = {
+                handler.name: handler
+                for handlers in context.application.handlers.values()
+                for handler in handlers
+                if isinstance(handler, ConversationHandler) and handler.persistent
+            }
+
+        user_data, conversations = await run_in_db_thread(load_user_state, user.id)
+        # Еще не записанные изменения новее базы: повторная загрузка вытесненного
+        # пользователя не должна вернуть удаленные ключи и завершенные диалоги
+        unsaved_user = user.id in self._pending_user_data or user.id in self._writing[0]
+        if user_data and not unsaved_user:
+            self._saved[user.id] = pickle.dumps(user_data)
+            for key, value in user_data.items():
+                context.user_data.setdefault(key, value)
+        for name, states in conversations.items():
+            handler = self._conversation_handlers.get(name)
+            if handler is None or not LAZY_CONVERSATIONS:
+                continue
+            # Публичного способа восстановить один диалог у ConversationHandler нет;
+            # update_no_track - тот же путь, которым PTB загружает get_conversations()
+            handler._conversations.update_no_track({
+                key: state for key, state in states.items()
+                if key not in handler._conversations and not self._unsaved_conversation(name, key)})
+        self._remember(user.id)
+
+    def _unsaved_conversation(self, name: str, key: tuple) -> bool:
+        pending_key = (_key_user(key), name, _encode_key(key))
+        return pending_key in self._pending_conversations or pending_key in self._writing[1]
+
+    def _remember(self, user_id: int) -> None:
+        self._loaded[user_id] = None
+        while len(self._loaded) > self.cache_size:
+            evicted, _ = self._loaded.popitem(last=False)
+            self._saved.pop(evicted, None)
+
+    def _schedule_write(self, delay: float = 0) -> None:
+        # Все update_* одного прохода Application запускаются вместе, поэтому
+        # задача записи выполнится после них и заберет все изменения разом
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending(delay))
+
+    async def _write_pending(self, delay: float) -> None:
+        failed = False
+        try:
+            self._sleeping = True
+            await asyncio.sleep(delay)
+            self._sleeping = False
+            user_data, self._pending_user_data = self._pending_user_data, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            if user_data or conversations:
+                self._writing = (user_data, conversations)
+                try:
+                    await run_in_db_thread(save_state, user_data, conversations)
+                except Exception as e:
+                    # Не записанное возвращается в очередь; более новые изменения остаются
+                    failed = True
+                    print(f"Error saving conversation state: {e}")
+                    for user_id, data in user_data.items():
+                        self._pending_user_data.setdefault(user_id, data)
+                    for key, state in conversations.items():
+                        self._pending_conversations.setdefault(key, state)
+                finally:
+                    self._writing = ({}, {})
+        finally:
+            self._sleeping = False
+            self._write_task = None
+
+        self._retry_delay = min(max(2 * self._retry_delay, 1.0), PERSISTENCE_MAX_RETRY_DELAY) if failed else 0.0
+        # Изменения, пришедшие во время записи, или повтор после ошибки
+        if self._pending_user_data or self._pending_conversations:
+            self._schedule_write(self._retry_delay)
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        if LAZY_CONVERSATIONS:
+            return {}
+        return await run_in_db_thread(load_conversations, name)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        blob = pickle.dumps(data) if data else None
+        if blob == self._saved.get(user_id):
+            return
+        if blob is None or user_id not in self._loaded:
+            self._saved.pop(user_id, None)
+        else:
+            self._saved[user_id] = blob
+        self._pending_user_data[user_id] = blob
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.update_user_data(user_id, {})
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        state = None if new_state is None else pickle.dumps(new_state)
+        self._pending_conversations[(_key_user(key), name, _encode_key(key))] = state
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Дописывает изменения при остановке бота."""
+        while self._write_task is not None:
+            task = self._write_task
+            if self._sleeping:
+                # Ждать паузы перед повтором незачем: запись ниже сделает то же самое
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        user_data, self._pending_user_data = self._pending_user_data, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        if user_data or conversations:
+            await run_in_db_thread(save_state, user_data, conversations)
@@ -0,0 +1,143 @@
+import calendar
+import os
+import re
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from database.db import get_db_connection, get_shard_connection, shard_count
+from models.transaction import RecurringRule, Transaction
+from services.transaction_service import TransactionService
+
+# Сколько наступивших правил шарда проводится одной транзакцией БД
+RECURRING_BATCH_SIZE = int(os.getenv('RECURRING_BATCH_SIZE', '1000'))
+
+PERIOD_ALIASES = {
+    'daily': ('day', 1), 'ежедневно': ('day', 1),
+    'weekly': ('day', 7), 'еженедельно': ('day', 7),
+    'monthly': ('month', 1), 'ежемесячно': ('month', 1),
+    'yearly': ('month', 12), 'ежегодно': ('month', 12),
+}
+# Произвольный период: 10d - каждые 10 дней, 2w - две недели, 3m - три месяца
+CUSTOM_PERIOD_RE = re.compile(r'(\d{1,3})([dwmднм])')
+
+
+def parse_period(text: str) -> Optional[Tuple[str, int]]:
+    """'monthly', 'еженедельно', '10d', '2w', '3m' -> (unit, count); None - не период."""
+    text = text.lower()
+    if text in PERIOD_ALIASES:
+        return PERIOD_ALIASES[text]
+    match = CUSTOM_PERIOD_RE.fullmatch(text)
+    if not match or int(match.group(1)) == 0:
+        return None
+    count, unit = int(match.group(1)), match.group(2)
+    if unit in 'dд':
+        return 'day', count
+    if unit in 'wн':
+        return 'day', count * 7
+    return 'month', count
+
+
+def next_occurrence(due: date, unit: str, count: int, anchor_day: Optional[int] = None) -> date:
+    """Следующая дата правила после due."""
+    if unit == 'day':
+        return due + timedelta(days=count)
+    year, month = divmod(due.year * 12 + due.month - 1 + count, 12)
+    day = min(anchor_day or due.day, calendar.monthrange(year, month + 1)[1])
+    return date(year, month + 1, day)
+
+
+class RecurringService:
+    """Повторяющиеся транзакции: правила хранятся в шарде пользователя.
+
+    Правило помнит дату следующего проведения (next_due, индексирована),
+    поэтому проход планировщика читает только наступившие правила. Транзакции
+    всех наступивших правил шарда и сдвиг их next_due записываются одной
+    транзакцией БД: после перезапуска или пропущенных проходов правило
+    проводится за каждую пропущенную дату ровно один раз.
+    """
+
+    @staticmethod
+    def add_rule(rule: RecurringRule) -> int:
+        with get_db_connection(rule.user_id) as conn:
+            c = conn.cursor()
+            c.execute("""INSERT INTO recurring_rules
+                         (user_id, type, amount, category, description, unit, count, anchor_day, next_due)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                      (rule.user_id, rule.type, rule.amount, rule.category, rule.description,
+                       rule.unit, rule.count, rule.anchor_day, rule.next_due))
+            rule_id = c.lastrowid
+            conn.commit()
+        return rule_id
+
+    @staticmethod
+    def get_rules(user_id: int) -> List[RecurringRule]:
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("""SELECT user_id, type, amount, category, unit, count, next_due,
+                                anchor_day, description, rule_id
+                         FROM recurring_rules
+                         WHERE user_id = ?
+                         ORDER BY rule_id""", (user_id,))
+            return [RecurringRule(*row) for row in c.fetchall()]
+
+    @staticmethod
+    def delete_rule(user_id: int, rule_id: int) -> bool:
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM recurring_rules WHERE rule_id = ? AND user_id = ?", (rule_id, user_id))
+            success = c.rowcount > 0
+            conn.commit()
+        return success
+
+    @staticmethod
+    def post_due(today: Optional[date] = None,
+                 batch_size: int = RECURRING_BATCH_SIZE) -> List[Tuple[int, List[Transaction]]]:
+        """Проводит все правила, наступившие к today; возвращает (rule_id, созданные транзакции)."""
+        today = today or date.today()
+        posted = []
+        for index in range(shard_count()):
+            while True:
+                rules = RecurringService._post_due_in_shard(index, today, batch_size)
+                posted.extend(rules)
+                if len(rules) < batch_size:
+                    break
+        return posted
+
+    @staticmethod
+    def _post_due_in_shard(index: int, today: date, batch_size: int) -> List[Tuple[int, List[Transaction]]]:
+        with get_shard_connection(index) as conn:
+            c = conn.cursor()
+            # Правила читаются под блокировкой записи: второй экземпляр бота
+            # дождется коммита и уже не увидит их наступившими
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                c.execute("""SELECT rule_id, user_id, type, amount, category, description,
+                                    unit, count, anchor_day, next_due
+                             FROM recurring_rules
+                             WHERE next_due <= ?
+                             ORDER BY next_due
+                             LIMIT ?""", (today.isoformat(), batch_size))
+                rules = c.fetchall()
+
+                posted = []
+                transactions = []
+                updates = []
+                for rule_id, user_id, typ, amount, category, description, unit, count, anchor_day, next_due in rules:
+                    due = date.fromisoformat(next_due)
+                    first = len(transactions)
+                    while due <= today:
+                        transactions.append(Transaction(user_id=user_id, type=typ, amount=amount,
+                                                        category=category, description=description,
+                                                        date=f"{due.isoformat()} 00:00:00"))
+                        due = next_occurrence(due, unit, count, anchor_day)
+                    posted.append((rule_id, transactions[first:]))
+                    updates.append((due.isoformat(), rule_id))
+
+                if transactions:
+                    TransactionService.write_transactions(c, transactions)
+                c.executemany("UPDATE recurring_rules SET next_due = ? WHERE rule_id = ?", updates)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return posted
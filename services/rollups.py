@@ -0,0 +1,129 @@
+"""Иерархические агрегаты по категориям: дни, месяцы и годы в одной таблице.
+
+Ключ периода в category_rollups - целое число, разрядность которого задает
+уровень: YYYY - год, YYYYMM - месяц, YYYYMMDD - день. Диапазоны уровней не
+пересекаются, поэтому отрезок между двумя ключами одного уровня содержит
+только ключи этого уровня, и выборка за период - несколько BETWEEN по
+первичному ключу.
+"""
+import calendar
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def period_keys(transaction_date: str) -> Tuple[int, int, int]:
+    """Ключи дня, месяца и года для даты вида 'YYYY-MM-DD...'."""
+    year = int(transaction_date[:4])
+    month = year * 100 + int(transaction_date[5:7])
+    return month * 100 + int(transaction_date[8:10]), month, year
+
+
+def collect(rows: Iterable[tuple]) -> Dict[tuple, list]:
+    """Суммирует транзакции (user_id, type, amount, category, date) по всем уровням агрегатов."""
+    totals = {}
+    for user_id, typ, amount, category, transaction_date in rows:
+        for period in period_keys(transaction_date):
+            bucket = totals.setdefault((user_id, period, typ, category or ''), [0, 0])
+            bucket[0] += amount
+            bucket[1] += 1
+    return totals
+
+
+def apply(c, totals: Dict[tuple, list]) -> None:
+    """Прибавляет собранные collect() суммы к таблице агрегатов."""
+    c.executemany("""INSERT INTO category_rollups (user_id, period, type, category, total, count)
+                     VALUES (?, ?, ?, ?, ?, ?)
+                     ON CONFLICT (user_id, period, type, category) DO UPDATE
+                     SET total = total + excluded.total,
+                         count = count + excluded.count""",
+                  [key + tuple(value) for key, value in totals.items()])
+
+
+def rebuild(c, user_id: Optional[int] = None,
+            first_month: Optional[int] = None, last_month: Optional[int] = None) -> None:
+    """Пересчитывает агрегаты из транзакций: дни, из них месяцы, из месяцев годы.
+
+    Без user_id - для всех пользователей, без границ (YYYYMM) - за все время.
+    Годы пересчитываются целиком, поэтому месяцы вне границ в них учтены.
+    """
+    first_month = first_month or 100001
+    last_month = last_month or 999912
+    first_year, last_year = first_month // 100, last_month // 100
+    user_filter = "user_id = ? AND " if user_id is not None else ""
+    user_params = (user_id,) if user_id is not None else ()
+
+    c.execute(f"DELETE FROM category_rollups WHERE {user_filter}period BETWEEN ? AND ?",
+              user_params + (first_month * 100, last_month * 100 + 99))
+    c.execute(f"""INSERT INTO category_rollups (user_id, period, type, category, total, count)
+                  SELECT user_id, year_month * 100 + CAST(substr(date, 9, 2) AS INTEGER),
+                         type, COALESCE(category, ''), SUM(amount), COUNT(*)
+                  FROM transactions
+                  WHERE {user_filter}year_month BETWEEN ? AND ?
+                  GROUP BY 1, 2, 3, 4""",
+              user_params + (first_month, last_month))
+
+    c.execute(f"DELETE FROM category_rollups WHERE {user_filter}period BETWEEN ? AND ?",
+              user_params + (first_month, last_month))
+    c.execute(f"""INSERT INTO category_rollups (user_id, period, type, category, total, count)
+                  SELECT user_id, period / 100, type, category, SUM(total), SUM(count)
+                  FROM category_rollups
+                  WHERE {user_filter}period BETWEEN ? AND ?
+                  GROUP BY 1, 2, 3, 4""",
+              user_params + (first_month * 100, last_month * 100 + 99))
+
+    c.execute(f"DELETE FROM category_rollups WHERE {user_filter}period BETWEEN ? AND ?",
+              user_params + (first_year, last_year))
+    c.execute(f"""INSERT INTO category_rollups (user_id, period, type, category, total, count)
+                  SELECT user_id, period / 100, type, category, SUM(total), SUM(count)
+                  FROM category_rollups
+                  WHERE {user_filter}period BETWEEN ? AND ?
+                  GROUP BY 1, 2, 3, 4""",
+              user_params + (first_year * 100 + 1, last_year * 100 + 12))
+
+
+def split_period(start: date, end: date) -> List[Tuple[int, int]]:
+    """Разбивает отрезок дат на диапазоны ключей: целые годы, целые месяцы, остальные дни."""
+    ranges = []
+    level = None
+    day = start
+    while day <= end:
+        month_end = day.replace(day=calendar.monthrange(day.year, day.month)[1])
+        if day.month == 1 and day.day == 1 and date(day.year, 12, 31) <= end:
+            key, next_day, key_level = day.year, date(day.year + 1, 1, 1), 'year'
+        elif day.day == 1 and month_end <= end:
+            key, next_day, key_level = day.year * 100 + day.month, month_end + timedelta(days=1), 'month'
+        else:
+            key, next_day, key_level = day.year * 10000 + day.month * 100 + day.day, day + timedelta(days=1), 'day'
+
+        # Подряд идущие ключи одного уровня объединяются в один BETWEEN
+        if key_level == level:
+            ranges[-1] = (ranges[-1][0], key)
+        else:
+            ranges.append((key, key))
+            level = key_level
+        day = next_day
+    return ranges
+
+
+def read_period(c, user_filter: str, params: list, date_from: date, date_to: date) -> dict:
+    """Доходы и расходы по категориям за отрезок дат включительно.
+
+    user_filter - условие на r.user_id (например, "r.user_id = ?") с параметрами params.
+    """
+    result = {'total_income': 0, 'total_expense': 0, 'income_by_category': {}, 'expense_by_category': {}}
+    ranges = split_period(date_from, date_to)
+    if not ranges:
+        return result
+
+    # Каждый диапазон - отдельный поиск по первичному ключу (OR SQLite так не планирует)
+    c.execute(f"""WITH ranges (first, last) AS (VALUES {', '.join(['(?, ?)'] * len(ranges))})
+                  SELECT r.type, r.category, SUM(r.total)
+                  FROM ranges
+                  JOIN category_rollups r ON {user_filter} AND r.period BETWEEN first AND last
+                  GROUP BY r.type, r.category
+                  ORDER BY SUM(r.total) DESC""",
+              [key for bounds in ranges for key in bounds] + list(params))
+    for typ, category, total in c.fetchall():
+        result[f'total_{typ}'] += total
+        result[f'{typ}_by_category'][category or None] = total
+    return result
@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Any, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from services import metrics
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в личный чат
+# и ~20 в минуту в группу; короткие всплески допускаются
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+SEND_GLOBAL_BURST = int(os.getenv('SEND_GLOBAL_BURST', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_GROUP_RATE = float(os.getenv('SEND_GROUP_RATE', str(20 / 60)))
+SEND_GROUP_BURST = int(os.getenv('SEND_GROUP_BURST', '3'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+
+# Приоритеты отправки: ответы пользователю идут раньше рассылок.
+# Рассылка передает bot.send_message(..., rate_limit_args=BULK)
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+# Как часто выбрасываются корзины чатов, в которые давно ничего не отправлялось
+CHAT_SWEEP_INTERVAL = 60.0
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst про запас."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена (0 - можно отправлять)."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and self.blocked_until <= now
+
+
+class _PriorityBucket:
+    """Общая корзина бота; ожидающие получают токены в порядке (приоритет, очередь)."""
+
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int) -> None:
+        if not self._waiters and self.bucket.delay(time.monotonic()) == 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # Отправитель отменен, пока ждал
+                heapq.heappop(self._waiters)
+                continue
+            wait = self.bucket.delay(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            self.bucket.take()
+            heapq.heappop(self._waiters)[2].set_result(None)
+
+
+class SendScheduler(BaseRateLimiter):
+    """Очередь исходящих запросов к Bot API с учетом лимитов Telegram.
+
+    Все запросы с chat_id проходят через корзину своего чата и общую корзину
+    бота; запросы одного чата уходят строго по очереди. Общую корзину первыми
+    получают ответы пользователям (INTERACTIVE), рассылки (BULK) - когда
+    ответов в очереди нет. На RetryAfter чат и весь бот ставятся на паузу на
+    указанное время, и запрос повторяется до SEND_MAX_RETRIES раз, а не
+    превращается в ошибку для пользователя. Запросы без chat_id (getUpdates,
+    getFile, setWebhook) не ограничиваются.
+    """
+
+    def __init__(self, max_retries: int = SEND_MAX_RETRIES):
+        self.max_retries = max_retries
+        self._global = None
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._chat_locks: Dict[Any, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Any, int] = {}
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self._last_sweep = time.monotonic()
+
+    async def initialize(self) -> None:
+        self._global = _PriorityBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_BURST)
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        stats = {f'waiting_{name}': self._waiting[priority] for priority, name in PRIORITY_NAMES.items()}
+        stats['chats'] = len(self._chats)
+        return stats
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = (TokenBucket(SEND_GROUP_RATE, SEND_GROUP_BURST) if group
+                                             else TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST))
+        return bucket
+
+    def _sweep(self, now: float) -> None:
+        # Полная корзина без ожидающих ничем не отличается от новой
+        self._last_sweep = now
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items()
+                        if chat_id not in self._chat_locks and bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[int]):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        priority = rate_limit_args if rate_limit_args in PRIORITY_NAMES else INTERACTIVE
+        enqueued = time.monotonic()
+        if enqueued - self._last_sweep > CHAT_SWEEP_INTERVAL:
+            self._sweep(enqueued)
+
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+        self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+        self._waiting[priority] += 1
+        waiting = True
+        try:
+            async with lock:
+                bucket = self._chat_bucket(chat_id)
+                for attempt in range(self.max_retries + 1):
+                    while (wait := bucket.delay(time.monotonic())) > 0:
+                        await asyncio.sleep(wait)
+                    bucket.take()
+                    await self._global.acquire(priority)
+                    if waiting:
+                        waiting = False
+                        self._waiting[priority] -= 1
+                        metrics.SEND_WAIT.observe((PRIORITY_NAMES[priority],), time.monotonic() - enqueued)
+                    try:
+                        return await callback(*args, **kwargs)
+                    except RetryAfter as e:
+                        metrics.SEND_RETRY_AFTER.inc((PRIORITY_NAMES[priority],))
+                        if attempt == self.max_retries:
+                            raise
+                        bucket.block(e.retry_after)
+                        self._global.bucket.block(e.retry_after)
+        finally:
+            if waiting:
+                self._waiting[priority] -= 1
+            self._chat_waiters[chat_id] -= 1
+            if not self._chat_waiters[chat_id]:
+                del self._chat_waiters[chat_id]
+                del self._chat_locks[chat_id]
@@ -1,73 +1,419 @@
-from datetime import datetime
-from typing import List, Optional
-from database.db import get_db_connection
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from database.db import get_db_connection, get_pool, get_shard_connection, shard_count, shard_indexes
 from models.transaction import Transaction, Category, MonthlyStats
+from services import rollups
+from services.analytics import analytics_cache
+from services.category_cache import category_cache
 
 class TransactionService:
     @staticmethod
     def add_transaction(transaction: Transaction) -> None:
-        conn = get_db_connection()
-        c = conn.cursor()
+        TransactionService.add_transactions([transaction])
 
-        # Add transaction
-        c.execute("""INSERT INTO transactions 
-                     (user_id, type, amount, category, description, date) 
-                     VALUES (?, ?, ?, ?, ?, ?)""",
-                  (transaction.user_id, transaction.type, transaction.amount,
-                   transaction.category, transaction.description, transaction.date))
+    @staticmethod
+    def add_transactions(transactions: List[Transaction]) -> None:
+        """Добавление пачки транзакций (в том числе разных пользователей).
+
+        Транзакции одного шарда записываются одним коммитом.
+        """
+        for index, shard_transactions in TransactionService.group_by_shard(transactions).items():
+            TransactionService._add_to_shard(index, shard_transactions)
+
+    @staticmethod
+    def group_by_shard(transactions: List[Transaction]) -> Dict[int, List[Transaction]]:
+        """Раскладывает транзакции по шардам их пользователей."""
+        pool = get_pool()
+        groups = {}
+        for transaction in transactions:
+            groups.setdefault(pool.shard_for(transaction.user_id), []).append(transaction)
+        return groups
+
+    @staticmethod
+    def _add_to_shard(index: int, transactions: List[Transaction]) -> None:
+        with get_shard_connection(index) as conn:
+            TransactionService.write_transactions(conn.cursor(), transactions)
+            conn.commit()
+
+    @staticmethod
+    def write_transactions(c, transactions: List[Transaction]) -> None:
+        """Вставляет транзакции одного шарда и обновляет агрегаты в текущей транзакции c.
+
+        Каждая строка monthly_stats, user_balances и агрегатов семьи
+        обновляется один раз на всю пачку; коммит - за вызывающим.
+        """
+        rows = []
+        monthly = {}
+        balances = {}
+        for transaction in transactions:
+            tx_date = datetime.strptime(transaction.date, '%Y-%m-%d %H:%M:%S')
+            rows.append((transaction.user_id, transaction.type, transaction.amount,
+                         transaction.category, transaction.description, transaction.date,
+                         tx_date.year * 100 + tx_date.month))
+
+            # Предварительно суммируем агрегаты, чтобы обновить каждую строку один раз
+            income = transaction.amount if transaction.type == 'income' else 0
+            expense = transaction.amount if transaction.type == 'expense' else 0
+            totals = monthly.setdefault((transaction.user_id, tx_date.year, tx_date.month), [0, 0])
+            totals[0] += income
+            totals[1] += expense
+            totals = balances.setdefault(transaction.user_id, [0, 0])
+            totals[0] += income
+            totals[1] += expense
+
+        # Add transactions
+        c.executemany("""INSERT INTO transactions 
+                         (user_id, type, amount, category, description, date, year_month) 
+                         VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
 
         # Update monthly stats
-        date = datetime.strptime(transaction.date, '%Y-%m-%d %H:%M:%S')
-        year = date.year
-        month = date.month
-
-        if transaction.type == 'income':
-            c.execute("""INSERT OR IGNORE INTO monthly_stats 
-                         (user_id, year, month, total_income, total_expense)
-                         VALUES (?, ?, ?, 0, 0)""", (transaction.user_id, year, month))
-            c.execute("""UPDATE monthly_stats 
-                         SET total_income = total_income + ? 
-                         WHERE user_id = ? AND year = ? AND month = ?""",
-                      (transaction.amount, transaction.user_id, year, month))
-        else:
-            c.execute("""INSERT OR IGNORE INTO monthly_stats 
-                         (user_id, year, month, total_income, total_expense)
-                         VALUES (?, ?, ?, 0, 0)""", (transaction.user_id, year, month))
-            c.execute("""UPDATE monthly_stats 
-                         SET total_expense = total_expense + ? 
-                         WHERE user_id = ? AND year = ? AND month = ?""",
-                      (transaction.amount, transaction.user_id, year, month))
+        c.executemany("""INSERT INTO monthly_stats (user_id, year, month, total_income, total_expense)
+                         VALUES (?, ?, ?, ?, ?)
+                         ON CONFLICT (user_id, year, month) DO UPDATE
+                         SET total_income = total_income + excluded.total_income,
+                             total_expense = total_expense + excluded.total_expense""",
+                      [key + tuple(totals) for key, totals in monthly.items()])
+
+        # Update running balances
+        c.executemany("""INSERT INTO user_balances (user_id, total_income, total_expense)
+                         VALUES (?, ?, ?)
+                         ON CONFLICT (user_id) DO UPDATE
+                         SET total_income = total_income + excluded.total_income,
+                             total_expense = total_expense + excluded.total_expense""",
+                      [(user_id,) + tuple(totals) for user_id, totals in balances.items()])
 
-        conn.commit()
-        conn.close()
+        # Update family aggregates
+        TransactionService._add_to_family(
+            c, [key + tuple(totals) for key, totals in monthly.items()],
+            [(user_id,) + tuple(totals) for user_id, totals in balances.items()])
+
+        # Update day/month/year rollups by category
+        rollups.apply(c, rollups.collect(
+            (t.user_id, t.type, t.amount, t.category, t.date) for t in transactions))
 
     @staticmethod
-    def get_balance(user_id: int) -> float:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT type, amount FROM transactions WHERE user_id = ?", (user_id,))
-        transactions = c.fetchall()
-        income = sum(amount for typ, amount in transactions if typ == 'income')
-        expense = sum(amount for typ, amount in transactions if typ == 'expense')
-        conn.close()
-        return income - expense
+    def import_transactions(user_id: int, rows: Iterable[tuple], chunk_size: int = 5000,
+                            progress: Optional[Callable[[int], None]] = None) -> int:
+        """Массовый импорт транзакций пользователя одной транзакцией БД.
+
+        rows - итератор кортежей (type, amount, category, description, date)
+        с amount в копейках; читается по частям, поэтому объем памяти не
+        зависит от размера импорта.
+        Агрегаты пересчитываются одним групповым запросом в конце.
+        """
+        imported = 0
+        totals = {'income': 0, 'expense': 0}
+        monthly = {}
+        categories = {'income': set(), 'expense': set()}
+
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            chunk = []
+            for typ, amount, category, description, tx_date in rows:
+                year_month = int(tx_date[:4]) * 100 + int(tx_date[5:7])
+                chunk.append((user_id, typ, amount, category, description, tx_date, year_month))
+                totals[typ] += amount
+                month_totals = monthly.get(year_month)
+                if month_totals is None:
+                    month_totals = monthly[year_month] = {'income': 0, 'expense': 0}
+                month_totals[typ] += amount
+                if category:
+                    categories[typ].add(category)
+
+                if len(chunk) >= chunk_size:
+                    imported += TransactionService._insert_chunk(c, chunk)
+                    if progress:
+                        progress(imported)
+            imported += TransactionService._insert_chunk(c, chunk)
+
+            if imported:
+                first_month, last_month = min(monthly), max(monthly)
+
+                # Недостающие категории создаются разом
+                c.executemany("INSERT OR IGNORE INTO income_categories (user_id, name) VALUES (?, ?)",
+                              [(user_id, name) for name in categories['income']])
+                c.executemany("INSERT OR IGNORE INTO expense_categories (user_id, name) VALUES (?, ?)",
+                              [(user_id, name) for name in categories['expense']])
+
+                # Пересчет затронутых месяцев одним групповым запросом вместо построчных upsert
+                c.execute("""INSERT OR REPLACE INTO monthly_stats (user_id, year, month, total_income, total_expense)
+                             SELECT user_id, year_month / 100, year_month % 100,
+                                    SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+                                    SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+                             FROM transactions
+                             WHERE user_id = ? AND year_month BETWEEN ? AND ?
+                             GROUP BY year_month""",
+                          (user_id, first_month, last_month))
+
+                c.execute("""INSERT INTO user_balances (user_id, total_income, total_expense)
+                             VALUES (?, ?, ?)
+                             ON CONFLICT (user_id) DO UPDATE
+                             SET total_income = total_income + excluded.total_income,
+                                 total_expense = total_expense + excluded.total_expense""",
+                          (user_id, totals['income'], totals['expense']))
+
+                TransactionService._add_to_family(
+                    c, [(user_id, year_month // 100, year_month % 100, month_totals['income'], month_totals['expense'])
+                        for year_month, month_totals in monthly.items()],
+                    [(user_id, totals['income'], totals['expense'])])
+
+                rollups.rebuild(c, user_id, first_month, last_month)
+
+            conn.commit()
+
+        category_cache.invalidate(user_id)
+        if progress:
+            progress(imported)
+        return imported
 
     @staticmethod
-    def get_monthly_stats(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> MonthlyStats:
-        conn = get_db_connection()
-        c = conn.cursor()
+    def _add_to_family(c, monthly_rows: List[tuple], balance_rows: List[tuple]) -> None:
+        """Прибавляет суммы пользователей к агрегатам их семей.
+
+        monthly_rows - (user_id, year, month, income, expense), balance_rows -
+        (user_id, income, expense). Членство читается из users внутри той же
+        транзакции записи, поэтому не расходится с одновременным вступлением в семью.
+        Агрегаты семьи в каждом шарде - суммы только по его участникам.
+        """
+        c.executemany("""INSERT INTO family_monthly_stats (family_id, year, month, total_income, total_expense)
+                         SELECT family_id, ?, ?, ?, ? FROM users WHERE user_id = ? AND family_id IS NOT NULL
+                         ON CONFLICT (family_id, year, month) DO UPDATE
+                         SET total_income = total_income + excluded.total_income,
+                             total_expense = total_expense + excluded.total_expense""",
+                      [(year, month, income, expense, user_id)
+                       for user_id, year, month, income, expense in monthly_rows])
+        c.executemany("""INSERT INTO family_balances (family_id, total_income, total_expense)
+                         SELECT family_id, ?, ? FROM users WHERE user_id = ? AND family_id IS NOT NULL
+                         ON CONFLICT (family_id) DO UPDATE
+                         SET total_income = total_income + excluded.total_income,
+                             total_expense = total_expense + excluded.total_expense""",
+                      [(income, expense, user_id) for user_id, income, expense in balance_rows])
+
+    @staticmethod
+    def _subtract_from_family(c, user_id: int, transaction_type: Optional[str] = None) -> None:
+        """Вычитает из агрегатов семьи транзакции пользователя, которые сейчас будут удалены."""
+        type_filter = "AND t.type = ?" if transaction_type else ""
+        params = (user_id, transaction_type) if transaction_type else (user_id,)
+        c.execute(f"""INSERT INTO family_monthly_stats (family_id, year, month, total_income, total_expense)
+                      SELECT u.family_id, t.year_month / 100, t.year_month % 100,
+                             -SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END),
+                             -SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END)
+                      FROM transactions t
+                      JOIN users u ON u.user_id = t.user_id
+                      WHERE t.user_id = ? {type_filter} AND u.family_id IS NOT NULL
+                      GROUP BY u.family_id, t.year_month
+                      ON CONFLICT (family_id, year, month) DO UPDATE
+                      SET total_income = total_income + excluded.total_income,
+                          total_expense = total_expense + excluded.total_expense""", params)
+        c.execute(f"""INSERT INTO family_balances (family_id, total_income, total_expense)
+                      SELECT u.family_id,
+                             -SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END),
+                             -SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END)
+                      FROM transactions t
+                      JOIN users u ON u.user_id = t.user_id
+                      WHERE t.user_id = ? {type_filter} AND u.family_id IS NOT NULL
+                      GROUP BY u.family_id
+                      ON CONFLICT (family_id) DO UPDATE
+                      SET total_income = total_income + excluded.total_income,
+                          total_expense = total_expense + excluded.total_expense""", params)
+
+    @staticmethod
+    def _insert_chunk(c, chunk: list) -> int:
+        c.executemany("""INSERT INTO transactions
+                         (user_id, type, amount, category, description, date, year_month)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)""", chunk)
+        count = len(chunk)
+        chunk.clear()
+        return count
+
+    @staticmethod
+    def get_balance(user_id: int) -> int:
+        """Баланс пользователя в копейках."""
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("""SELECT total_income - total_expense
+                         FROM user_balances
+                         WHERE user_id = ?""", (user_id,))
+            result = c.fetchone()
+        return result[0] if result else 0
+
+    @staticmethod
+    def reconcile_balances(fix: bool = False, user_id: Optional[int] = None) -> List[tuple]:
+        """Сверка user_balances с транзакциями для всех пользователей или одного.
+
+        Возвращает расхождения в виде (user_id, stored_income, stored_expense,
+        actual_income, actual_expense). При fix=True исправляет их вместе с
+        балансами семей, в которые входят пользователи.
+        """
+        actual_filter = "WHERE user_id = ?" if user_id is not None else ""
+        stored_filter = "AND b.user_id = ?" if user_id is not None else ""
+        params = (user_id, user_id) if user_id is not None else ()
+        mismatches = []
+        for index in shard_indexes(user_id):
+            with get_shard_connection(index) as conn:
+                c = conn.cursor()
+                if fix:
+                    # Сверка и исправление под одной блокировкой записи
+                    c.execute("BEGIN IMMEDIATE")
+                c.execute(f"""WITH actual AS (
+                                  SELECT user_id,
+                                         SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) AS income,
+                                         SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) AS expense
+                                  FROM transactions
+                                  {actual_filter}
+                                  GROUP BY user_id)
+                              SELECT a.user_id, b.total_income, b.total_expense, a.income, a.expense
+                              FROM actual a
+                              LEFT JOIN user_balances b ON b.user_id = a.user_id
+                              WHERE b.user_id IS NULL
+                                 OR b.total_income != a.income
+                                 OR b.total_expense != a.expense
+                              UNION ALL
+                              SELECT b.user_id, b.total_income, b.total_expense, 0, 0
+                              FROM user_balances b
+                              WHERE (b.total_income != 0 OR b.total_expense != 0) {stored_filter}
+                                AND NOT EXISTS (SELECT 1 FROM transactions t WHERE t.user_id = b.user_id)""",
+                          params)
+                shard_mismatches = c.fetchall()
+
+                if fix and shard_mismatches:
+                    c.executemany("""INSERT OR REPLACE INTO user_balances (user_id, total_income, total_expense)
+                                     VALUES (?, ?, ?)""",
+                                  [(user_id, income, expense)
+                                   for user_id, _, _, income, expense in shard_mismatches])
+                    TransactionService._add_to_family(
+                        c, [], [(user_id, income - (stored_income or 0), expense - (stored_expense or 0))
+                                for user_id, stored_income, stored_expense, income, expense in shard_mismatches])
+                conn.commit()
+            mismatches.extend(shard_mismatches)
+        return mismatches
+
+    @staticmethod
+    def reconcile_monthly_stats(fix: bool = False, user_id: Optional[int] = None) -> List[tuple]:
+        """Сверка monthly_stats с транзакциями для всех пользователей или одного.
+
+        Возвращает расхождения в виде (user_id, year, month, stored_income,
+        stored_expense, actual_income, actual_expense); stored_* - None, если
+        строки нет. При fix=True исправляет их вместе со статистикой семей.
+        """
+        actual_filter = "WHERE user_id = ?" if user_id is not None else ""
+        stored_filter = "AND m.user_id = ?" if user_id is not None else ""
+        params = (user_id, user_id) if user_id is not None else ()
+        mismatches = []
+        for index in shard_indexes(user_id):
+            with get_shard_connection(index) as conn:
+                c = conn.cursor()
+                if fix:
+                    c.execute("BEGIN IMMEDIATE")
+                c.execute(f"""WITH actual AS (
+                                  SELECT user_id, year_month,
+                                         SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) AS income,
+                                         SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) AS expense
+                                  FROM transactions
+                                  {actual_filter}
+                                  GROUP BY user_id, year_month)
+                              SELECT a.user_id, a.year_month / 100, a.year_month % 100,
+                                     m.total_income, m.total_expense, a.income, a.expense
+                              FROM actual a
+                              LEFT JOIN monthly_stats m
+                                ON m.user_id = a.user_id AND m.year = a.year_month / 100 AND m.month = a.year_month % 100
+                              WHERE m.user_id IS NULL
+                                 OR m.total_income != a.income
+                                 OR m.total_expense != a.expense
+                              UNION ALL
+                              SELECT m.user_id, m.year, m.month, m.total_income, m.total_expense, 0, 0
+                              FROM monthly_stats m
+                              WHERE (m.total_income != 0 OR m.total_expense != 0) {stored_filter}
+                                AND NOT EXISTS (SELECT 1 FROM transactions t
+                                                WHERE t.user_id = m.user_id AND t.year_month = m.year * 100 + m.month)""",
+                          params)
+                shard_mismatches = c.fetchall()
+
+                if fix and shard_mismatches:
+                    c.executemany("""INSERT OR REPLACE INTO monthly_stats (user_id, year, month, total_income, total_expense)
+                                     VALUES (?, ?, ?, ?, ?)""",
+                                  [(user_id, year, month, income, expense)
+                                   for user_id, year, month, _, _, income, expense in shard_mismatches])
+                    TransactionService._add_to_family(
+                        c, [(user_id, year, month, income - (stored_income or 0), expense - (stored_expense or 0))
+                            for user_id, year, month, stored_income, stored_expense, income, expense in shard_mismatches],
+                        [])
+                conn.commit()
+            mismatches.extend(shard_mismatches)
+        return mismatches
+
+    @staticmethod
+    def rebuild_monthly_stats(chunk_users: int = 1000, pause: float = 0.05,
+                              progress: Optional[Callable[[int], None]] = None) -> int:
+        """Пересчитывает monthly_stats всех пользователей групповыми запросами.
 
+        Шарды обходятся по очереди; в каждом пользователи обрабатываются
+        диапазонами user_id по chunk_users штук, каждый диапазон - отдельной
+        короткой транзакцией, а между ними делается пауза pause секунд, чтобы
+        запись бота не ждала весь пересчет. В конце из monthly_stats участников
+        пересобирается family_monthly_stats шарда.
+        Возвращает число обработанных пользователей.
+        """
+        users = 0
+        for index in range(shard_count()):
+            with get_shard_connection(index) as conn:
+                c = conn.cursor()
+                low = -2 ** 63
+                while True:
+                    c.execute("BEGIN IMMEDIATE")
+                    c.execute("""SELECT COUNT(*), MAX(user_id)
+                                 FROM (SELECT DISTINCT user_id FROM transactions
+                                       WHERE user_id > ?
+                                       ORDER BY user_id
+                                       LIMIT ?)""", (low, chunk_users))
+                    count, high = c.fetchone()
+                    last_chunk = count < chunk_users
+                    # Последний диапазон открыт сверху, чтобы убрать строки пользователей без транзакций
+                    bounds = (low, 2 ** 63 - 1 if last_chunk else high)
+                    c.execute("DELETE FROM monthly_stats WHERE user_id > ? AND user_id <= ?", bounds)
+                    c.execute("""INSERT INTO monthly_stats (user_id, year, month, total_income, total_expense)
+                                 SELECT user_id, year_month / 100, year_month % 100,
+                                        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+                                        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+                                 FROM transactions
+                                 WHERE user_id > ? AND user_id <= ?
+                                 GROUP BY user_id, year_month""", bounds)
+                    conn.commit()
+
+                    users += count
+                    if progress:
+                        progress(users)
+                    if last_chunk:
+                        break
+                    low = high
+                    if pause:
+                        time.sleep(pause)
+
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("DELETE FROM family_monthly_stats")
+                c.execute("""INSERT INTO family_monthly_stats (family_id, year, month, total_income, total_expense)
+                             SELECT u.family_id, m.year, m.month, SUM(m.total_income), SUM(m.total_expense)
+                             FROM users u
+                             JOIN monthly_stats m ON m.user_id = u.user_id
+                             WHERE u.family_id IS NOT NULL
+                             GROUP BY u.family_id, m.year, m.month""")
+                conn.commit()
+        return users
+
+    @staticmethod
+    def get_monthly_stats(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> MonthlyStats:
         now = datetime.now()
         query_year = year or now.year
         query_month = month or now.month
 
-        c.execute("""SELECT total_income, total_expense 
-                     FROM monthly_stats 
-                     WHERE user_id = ? AND year = ? AND month = ?""",
-                  (user_id, query_year, query_month))
-
-        result = c.fetchone()
-        conn.close()
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("""SELECT total_income, total_expense 
+                         FROM monthly_stats 
+                         WHERE user_id = ? AND year = ? AND month = ?""",
+                      (user_id, query_year, query_month))
+            result = c.fetchone()
 
         if result:
             return MonthlyStats(
@@ -85,122 +431,244 @@ class TransactionService:
             total_expense=0
         )
 
+    @staticmethod
+    def get_monthly_trend(user_id: int, months: int = 12) -> List[MonthlyStats]:
+        """Итоги последних months месяцев по порядку, включая текущий и пустые месяцы."""
+        now = datetime.now()
+        first = now.year * 12 + now.month - months
+        first_year, first_month = divmod(first, 12)
+        first_month += 1
+
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("""SELECT year, month, total_income, total_expense
+                         FROM monthly_stats
+                         WHERE user_id = ? AND (year > ? OR (year = ? AND month >= ?))""",
+                      (user_id, first_year, first_year, first_month))
+            rows = {(year, month): (income, expense) for year, month, income, expense in c.fetchall()}
+
+        trend = []
+        for index in range(first, first + months):
+            year, month = divmod(index, 12)
+            income, expense = rows.get((year, month + 1), (0, 0))
+            trend.append(MonthlyStats(user_id=user_id, year=year, month=month + 1,
+                                      total_income=income, total_expense=expense))
+        return trend
+
     @staticmethod
     def get_transactions_by_category(user_id: int, category: str, transaction_type: str) -> List[Transaction]:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("""SELECT user_id, type, amount, category, description, date
-                     FROM transactions
-                     WHERE user_id = ? AND category = ? AND type = ?""",
-                  (user_id, category, transaction_type))
-        transactions = [Transaction(*row) for row in c.fetchall()]
-        conn.close()
-        return transactions
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("""SELECT user_id, type, amount, category, description, date
+                         FROM transactions
+                         WHERE user_id = ? AND category = ? AND type = ?""",
+                      (user_id, category, transaction_type))
+            return [Transaction(*row) for row in c.fetchall()]
 
     @staticmethod
-    def get_category_stats(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> dict:
-        conn = get_db_connection()
-        c = conn.cursor()
+    def iter_transactions(user_id: int, batch_size: int = 1000) -> Iterator[tuple]:
+        """Вся история пользователя в хронологическом порядке, порциями через fetchmany.
+
+        Отдает кортежи (id, date, type, amount, category, description). Генератор
+        держит соединение до конца чтения, поэтому расходуется в том же потоке.
+        """
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute("""SELECT id, date, type, amount, category, description
+                         FROM transactions
+                         WHERE user_id = ?
+                         ORDER BY date, id""", (user_id,))
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    @staticmethod
+    def get_transactions_page(user_id: int, limit: int = 10,
+                              before: Optional[Tuple[str, int]] = None,
+                              after: Optional[Tuple[str, int]] = None,
+                              transaction_type: Optional[str] = None,
+                              category: Optional[str] = None,
+                              date_from: Optional[str] = None,
+                              date_to: Optional[str] = None) -> Tuple[List[tuple], bool]:
+        """Страница истории с пагинацией по ключу (date, id) вместо OFFSET.
+
+        before - ключ (date, id), от которого листать к более старым записям,
+        after - к более новым. Записи всегда отдаются от новых к старым в виде
+        (id, date, type, amount, category, description); второй элемент
+        результата - есть ли еще записи в направлении листания.
+        date_from и date_to ('YYYY-MM-DD') включительно.
+        """
+        conditions = ["user_id = ?"]
+        params = [user_id]
+        if transaction_type:
+            conditions.append("type = ?")
+            params.append(transaction_type)
+        if category:
+            conditions.append("category = ?")
+            params.append(category)
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date < date(?, '+1 day')")
+            params.append(date_to)
+
+        # Ключ предыдущей страницы отсекает просмотренное, поэтому стоимость не зависит от номера страницы
+        if after:
+            conditions.append("(date, id) > (?, ?)")
+            params.extend(after)
+            order = "ASC"
+        else:
+            if before:
+                conditions.append("(date, id) < (?, ?)")
+                params.extend(before)
+            order = "DESC"
+
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            c.execute(f"""SELECT id, date, type, amount, category, description
+                          FROM transactions
+                          WHERE {' AND '.join(conditions)}
+                          ORDER BY date {order}, id {order}
+                          LIMIT ?""", params + [limit + 1])
+            rows = c.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after:
+            rows.reverse()
+        return rows, has_more
 
+    @staticmethod
+    def get_category_stats(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> dict:
         now = datetime.now()
         query_year = year or now.year
         query_month = month or now.month
 
-        # Get income by category
-        c.execute("""SELECT category, SUM(amount)
-                     FROM transactions
-                     WHERE user_id = ? AND type = 'income'
-                     AND strftime('%Y', date) = ? AND strftime('%m', date) = ?
-                     GROUP BY category""",
-                  (user_id, str(query_year), f"{query_month:02d}"))
-        income_by_category = dict(c.fetchall())
-
-        # Get expenses by category
-        c.execute("""SELECT category, SUM(amount)
-                     FROM transactions
-                     WHERE user_id = ? AND type = 'expense'
-                     AND strftime('%Y', date) = ? AND strftime('%m', date) = ?
-                     GROUP BY category""",
-                  (user_id, str(query_year), f"{query_month:02d}"))
-        expense_by_category = dict(c.fetchall())
-
-        conn.close()
+        income_by_category = {}
+        expense_by_category = {}
+
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+
+            # Доходы и расходы по категориям одним запросом по индексу (user_id, year_month)
+            c.execute("""SELECT type, category, SUM(amount)
+                         FROM transactions
+                         WHERE user_id = ? AND year_month = ?
+                         GROUP BY type, category""",
+                      (user_id, query_year * 100 + query_month))
+            for typ, category, total in c.fetchall():
+                if typ == 'income':
+                    income_by_category[category] = total
+                else:
+                    expense_by_category[category] = total
+
         return {
             'income_by_category': income_by_category,
             'expense_by_category': expense_by_category
         }
 
+    @staticmethod
+    def get_period_stats(user_id: int, date_from: date, date_to: date) -> dict:
+        """Доходы и расходы по категориям за произвольный отрезок дат включительно.
+
+        Читает агрегаты category_rollups: целые годы, затем месяцы, затем дни,
+        поэтому число прочитанных строк не зависит от числа транзакций.
+        """
+        with get_db_connection(user_id) as conn:
+            return rollups.read_period(conn.cursor(), "r.user_id = ?", [user_id], date_from, date_to)
+
     @staticmethod
     def add_category(category: Category) -> None:
         """Добавление новой категории."""
-        conn = get_db_connection()
-        c = conn.cursor()
+        with get_db_connection(category.user_id) as conn:
+            c = conn.cursor()
 
-        table = 'income_categories' if category.type == 'income' else 'expense_categories'
-        c.execute(f"INSERT INTO {table} (user_id, name) VALUES (?, ?)", 
-                 (category.user_id, category.name))
+            table = 'income_categories' if category.type == 'income' else 'expense_categories'
+            c.execute(f"INSERT OR IGNORE INTO {table} (user_id, name) VALUES (?, ?)", 
+                     (category.user_id, category.name))
 
-        conn.commit()
-        conn.close()
+            conn.commit()
+        category_cache.invalidate(category.user_id, category.type)
 
     @staticmethod
     def get_categories(user_id: int, category_type: str) -> List[str]:
         """Получение списка категорий пользователя."""
-        conn = get_db_connection()
-        c = conn.cursor()
-
-        table = 'income_categories' if category_type == 'income' else 'expense_categories'
-        c.execute(f"SELECT name FROM {table} WHERE user_id = ?", (user_id,))
-        
-        categories = [row[0] for row in c.fetchall()]
-        conn.close()
+        categories = category_cache.get(user_id, category_type)
+        if categories is None:
+            categories = TransactionService.load_categories(user_id, category_type)
+        return categories
+
+    @staticmethod
+    def load_categories(user_id: int, category_type: str) -> List[str]:
+        """Чтение категорий из базы в обход кэша с последующим сохранением в кэш."""
+        version = category_cache.version
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+
+            table = 'income_categories' if category_type == 'income' else 'expense_categories'
+            c.execute(f"SELECT name FROM {table} WHERE user_id = ?", (user_id,))
+
+            categories = [row[0] for row in c.fetchall()]
+        category_cache.put(user_id, category_type, categories, version)
         return categories
 
     @staticmethod
     def delete_category(user_id: int, category_name: str, category_type: str) -> bool:
         """Удаление категории."""
-        conn = get_db_connection()
-        c = conn.cursor()
-
-        table = 'income_categories' if category_type == 'income' else 'expense_categories'
-        c.execute(f"DELETE FROM {table} WHERE user_id = ? AND name = ?", 
-                 (user_id, category_name))
-        
-        success = c.rowcount > 0
-        conn.commit()
-        conn.close()
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+
+            table = 'income_categories' if category_type == 'income' else 'expense_categories'
+            c.execute(f"DELETE FROM {table} WHERE user_id = ? AND name = ?", 
+                     (user_id, category_name))
+
+            success = c.rowcount > 0
+            conn.commit()
+        category_cache.invalidate(user_id, category_type)
         return success
 
     @staticmethod
     def clear_transactions(user_id: int, transaction_type: Optional[str] = None) -> None:
         """Очистка транзакций пользователя."""
-        conn = get_db_connection()
-        c = conn.cursor()
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
+            TransactionService._subtract_from_family(c, user_id, transaction_type)
 
-        if transaction_type:
-            c.execute("DELETE FROM transactions WHERE user_id = ? AND type = ?", 
-                     (user_id, transaction_type))
-        else:
-            c.execute("DELETE FROM transactions WHERE user_id = ?", (user_id,))
+            if transaction_type:
+                c.execute("DELETE FROM transactions WHERE user_id = ? AND type = ?", 
+                         (user_id, transaction_type))
+                column = 'total_income' if transaction_type == 'income' else 'total_expense'
+                c.execute(f"UPDATE user_balances SET {column} = 0 WHERE user_id = ?", (user_id,))
+                # Суммы другого типа в статистике по месяцам остаются как были
+                c.execute(f"UPDATE monthly_stats SET {column} = 0 WHERE user_id = ?", (user_id,))
+                c.execute("""DELETE FROM monthly_stats
+                             WHERE user_id = ? AND total_income = 0 AND total_expense = 0""", (user_id,))
+                c.execute("DELETE FROM category_rollups WHERE user_id = ? AND type = ?",
+                          (user_id, transaction_type))
+            else:
+                c.execute("DELETE FROM transactions WHERE user_id = ?", (user_id,))
+                c.execute("DELETE FROM user_balances WHERE user_id = ?", (user_id,))
+                c.execute("DELETE FROM monthly_stats WHERE user_id = ?", (user_id,))
+                c.execute("DELETE FROM category_rollups WHERE user_id = ?", (user_id,))
 
-        # Обновляем статистику
-        c.execute("DELETE FROM monthly_stats WHERE user_id = ?", (user_id,))
-        
-        conn.commit()
-        conn.close()
+            conn.commit()
+        analytics_cache.invalidate(user_id)
 
     @staticmethod
     def clear_categories(user_id: int, category_type: Optional[str] = None) -> None:
         """Очистка категорий пользователя."""
-        conn = get_db_connection()
-        c = conn.cursor()
+        with get_db_connection(user_id) as conn:
+            c = conn.cursor()
 
-        if category_type:
-            table = 'income_categories' if category_type == 'income' else 'expense_categories'
-            c.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
-        else:
-            c.execute("DELETE FROM income_categories WHERE user_id = ?", (user_id,))
-            c.execute("DELETE FROM expense_categories WHERE user_id = ?", (user_id,))
-        
-        conn.commit()
-        conn.close() 
\ No newline at end of file
+            if category_type:
+                table = 'income_categories' if category_type == 'income' else 'expense_categories'
+                c.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            else:
+                c.execute("DELETE FROM income_categories WHERE user_id = ?", (user_id,))
+                c.execute("DELETE FROM expense_categories WHERE user_id = ?", (user_id,))
+
+            conn.commit()
+        category_cache.invalidate(user_id, category_type)
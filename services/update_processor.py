@@ -0,0 +1,103 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Dict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько апдейтов обрабатывается одновременно (1 - по одному, как раньше)
+UPDATES_CONCURRENCY = int(os.getenv('UPDATES_CONCURRENCY', '1'))
+# Сколько апдейтов может быть принято и еще не обработано; дальше прием ждет
+UPDATES_MAX_PENDING = int(os.getenv('UPDATES_MAX_PENDING', '256'))
+
+
+def _chat_key(update: object):
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных чатов с порядком внутри чата.
+
+    Application запускает задачу на каждый апдейт сразу. Апдейты одного чата
+    ждут друг друга на замке чата (asyncio.Lock будит ожидающих по очереди),
+    поэтому ConversationHandler видит их в порядке поступления. Обработчиков
+    одновременно выполняется не больше concurrency, а принятых, но еще не
+    обработанных апдейтов - не больше max_pending: место под апдейт занимает
+    PendingUpdateQueue.put, а освобождает конец его обработки.
+    """
+
+    def __init__(self, concurrency: int = UPDATES_CONCURRENCY, max_pending: int = UPDATES_MAX_PENDING):
+        super().__init__(max(max_pending, concurrency, 2))
+        self.concurrency = concurrency
+        self._active = None
+        self._chat_locks: Dict[Any, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Any, int] = {}
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self.pending = 0
+
+    async def initialize(self) -> None:
+        self._active = asyncio.Semaphore(self.concurrency)
+        # Сигнал остановки Application тоже проходит через put и занимает место
+        self.pending = 0
+        self._capacity.set()
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def reserve(self) -> None:
+        """Ждет, пока число необработанных апдейтов не опустится ниже лимита, и занимает место."""
+        while self.pending >= self.max_concurrent_updates:
+            await self._capacity.wait()
+        self.pending += 1
+        if self.pending >= self.max_concurrent_updates:
+            self._capacity.clear()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _chat_key(update)
+        try:
+            if key is None:
+                async with self._active:
+                    await coroutine
+                return
+
+            lock = self._chat_locks.get(key)
+            if lock is None:
+                lock = self._chat_locks[key] = asyncio.Lock()
+            self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+            try:
+                async with lock:
+                    async with self._active:
+                        await coroutine
+            finally:
+                self._chat_waiters[key] -= 1
+                if not self._chat_waiters[key]:
+                    # Замки нужны только чатам с апдейтами в работе
+                    del self._chat_waiters[key]
+                    del self._chat_locks[key]
+        finally:
+            self.pending -= 1
+            if self.pending < self.max_concurrent_updates:
+                self._capacity.set()
+
+
+class PendingUpdateQueue(asyncio.Queue):
+    """update_queue Application, которая не принимает апдейтов сверх лимита processor.
+
+    Application забирает апдейты из очереди сразу и запускает на каждый задачу,
+    поэтому ограничивать нужно прием: put ждет свободного места и при поллинге
+    (Updater не запрашивает новые апдейты), и в вебхуке (Telegram ждет ответа).
+    """
+
+    def __init__(self, processor: ChatOrderedUpdateProcessor):
+        super().__init__()
+        self.processor = processor
+
+    async def put(self, item: object) -> None:
+        await self.processor.reserve()
+        await super().put(item)
@@ -0,0 +1,104 @@
+import asyncio
+import hmac
+import json
+import os
+
+from telegram import Update
+
+# Вебхук включается указанием полного публичного адреса, который вызывает Telegram;
+# прокси перед ботом переадресует его на WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# Локальный адрес HTTP-сервера; TLS обычно завершает обратный прокси перед ним
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Сколько соединений Telegram держит к вебхуку одновременно (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+MAX_BODY_SIZE = 1 << 20
+
+enabled = bool(WEBHOOK_URL)
+
+_REASONS = {200: b'OK', 400: b'Bad Request', 403: b'Forbidden', 404: b'Not Found',
+            405: b'Method Not Allowed', 413: b'Payload Too Large'}
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий апдейты Telegram и кладущий их в update_queue.
+
+    Ответ 200 уходит только после того, как update_queue приняла апдейт
+    (PendingUpdateQueue ждет свободного места): пока бот не справляется,
+    Telegram ждет ответа и не шлет новых апдейтов сверх WEBHOOK_MAX_CONNECTIONS,
+    а не копит их в памяти процесса.
+    """
+
+    def __init__(self, application, host: str = WEBHOOK_LISTEN,
+                 port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path.encode()
+        self.secret = secret.encode()
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"Webhook listening on http://{self.host}:{self.port}{self.path.decode()}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # Telegram переиспользует соединения, поэтому запросы читаются в цикле
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.partition(b':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get(b'content-length', b'0') or 0)
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status = await self._handle_request(request_line.split(), headers, body)
+                keep_alive = headers.get(b'connection', b'').lower() != b'close'
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request: list, headers: dict, body: bytes) -> int:
+        if len(request) < 2 or request[1].split(b'?')[0] != self.path:
+            return 404
+        if request[0] != b'POST':
+            return 405
+        if self.secret and not hmac.compare_digest(
+                headers.get(b'x-telegram-bot-api-secret-token', b''), self.secret):
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        await self.application.update_queue.put(update)
+        return 200
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool = True) -> None:
+        writer.write(b'HTTP/1.1 ' + str(status).encode() + b' ' + _REASONS[status] + b'\r\n'
+                     b'Content-Length: 0\r\n'
+                     b'Connection: ' + (b'keep-alive' if keep_alive else b'close') + b'\r\n\r\n')
+        await writer.drain()
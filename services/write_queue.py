@@ -0,0 +1,85 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, List, Optional
+from models.transaction import Transaction
+
+
+class WriteBehindQueue:
+    """Очередь группового коммита для новых транзакций.
+
+    Транзакции разных пользователей копятся несколько миллисекунд и
+    записываются одной пачкой. submit() возвращает управление только после
+    того, как пачка зафиксирована в базе.
+
+    Если задан group_key, пачка делится на группы (например, по шардам),
+    которые записываются параллельно и независимо: ошибку одной группы
+    получают только ее транзакции, остальные уже зафиксированы.
+    """
+
+    def __init__(self, flush: Callable[[List[Transaction]], Awaitable[None]],
+                 flush_interval: float = 0.005, batch_size: int = 500,
+                 group_key: Optional[Callable[[Transaction], Hashable]] = None):
+        self._flush = flush
+        self._group_key = group_key
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, transaction: Transaction) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((transaction, future))
+        await future
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Если очередь еще не набрала полную пачку, даем ей немного накопиться
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.flush_interval)
+            stop = self._drain_into(batch)
+            await self._commit(batch)
+            if stop:
+                return
+
+    def _drain_into(self, batch: list) -> bool:
+        """Добирает элементы из очереди; возвращает True, если встретился сигнал остановки."""
+        while len(batch) < self.batch_size and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                # Записываем и то, что успели добавить после сигнала остановки
+                while not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                return True
+            batch.append(item)
+        return False
+
+    async def _commit(self, batch: list) -> None:
+        groups = {}
+        for item in batch:
+            key = self._group_key(item[0]) if self._group_key else None
+            groups.setdefault(key, []).append(item)
+        groups = list(groups.values())
+        results = await asyncio.gather(*(self._flush([transaction for transaction, _ in group])
+                                         for group in groups), return_exceptions=True)
+        for group, result in zip(groups, results):
+            for _, future in group:
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(None)
+
+    async def close(self) -> None:
+        """Дописывает все, что осталось в очереди, и останавливает фоновую задачу."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
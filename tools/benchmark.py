@@ -0,0 +1,299 @@
+"""Бенчмарк методов TransactionService на синтетических данных.
+
+Сначала генерируется база с заданным числом пользователей и транзакций,
+затем каждый метод сервиса вызывается много раз на случайных пользователях,
+а задержки (p50/p95/p99) сохраняются в JSON. Замеры идут на временной
+копии базы, так что каждый запуск видит одни и те же данные. Режим сравнения отмечает
+методы, которые стали медленнее сохраненного базового результата.
+
+Примеры:
+    python -m tools.benchmark generate --db bench.db --users 10000 --transactions 10000000
+    python -m tools.benchmark run --db bench.db --output bench.json
+    python -m tools.benchmark run --db bench.db --output new.json --baseline bench.json
+    python -m tools.benchmark compare bench.json new.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from database.db import configure_pool, connect, init_db
+from models.transaction import Transaction, Category
+from services import rollups
+from services.category_cache import category_cache
+from services.transaction_service import TransactionService
+
+INCOME_CATEGORIES = ['Зарплата', 'Премия', 'Фриланс', 'Проценты', 'Подарки']
+EXPENSE_CATEGORIES = ['Еда', 'Транспорт', 'Жилье', 'Связь', 'Здоровье', 'Одежда', 'Кафе',
+                      'Развлечения', 'Подписки', 'Путешествия', 'Образование', 'Спорт',
+                      'Дом', 'Техника', 'Налоги']
+CHUNK_SIZE = 50000
+
+
+def generate(path: str, users: int, transactions: int, years: int, seed: int) -> None:
+    """Создает синтетическую базу: пользователи с неравномерной активностью за несколько лет."""
+    if os.path.exists(path):
+        os.remove(path)
+    configure_pool(path, size=1, shards=1)
+    init_db()
+
+    rng = random.Random(seed)
+    now = int(time.time())
+    start = now - years * 365 * 24 * 3600
+
+    # Активность пользователей сильно различается: немного "тяжелых", много "легких"
+    weights = [rng.paretovariate(1.2) for _ in range(users)]
+    scale = transactions / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    counts[0] += transactions - sum(counts)
+
+    conn = connect(path)
+    c = conn.cursor()
+    started = time.perf_counter()
+
+    c.executemany("INSERT INTO income_categories (user_id, name) VALUES (?, ?)",
+                  [(user_id, name) for user_id in range(1, users + 1) for name in INCOME_CATEGORIES])
+    c.executemany("INSERT INTO expense_categories (user_id, name) VALUES (?, ?)",
+                  [(user_id, name) for user_id in range(1, users + 1) for name in EXPENSE_CATEGORIES])
+
+    rows = []
+    inserted = 0
+    for user_id, count in enumerate(counts, start=1):
+        for ts in sorted(rng.randrange(start, now) for _ in range(count)):
+            day = time.gmtime(ts)
+            if rng.random() < 0.15:
+                typ, category = 'income', rng.choice(INCOME_CATEGORIES)
+                amount = rng.randrange(1000_00, 150000_00)
+            else:
+                typ, category = 'expense', rng.choice(EXPENSE_CATEGORIES)
+                amount = rng.randrange(50_00, 15000_00)
+            rows.append((user_id, typ, amount, category, None,
+                         time.strftime('%Y-%m-%d %H:%M:%S', day),
+                         day.tm_year * 100 + day.tm_mon))
+        if len(rows) >= CHUNK_SIZE:
+            inserted += _insert_chunk(c, rows)
+            print(f"\r{inserted}/{transactions} transactions", end='', flush=True)
+    inserted += _insert_chunk(c, rows)
+
+    # Агрегаты пересчитываются одним проходом по готовым данным
+    c.execute("""INSERT OR REPLACE INTO monthly_stats (user_id, year, month, total_income, total_expense)
+                 SELECT user_id, year_month / 100, year_month % 100,
+                        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+                        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+                 FROM transactions
+                 GROUP BY user_id, year_month""")
+    c.execute("""INSERT OR REPLACE INTO user_balances (user_id, total_income, total_expense)
+                 SELECT user_id,
+                        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+                        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END)
+                 FROM transactions
+                 GROUP BY user_id""")
+    rollups.rebuild(c)
+    conn.commit()
+    c.execute("ANALYZE")
+    conn.close()
+    print(f"\nGenerated {inserted} transactions for {users} users in {time.perf_counter() - started:.1f}s")
+
+
+def _insert_chunk(c: sqlite3.Cursor, rows: list) -> int:
+    c.executemany("""INSERT INTO transactions
+                     (user_id, type, amount, category, description, date, year_month)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+    count = len(rows)
+    rows.clear()
+    return count
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(func, args_factory, iterations: int) -> dict:
+    timings = []
+    for _ in range(iterations):
+        args = args_factory()
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': timings[-1],
+    }
+
+
+def run(path: str, iterations: int, seed: int) -> dict:
+    """Замеряет методы на копии базы: пишущие методы не меняют данные следующего запуска."""
+    # Копия рядом с исходной базой: /tmp может быть меньше синтетической базы
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp:
+        copy = os.path.join(tmp, os.path.basename(path))
+        source = sqlite3.connect(path)
+        target = sqlite3.connect(copy)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        pool = configure_pool(copy, size=1, shards=1)
+        try:
+            return _run_cases(copy, iterations, seed)
+        finally:
+            pool.close()
+
+
+def _run_cases(path: str, iterations: int, seed: int) -> dict:
+    init_db()
+    conn = connect(path)
+    users = conn.execute("SELECT MAX(user_id) FROM user_balances").fetchone()[0] or 0
+    transactions = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    first_month, last_month = conn.execute(
+        "SELECT MIN(year_month), MAX(year_month) FROM transactions").fetchone()
+    conn.close()
+    if not users:
+        raise SystemExit(f"{path} has no data, run the generate command first")
+
+    rng = random.Random(seed)
+    months = [ym for ym in range(first_month, last_month + 1) if 1 <= ym % 100 <= 12]
+
+    def user():
+        return rng.randint(1, users)
+
+    def month():
+        ym = rng.choice(months)
+        return ym // 100, ym % 100
+
+    def new_transaction():
+        return Transaction(user_id=user(), type=rng.choice(['income', 'expense']),
+                           amount=rng.randrange(10_00, 5000_00), category=rng.choice(EXPENSE_CATEGORIES))
+
+    def uncached_categories(user_id, category_type):
+        category_cache.invalidate(user_id, category_type)
+        return TransactionService.get_categories(user_id, category_type)
+
+    # Разрушающие операции идут последними и на отдельных пользователях
+    cleared_users = iter(range(users, 0, -1))
+
+    cases = [
+        ('get_balance', TransactionService.get_balance, lambda: (user(),)),
+        ('get_monthly_stats', TransactionService.get_monthly_stats, lambda: (user(), *month())),
+        ('get_category_stats', TransactionService.get_category_stats, lambda: (user(), *month())),
+        ('get_period_stats_365d', TransactionService.get_period_stats,
+         lambda: (user(), date.today() - timedelta(days=364), date.today())),
+        ('get_transactions_by_category', TransactionService.get_transactions_by_category,
+         lambda: (user(), rng.choice(EXPENSE_CATEGORIES), 'expense')),
+        ('get_categories', uncached_categories, lambda: (user(), rng.choice(['income', 'expense']))),
+        ('get_categories_cached', TransactionService.get_categories, lambda: (1, 'expense')),
+        ('add_transaction', TransactionService.add_transaction, lambda: (new_transaction(),)),
+        ('add_transactions_x100', TransactionService.add_transactions,
+         lambda: ([new_transaction() for _ in range(100)],)),
+        ('add_category', TransactionService.add_category,
+         lambda: (Category(user_id=user(), name=f"Новая {rng.randrange(10 ** 6)}", type='expense'),)),
+        ('delete_category', TransactionService.delete_category,
+         lambda: (user(), rng.choice(EXPENSE_CATEGORIES), 'expense')),
+        ('clear_transactions', TransactionService.clear_transactions, lambda: (next(cleared_users), 'expense')),
+        ('clear_categories', TransactionService.clear_categories, lambda: (next(cleared_users),)),
+    ]
+
+    results = {}
+    for name, func, args_factory in cases:
+        count = min(iterations, users // 4) if name.startswith('clear_') else iterations
+        results[name] = measure(func, args_factory, count)
+        r = results[name]
+        print(f"{name:32} p50={r['p50_ms']:8.3f}ms p95={r['p95_ms']:8.3f}ms p99={r['p99_ms']:8.3f}ms")
+
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'users': users,
+            'transactions': transactions,
+            'iterations': iterations,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Возвращает список регрессий: метод, метрика, базовое и текущее значение."""
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def report_regressions(baseline: dict, current: dict, threshold: float) -> int:
+    regressions = compare(baseline, current, threshold)
+    for name, metric, base, value in regressions:
+        print(f"REGRESSION {name} {metric}: {base:.3f}ms -> {value:.3f}ms (+{(value / base - 1) * 100:.0f}%)")
+    print(f"{len(regressions)} regressions over {threshold * 100:.0f}% threshold")
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='создать синтетическую базу')
+    gen.add_argument('--db', default='bench.db')
+    gen.add_argument('--users', type=int, default=10000)
+    gen.add_argument('--transactions', type=int, default=1000000)
+    gen.add_argument('--years', type=int, default=3)
+    gen.add_argument('--seed', type=int, default=42)
+
+    bench = commands.add_parser('run', help='замерить методы сервиса')
+    bench.add_argument('--db', default='bench.db')
+    bench.add_argument('--iterations', type=int, default=1000)
+    bench.add_argument('--seed', type=int, default=42)
+    bench.add_argument('--output', default='bench.json')
+    bench.add_argument('--baseline', help='сравнить с сохраненным результатом')
+    bench.add_argument('--threshold', type=float, default=0.2)
+
+    cmp = commands.add_parser('compare', help='сравнить два результата')
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.add_argument('--threshold', type=float, default=0.2)
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate(args.db, args.users, args.transactions, args.years, args.seed)
+        return 0
+
+    if args.command == 'run':
+        result = run(args.db, args.iterations, args.seed)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+        if args.baseline:
+            with open(args.baseline) as f:
+                return report_regressions(json.load(f), result, args.threshold)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return report_regressions(baseline, current, args.threshold)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
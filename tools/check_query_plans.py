@@ -0,0 +1,134 @@
+"""Проверка планов запросов сервисов, аналитики, повторяющихся операций и хранилища диалогов.
+
+Вызывает каждый метод сервиса на временной базе с актуальной схемой,
+перехватывает выполненные SQL-запросы и прогоняет их через
+EXPLAIN QUERY PLAN. Завершается с кодом 1, если хоть один запрос
+читает таблицу полным сканированием (SCAN) или страница с LIMIT
+сортируется во временном B-дереве, то есть читает все подходящие строки.
+
+Запуск: python -m tools.check_query_plans
+"""
+import os
+import pickle
+import re
+import sys
+import tempfile
+from datetime import date
+
+from database.db import configure_pool, init_db, get_db_connection
+from models.transaction import Transaction, Category, RecurringRule
+from services.analytics import TransactionAnalytics
+from services.family_service import FamilyService
+from services.persistence import load_user_state, save_state
+from services.recurring_service import RecurringService
+from services.transaction_service import TransactionService
+
+# Полное чтение таблицы; SCAN по VALUES, CTE и подзапросам не в счет
+SCAN_RE = re.compile(r'\bSCAN (\w+)')
+# Сортировка страницы в памяти: стоимость растет со всей историей пользователя
+SORT_RE = re.compile(r'USE TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY')
+PAGE_RE = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+# Запросы, которые читают данные и для которых важен план
+PLANNED_RE = re.compile(r'^\s*(SELECT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+
+
+def exercise_service(user_id: int = 1) -> None:
+    """Вызывает все методы сервиса, чтобы собрать выполняемые запросы."""
+    TransactionService.add_category(Category(user_id=user_id, name='Зарплата', type='income'))
+    TransactionService.add_category(Category(user_id=user_id, name='Еда', type='expense'))
+    TransactionService.add_transaction(Transaction(user_id=user_id, type='income', amount=10000, category='Зарплата'))
+    TransactionService.add_transaction(Transaction(user_id=user_id, type='expense', amount=4000, category='Еда'))
+    TransactionService.get_balance(user_id)
+    TransactionService.get_monthly_stats(user_id)
+    TransactionService.get_category_stats(user_id)
+    TransactionService.get_period_stats(user_id, date(2023, 11, 15), date(2025, 2, 10))
+    TransactionService.get_monthly_trend(user_id)
+    TransactionAnalytics.get_insights(user_id)
+    rule_id = RecurringService.add_rule(RecurringRule(user_id=user_id, type='expense', amount=499, category='Еда',
+                                                      unit='month', count=1, next_due='2024-01-31', anchor_day=31))
+    RecurringService.post_due(date(2024, 3, 1))
+    RecurringService.get_rules(user_id)
+    RecurringService.delete_rule(user_id, rule_id)
+    TransactionService.get_transactions_by_category(user_id, 'Еда', 'expense')
+    TransactionService.get_categories(user_id, 'income')
+    list(TransactionService.iter_transactions(user_id))
+    rows, _ = TransactionService.get_transactions_page(user_id, limit=1)
+    key = (rows[0][1], rows[0][0])
+    TransactionService.get_transactions_page(user_id, before=key)
+    TransactionService.get_transactions_page(user_id, after=key, transaction_type='expense')
+    TransactionService.get_transactions_page(user_id, transaction_type='expense', category='Еда',
+                                             date_from='2020-01-01', date_to='2030-12-31')
+    TransactionService.get_transactions_page(user_id, category='Еда')
+    TransactionService.get_transactions_page(user_id, before=key, category='Еда')
+    family = FamilyService.create_family(user_id)
+    FamilyService.join_family(user_id + 1, family.invite_code)
+    TransactionService.add_transaction(Transaction(user_id=user_id + 1, type='expense', amount=1000, category='Еда'))
+    FamilyService.get_family_id(user_id)
+    FamilyService.get_family(family.family_id)
+    FamilyService.family_exists(family.family_id)
+    FamilyService.forget_missing_family(user_id + 1, family.family_id)
+    FamilyService.get_family_balance(family.family_id)
+    FamilyService.get_family_monthly_stats(family.family_id)
+    FamilyService.get_family_period_stats(family.family_id, date(2023, 11, 15), date(2025, 2, 10))
+    FamilyService.leave_family(user_id + 1)
+    TransactionService.reconcile_balances(user_id=user_id)
+    TransactionService.reconcile_monthly_stats(user_id=user_id)
+    TransactionService.delete_category(user_id, 'Еда', 'expense')
+    TransactionService.clear_transactions(user_id, 'income')
+    TransactionService.clear_transactions(user_id)
+    TransactionService.clear_categories(user_id, 'income')
+    TransactionService.clear_categories(user_id)
+    save_state({user_id: pickle.dumps({'amount': 100})},
+               {(user_id, 'transaction', f'[{user_id}, {user_id}]'): pickle.dumps(0)})
+    load_user_state(user_id)
+    save_state({user_id: None}, {(user_id, 'transaction', f'[{user_id}, {user_id}]'): None})
+
+
+def collect_plans() -> tuple:
+    """Возвращает список (sql, [строки плана]) для всех запросов сервиса и имена таблиц."""
+    statements = []
+    with get_db_connection() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        exercise_service()
+    finally:
+        with get_db_connection() as conn:
+            conn.set_trace_callback(None)
+
+    plans = []
+    seen = set()
+    with get_db_connection() as conn:
+        for sql in statements:
+            sql = ' '.join(sql.split())
+            if not PLANNED_RE.match(sql) or sql in seen:
+                continue
+            seen.add(sql)
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            plans.append((sql, [row[3] for row in rows]))
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return plans, tables
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        # Один поток - одно соединение, на котором и включена трассировка
+        pool = configure_pool(os.path.join(tmp, 'plans.db'), size=1, shards=1)
+        init_db()
+        plans, tables = collect_plans()
+        pool.close()
+
+    failed = 0
+    for sql, details in plans:
+        scans = [d for d in details if any(name in tables for name in SCAN_RE.findall(d))
+                 or (PAGE_RE.search(sql) and SORT_RE.search(d))]
+        status = 'FAIL' if scans else 'ok'
+        failed += bool(scans)
+        print(f"[{status}] {sql}")
+        for detail in details:
+            print(f"       {detail}")
+    print(f"\n{len(plans)} queries checked, {failed} with full scans or sorted pages")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""Нагрузочный тест бота целиком: от входящего апдейта до ответа.
+
+Собирает настоящее Application со всеми хендлерами из get_handlers(),
+но вместо Telegram Bot API подключает локальную заглушку в том же процессе.
+Тысячи виртуальных пользователей параллельно проходят типичные сценарии
+("➕ Доход → сумма → категория", "📊 Статистика" и т.д.), а в конце
+выводятся апдейты в секунду, задержки по шагам диалога и лаг event loop.
+
+Пример:
+    python -m tools.loadgen --users 2000 --flows 10 --concurrent-updates 64
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+from database.db import configure_pool, init_db
+from handlers.transaction_handlers import get_handlers
+from services.persistence import SQLitePersistence
+from services.update_processor import ChatOrderedUpdateProcessor, PendingUpdateQueue
+
+
+class FakeBotAPI(BaseRequest):
+    """Заглушка Bot API: отвечает сразу (или с заданной задержкой) и сообщает о доставленных ответах."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = defaultdict(int)
+        self._waiters = {}
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id] = future
+        return future
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.requests[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Budget Bot', 'username': 'budget_bot'}
+        elif 'chat_id' in params:
+            chat_id = int(params['chat_id'])
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+            future = self._waiters.pop(chat_id, None)
+            if future is not None and not future.done():
+                future.set_result(params.get('text', ''))
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class LoadGenerator:
+    def __init__(self, application: Application, api: FakeBotAPI, timeout: float):
+        self.application = application
+        self.api = api
+        self.timeout = timeout
+        self.latencies = defaultdict(list)
+        self.errors = 0
+        self.updates = 0
+        self._ids = itertools.count(1)
+
+    def _make_update(self, user_id: int, text: str) -> Update:
+        message = {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': next(self._ids), 'message': message}, self.application.bot)
+
+    async def send(self, user_id: int, state: str, text: str) -> None:
+        """Отправляет апдейт и ждет ответа бота; задержка учитывается по состоянию диалога."""
+        reply = self.api.expect_reply(user_id)
+        started = time.perf_counter()
+        await self.application.update_queue.put(self._make_update(user_id, text))
+        self.updates += 1
+        try:
+            await asyncio.wait_for(reply, self.timeout)
+        except asyncio.TimeoutError:
+            self.errors += 1
+            return
+        self.latencies[state].append(time.perf_counter() - started)
+
+    async def run_user(self, user_id: int, flows: int, rng: random.Random) -> None:
+        # Первичная настройка: команда /start и по одной категории каждого типа
+        await self.send(user_id, 'start', '/start')
+        await self.send(user_id, 'entry', '➕ Добавить категорию доходов')
+        await self.send(user_id, 'ADD_INCOME_CATEGORY', 'Зарплата')
+        await self.send(user_id, 'entry', '➕ Добавить категорию расходов')
+        await self.send(user_id, 'ADD_EXPENSE_CATEGORY', 'Еда')
+
+        for _ in range(flows):
+            flow = rng.choices(['income', 'expense', 'balance', 'stats', 'categories'],
+                               weights=[1, 4, 3, 2, 1])[0]
+            if flow == 'income':
+                await self.send(user_id, 'entry', '➕ Доход')
+                await self.send(user_id, 'GET_AMOUNT', str(rng.randint(1000, 100000)))
+                await self.send(user_id, 'GET_CATEGORY', 'Зарплата')
+            elif flow == 'expense':
+                await self.send(user_id, 'entry', '➖ Расход')
+                await self.send(user_id, 'GET_AMOUNT', f"{rng.uniform(10, 5000):.2f}")
+                await self.send(user_id, 'GET_CATEGORY', 'Еда')
+            elif flow == 'balance':
+                await self.send(user_id, 'balance', '💰 Баланс')
+            elif flow == 'stats':
+                await self.send(user_id, 'stats', '📊 Статистика')
+            else:
+                await self.send(user_id, 'entry', '📋 Показать все категории')
+
+
+async def sample_loop_lag(samples: list, interval: float, stop: asyncio.Event) -> None:
+    """Меряет, насколько позже запланированного просыпается event loop."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+def _percentiles(values: list) -> str:
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+    return f"p50={pick(50):8.2f}ms p95={pick(95):8.2f}ms p99={pick(99):8.2f}ms max={values[-1] * 1000:8.2f}ms"
+
+
+async def run(args) -> int:
+    api = FakeBotAPI(args.api_latency / 1000)
+    # Тот же обработчик, что и у бота: параллельно по чатам, по порядку внутри чата
+    processor = ChatOrderedUpdateProcessor(args.concurrent_updates) if args.concurrent_updates > 1 else False
+    persistence = SQLitePersistence()
+    application = (
+        Application.builder()
+        .token('123456:LOADTEST')
+        .request(api)
+        .get_updates_request(FakeBotAPI())
+        .update_queue(PendingUpdateQueue(processor) if processor else asyncio.Queue())
+        .concurrent_updates(processor)
+        .persistence(persistence)
+        .build()
+    )
+    application.add_handler(persistence.loader_handler(), group=-1)
+    for handler in get_handlers():
+        application.add_handler(handler)
+
+    generator = LoadGenerator(application, api, args.timeout)
+    rng = random.Random(args.seed)
+    lag_samples = []
+    stop = asyncio.Event()
+
+    await application.initialize()
+    await application.start()
+    sampler = asyncio.create_task(sample_loop_lag(lag_samples, 0.01, stop))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        generator.run_user(user_id, args.flows, random.Random(rng.random()))
+        for user_id in range(1, args.users + 1)
+    ])
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await sampler
+    await application.stop()
+    await application.shutdown()
+
+    print(f"{generator.updates} updates from {args.users} users in {elapsed:.2f}s: "
+          f"{generator.updates / elapsed:.0f} updates/s, {generator.errors} timeouts")
+    print("\nLatency by conversation state (update in -> reply out):")
+    for state, values in sorted(generator.latencies.items()):
+        print(f"  {state:22} n={len(values):7} {_percentiles(values)}")
+    if lag_samples:
+        print(f"\nEvent loop lag:          n={len(lag_samples):7} {_percentiles(lag_samples)}")
+    print(f"\nBot API calls: {dict(api.requests)}")
+    return 1 if generator.errors else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--flows', type=int, default=10, help='сценариев на пользователя')
+    parser.add_argument('--concurrent-updates', type=int, default=0,
+                        help='сколько апдейтов Application обрабатывает одновременно (0 - последовательно)')
+    parser.add_argument('--api-latency', type=float, default=0, help='задержка ответа Bot API, мс')
+    parser.add_argument('--timeout', type=float, default=30, help='ожидание ответа на апдейт, с')
+    parser.add_argument('--db', help='путь к базе (по умолчанию временный файл)')
+    parser.add_argument('--shards', type=int, help='число файлов-шардов (по умолчанию DB_SHARDS)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_pool(args.db or os.path.join(tmp, 'loadtest.db'), shards=args.shards)
+        init_db()
+        return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Сверка агрегатов с исходными транзакциями.
+
+Пересчитывает балансы и статистику по месяцам групповыми запросами
+и сравнивает их с таблицами user_balances и monthly_stats - для всех
+пользователей или одного (--user). С --rebuild заново строит
+monthly_stats всех пользователей короткими транзакциями по --chunk
+пользователей, не останавливая бота.
+
+Запуск: python -m tools.reconcile [--db PATH] [--user ID] [--fix] [--rebuild [--chunk N]]
+"""
+import argparse
+import sys
+import time
+
+from database.db import configure_pool, init_db
+from services.transaction_service import TransactionService
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='путь к базе (по умолчанию DB_PATH)')
+    parser.add_argument('--user', type=int, help='проверить только этого пользователя')
+    parser.add_argument('--fix', action='store_true', help='исправить найденные расхождения')
+    parser.add_argument('--rebuild', action='store_true', help='пересчитать monthly_stats всех пользователей')
+    parser.add_argument('--chunk', type=int, default=1000, help='пользователей в одной транзакции пересчета')
+    args = parser.parse_args()
+
+    if args.db:
+        configure_pool(args.db)
+    init_db()
+
+    if args.rebuild:
+        started = time.perf_counter()
+        users = TransactionService.rebuild_monthly_stats(
+            chunk_users=args.chunk, progress=lambda done: print(f"\r{done} users", end='', flush=True))
+        print(f"\rmonthly_stats rebuilt for {users} users in {time.perf_counter() - started:.1f}s")
+
+    mismatches = TransactionService.reconcile_balances(fix=args.fix, user_id=args.user)
+    for user_id, stored_income, stored_expense, income, expense in mismatches:
+        print(f"user {user_id}: stored income={stored_income} expense={stored_expense}, "
+              f"actual income={income} expense={expense}")
+    print(f"{len(mismatches)} balance mismatches{' fixed' if args.fix and mismatches else ''}")
+
+    monthly = TransactionService.reconcile_monthly_stats(fix=args.fix, user_id=args.user)
+    for user_id, year, month, stored_income, stored_expense, income, expense in monthly:
+        print(f"user {user_id} {year}-{month:02d}: stored income={stored_income} expense={stored_expense}, "
+              f"actual income={income} expense={expense}")
+    print(f"{len(monthly)} monthly_stats mismatches{' fixed' if args.fix and monthly else ''}")
+    return 1 if (mismatches or monthly) and not args.fix else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
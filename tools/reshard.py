@@ -0,0 +1,142 @@
+"""Перераспределение пользователей между файлами-шардами.
+
+Переносит данные каждого пользователя в шард, который ему назначает
+shard_index() при новом числе шардов, и пересчитывает агрегаты семей.
+Jump hash переносит только тех пользователей, чей шард изменился: при
+добавлении одного шарда к N это 1/(N+1) пользователей каждого шарда.
+Запускается при остановленном боте; после него DB_SHARDS нужно
+выставить в новое значение.
+
+Запуск: python -m tools.reshard --to N [--from M] [--db PATH]
+"""
+import argparse
+import os
+import sys
+import time
+
+from database.db import DB_PATH, DB_SHARDS, connect, shard_index, shard_path
+from database.migrations import migrate
+
+# Таблицы, строки которых принадлежат одному пользователю и переезжают вместе с ним
+USER_TABLES = ('transactions', 'monthly_stats', 'user_balances', 'category_rollups',
+               'income_categories', 'expense_categories', 'users', 'user_data', 'conversations',
+               'recurring_rules')
+
+
+def _move_users(conn, target_path: str, user_ids: list) -> None:
+    """Переносит пользователей из шарда conn в target_path одной транзакцией."""
+    conn.execute("ATTACH DATABASE ? AS dst", (target_path,))
+    try:
+        # В режиме rollback journal коммит сразу в два файла атомарен, в WAL - нет
+        conn.execute("PRAGMA dst.journal_mode=DELETE")
+        conn.execute("CREATE TEMP TABLE moving (user_id INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO moving (user_id) VALUES (?)", [(user_id,) for user_id in user_ids])
+        conn.commit()
+        moving = "user_id IN (SELECT user_id FROM moving)"
+
+        conn.execute("BEGIN IMMEDIATE")
+        # id выдаются заново: в другом файле свой счетчик. Порядок (date, id) сохраняется
+        conn.execute(f"""INSERT INTO dst.transactions
+                         (user_id, type, amount, category, description, date, year_month)
+                         SELECT user_id, type, amount, category, description, date, year_month
+                         FROM main.transactions
+                         WHERE {moving}
+                         ORDER BY user_id, date, id""")
+        # Номера правил тоже свои в каждом файле; next_due переносится как есть
+        conn.execute(f"""INSERT INTO dst.recurring_rules
+                         (user_id, type, amount, category, description, unit, count, anchor_day, next_due)
+                         SELECT user_id, type, amount, category, description, unit, count, anchor_day, next_due
+                         FROM main.recurring_rules
+                         WHERE {moving}
+                         ORDER BY rule_id""")
+        for table in ('monthly_stats', 'user_balances', 'category_rollups', 'users', 'user_data', 'conversations'):
+            conn.execute(f"INSERT OR REPLACE INTO dst.{table} SELECT * FROM main.{table} WHERE {moving}")
+        for table in ('income_categories', 'expense_categories'):
+            conn.execute(f"""INSERT OR IGNORE INTO dst.{table} (user_id, name)
+                             SELECT user_id, name FROM main.{table} WHERE {moving}""")
+        for table in USER_TABLES:
+            conn.execute(f"DELETE FROM main.{table} WHERE {moving}")
+        conn.commit()
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute("DROP TABLE IF EXISTS temp.moving")
+        conn.execute("DETACH DATABASE dst")
+
+
+def _rebuild_family_aggregates(conn) -> None:
+    """Агрегаты семей шарда - суммы по участникам, которые в нем теперь лежат."""
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("DELETE FROM family_balances")
+    conn.execute("""INSERT INTO family_balances (family_id, total_income, total_expense)
+                    SELECT u.family_id, SUM(b.total_income), SUM(b.total_expense)
+                    FROM users u
+                    JOIN user_balances b ON b.user_id = u.user_id
+                    WHERE u.family_id IS NOT NULL
+                    GROUP BY u.family_id""")
+    conn.execute("DELETE FROM family_monthly_stats")
+    conn.execute("""INSERT INTO family_monthly_stats (family_id, year, month, total_income, total_expense)
+                    SELECT u.family_id, m.year, m.month, SUM(m.total_income), SUM(m.total_expense)
+                    FROM users u
+                    JOIN monthly_stats m ON m.user_id = u.user_id
+                    WHERE u.family_id IS NOT NULL
+                    GROUP BY u.family_id, m.year, m.month""")
+    conn.commit()
+
+
+def reshard(path: str, old_shards: int, new_shards: int) -> dict:
+    """Переносит пользователей из old_shards шардов в new_shards; возвращает {шард: пользователей}."""
+    paths = [shard_path(path, index) for index in range(max(old_shards, new_shards))]
+    for shard in paths:
+        conn = connect(shard)
+        migrate(conn)
+        conn.close()
+
+    for source in range(old_shards):
+        conn = connect(paths[source])
+        conn.execute("PRAGMA journal_mode=DELETE")
+        union = ' UNION '.join(f"SELECT user_id FROM {table}" for table in USER_TABLES)
+        targets = {}
+        for (user_id,) in conn.execute(union):
+            target = shard_index(user_id, new_shards)
+            if target != source:
+                targets.setdefault(target, []).append(user_id)
+        for target, user_ids in sorted(targets.items()):
+            started = time.perf_counter()
+            _move_users(conn, paths[target], user_ids)
+            print(f"shard {source} -> {target}: {len(user_ids)} users in {time.perf_counter() - started:.1f}s")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
+    counts = {}
+    for index, shard in enumerate(paths):
+        conn = connect(shard)
+        _rebuild_family_aggregates(conn)
+        counts[index] = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT user_id FROM transactions UNION SELECT user_id FROM users)").fetchone()[0]
+        conn.close()
+    return counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DB_PATH, help='путь к шарду 0 (по умолчанию DB_PATH)')
+    parser.add_argument('--from', dest='old_shards', type=int, default=DB_SHARDS,
+                        help='текущее число шардов (по умолчанию DB_SHARDS)')
+    parser.add_argument('--to', dest='new_shards', type=int, required=True, help='новое число шардов')
+    args = parser.parse_args()
+    if args.old_shards < 1 or args.new_shards < 1:
+        parser.error('число шардов должно быть положительным')
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} не найден')
+
+    counts = reshard(args.db, args.old_shards, args.new_shards)
+    for index, users in counts.items():
+        status = '' if index < args.new_shards else ' (больше не используется, файл можно удалить)'
+        print(f"{shard_path(args.db, index)}: {users} users{status}")
+    print(f"Done. Set DB_SHARDS={args.new_shards} before starting the bot.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())